@@ -153,7 +153,7 @@ class AbstractBuildSlave(pb.Avatar, service.MultiService):
         if not self.locks:
             return True
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access):
                 return False
         return True
 
@@ -73,6 +73,20 @@ class ChangeFilter(ComparableMixin):
                 return False
         return True
 
+    def getExactValues(self):
+        """
+        Return the attribute and values of the first change attribute that
+        this filter requires to have one of a list of exact values, as
+        C{(attribute, values)}, or None if there is no such attribute.  A
+        change whose attribute has none of these values never passes the
+        filter.  This is used to index filters; see
+        L{buildbot.changes.routing.ChangeRouter}.
+        """
+        for (filt_list, filt_re, filt_fn, chg_attr) in self.checks:
+            if filt_list is not None:
+                return (chg_attr, filt_list)
+        return None
+
     def __repr__(self):
         checks = []
         for (filt_list, filt_re, filt_fn, chg_attr) in self.checks:
@@ -0,0 +1,103 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from buildbot.util import subscription
+from buildbot.process import metrics
+
+class ChangeRouter(subscription.SubscriptionPoint):
+    """
+    A subscription point for changes, which delivers each change only to the
+    subscribers whose L{ChangeFilter} might accept it.
+
+    Each filter that requires some change attribute (project, repository,
+    branch or category) to have one of a list of exact values is indexed by
+    those values, so that delivering a change only looks up the change's
+    value of each indexed attribute.  Subscribers without a filter, or whose
+    filters use only regular expressions or functions, receive every change.
+
+    The filter is not applied by the router: a subscriber is still expected
+    to check its filter, since it may receive changes that do not pass it.
+    The number of subscribers that each change is delivered to is reported in
+    the C{ChangeRouter.fanout} metric.
+    """
+
+    def __init__(self, name):
+        subscription.SubscriptionPoint.__init__(self, name)
+        # { attribute : { value : set([ subscription ]) } }
+        self.index = {}
+        # subscriptions that receive every change
+        self.unindexed = set()
+
+    def subscribe(self, callback, change_filter=None):
+        """Add C{callback} to the subscriptions, to be called with changes
+        that might pass C{change_filter}; returns a L{Subscription}
+        instance."""
+        sub = subscription.SubscriptionPoint.subscribe(self, callback)
+        sub.index_keys = self._indexKeys(change_filter)
+        if sub.index_keys is None:
+            self.unindexed.add(sub)
+        else:
+            for attr, value in sub.index_keys:
+                self.index.setdefault(attr, {}).setdefault(value,
+                                                           set()).add(sub)
+        return sub
+
+    def _indexKeys(self, change_filter):
+        if change_filter is None:
+            return None
+        exact = change_filter.getExactValues()
+        if exact is None:
+            return None
+        attr, values = exact
+        try:
+            return [ (attr, value) for value in set(values) ]
+        except TypeError:
+            return None # unhashable values can't be indexed
+
+    def _unsubscribe(self, sub):
+        subscription.SubscriptionPoint._unsubscribe(self, sub)
+        if sub.index_keys is None:
+            self.unindexed.discard(sub)
+            return
+        for attr, value in sub.index_keys:
+            subs = self.index[attr][value]
+            subs.discard(sub)
+            if not subs:
+                del self.index[attr][value]
+                if not self.index[attr]:
+                    del self.index[attr]
+
+    def getCandidates(self, change):
+        """Return the subscriptions that should receive the given change"""
+        candidates = list(self.unindexed)
+        for attr, by_value in self.index.iteritems():
+            value = getattr(change, attr, '')
+            try:
+                subs = by_value.get(value)
+            except TypeError:
+                continue # an unhashable value can't pass an exact match
+            if subs:
+                candidates.extend(subs)
+        return candidates
+
+    def deliver(self, change):
+        """
+        Deliver the given change to all of the subscribers whose filters
+        might accept it.
+        """
+        candidates = self.getCandidates(change)
+        metrics.MetricHistogramEvent.log('ChangeRouter.fanout',
+                                         len(candidates))
+        self._deliverTo(candidates, (change,), {})
@@ -44,6 +44,10 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
     datetime objects.
     """
 
+    MAX_IN_LIST = 100
+    """maximum number of build request ids to claim with a literal C{IN}
+    clause; larger sets of ids are written to a temporary table instead."""
+
     def getBuildRequest(self, brid):
         """
         Get a single BuildRequest, in the format described above.  Returns
@@ -70,7 +74,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         return self.db.pool.do(thd)
 
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-            bsid=None):
+            bsid=None, after_brid=None):
         """
         Get a list of build requests matching the given characteristics.  Note
         that C{unclaimed}, C{my_claimed}, and C{other_claimed} all default to
@@ -83,7 +87,9 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         builds claimed by this master instance.  A request is considered
         unclaimed if its C{claimed_at} column is either NULL or 0, and it is
         not complete.  If C{bsid} is specified, then only build requests for
-        that buildset will be returned.
+        that buildset will be returned.  If C{after_brid} is specified, then
+        only build requests with a larger ID will be returned; this is used to
+        find newly-added build requests without scanning the whole table.
 
         A build is considered completed if its C{complete} column is 1; the
         C{complete_at} column is not consulted.
@@ -102,6 +108,8 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
         @param bsid: see above
 
+        @param after_brid: see above
+
         @returns: List of build request dictionaries as above, via Deferred
         """
         def thd(conn):
@@ -137,11 +145,29 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     q = q.where(tbl.c.complete == 0)
             if bsid is not None:
                 q = q.where(tbl.c.buildsetid == bsid)
+            if after_brid is not None:
+                q = q.where(tbl.c.id > after_brid)
             res = conn.execute(q)
 
             return [ self._brdictFromRow(row) for row in res.fetchall() ]
         return self.db.pool.do(thd)
 
+    def getLatestBuildRequestId(self):
+        """
+        Get the most-recently-assigned build request id, or None if there are
+        no build requests at all.  Unlike L{getBuildRequests}, this reads only
+        the primary key index, so it is cheap even for a large table.
+
+        @returns: brid via Deferred
+        """
+        def thd(conn):
+            tbl = self.db.model.buildrequests
+            q = sa.select([ tbl.c.id ],
+                    order_by=sa.desc(tbl.c.id),
+                    limit=1)
+            return conn.scalar(q)
+        return self.db.pool.do(thd)
+
     def claimBuildRequests(self, brids, _reactor=reactor, _race_hook=None):
         """
         Try to "claim" the indicated build requests for this buildmaster
@@ -177,8 +203,14 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         # claimed all of the desired build requests.  This will be most
         # effective in environments with lower transactional isolation levels,
         # which may incorrectly serialize the conflicting UPDATES.
+        #
+        # The common case of a few build requests is handled with a literal IN
+        # list; larger sets are written to a temporary table first.  On
+        # Postgres, the UPDATE returns the claimed ids directly: its qualified
+        # UPDATE re-checks the WHERE clause against concurrent updates, so the
+        # post-UPDATE check is not needed there.
 
-        def alreadyClaimed(conn, tmp):
+        def alreadyClaimed(conn, ids):
             # helper function to un-claim already-claimed requests, if we can't
             # claim all of them.  This may be redundant for the finer database
             # engines, but won't hurt.
@@ -188,7 +220,7 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
             # only select *my builds* in this set of brids
             q = tbl.update()
-            q = q.where((tbl.c.id.in_(tmp.select())) &
+            q = q.where((tbl.c.id.in_(ids)) &
                 ((tbl.c.claimed_at != None) &
                  (tbl.c.claimed_by_name == master_name) &
                  (tbl.c.claimed_by_incarnation == master_incarnation)))
@@ -205,22 +237,30 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             master_name = self.db.master.master_name
             master_incarnation = self.db.master.master_incarnation
             tbl = self.db.model.buildrequests
-
-            # first, create a temporary table containing all of the ID's
-            # we want to claim
-            tmp_meta = sa.MetaData(bind=conn)
-            tmp = sa.Table('bbtmp_claim_ids', tmp_meta,
-                    sa.Column('brid', sa.Integer),
-                    prefixes=['TEMPORARY'])
-            tmp.create()
+            dialect = conn.engine.dialect.name
+
+            if len(brids) <= self.MAX_IN_LIST:
+                tmp = None
+                ids = brids
+            else:
+                # create a temporary table containing all of the ID's we want
+                # to claim
+                tmp_meta = sa.MetaData(bind=conn)
+                tmp = sa.Table('bbtmp_claim_ids', tmp_meta,
+                        sa.Column('brid', sa.Integer),
+                        prefixes=['TEMPORARY'])
+                tmp.create()
+                ids = tmp.select()
+            use_returning = tmp is None and dialect == 'postgresql'
 
             transaction = conn.begin()
 
             try:
-                q = tmp.insert()
-                conn.execute(q, [ dict(brid=id) for id in brids ])
+                if tmp is not None:
+                    q = tmp.insert()
+                    conn.execute(q, [ dict(brid=id) for id in brids ])
 
-                q = tbl.update(whereclause=(tbl.c.id.in_(tmp.select())))
+                q = tbl.update(whereclause=(tbl.c.id.in_(ids)))
                 q = q.where(
                     # unclaimed
                     (((tbl.c.claimed_at == None) | (tbl.c.claimed_at == 0)) &
@@ -230,19 +270,24 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
                     ((tbl.c.claimed_at != None) &
                     (tbl.c.claimed_by_name == master_name) &
                     (tbl.c.claimed_by_incarnation == master_incarnation)))
+                if use_returning:
+                    q = q.returning(tbl.c.id)
                 res = conn.execute(q,
                     claimed_at=_reactor.seconds(),
                     claimed_by_name=self.db.master.master_name,
                     claimed_by_incarnation=self.db.master.master_incarnation)
-                updated_rows = res.rowcount
+                if use_returning:
+                    updated_rows = len(res.fetchall())
+                else:
+                    updated_rows = res.rowcount
                 res.close()
 
                 # if no rows or too few rows were updated, then we failed; this
                 # will roll back the transaction
                 if updated_rows != len(brids):
                     # MySQL doesn't do transactions, so roll this back manually
-                    if conn.engine.dialect.name == 'mysql':
-                        alreadyClaimed(conn, tmp)
+                    if dialect == 'mysql':
+                        alreadyClaimed(conn, ids)
                     transaction.rollback()
                     raise AlreadyClaimedError
 
@@ -254,24 +299,27 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
 
                 # but double-check to be sure all of the desired build requests
                 # now belong to this master
-                q = sa.select([tbl.c.claimed_by_name,
-                            tbl.c.claimed_by_incarnation],
-                            whereclause=(tbl.c.id.in_(tmp.select())))
-                res = conn.execute(q)
-                for row in res:
-                    if row.claimed_by_name != master_name or \
-                            row.claimed_by_incarnation != master_incarnation:
-                        # note that the transaction is already committed here; too
-                        # bad!  We'll just fake it by unclaiming those requests (so
-                        # hopefully this was not a reclaim)
-                        alreadyClaimed(conn, tmp)
-                        raise AlreadyClaimedError
-                res.close()
+                if not use_returning:
+                    q = sa.select([tbl.c.claimed_by_name,
+                                tbl.c.claimed_by_incarnation],
+                                whereclause=(tbl.c.id.in_(ids)))
+                    res = conn.execute(q)
+                    for row in res:
+                        if row.claimed_by_name != master_name or \
+                                row.claimed_by_incarnation != master_incarnation:
+                            # note that the transaction is already committed
+                            # here; too bad!  We'll just fake it by unclaiming
+                            # those requests (so hopefully this was not a
+                            # reclaim)
+                            alreadyClaimed(conn, ids)
+                            raise AlreadyClaimedError
+                    res.close()
             finally:
                 # clean up after ourselves, even though it's a temporary table;
                 # note that checkfirst=True does not work here for Postgres
                 # (#2010).
-                tmp.drop()
+                if tmp is not None:
+                    tmp.drop()
 
         return self.db.pool.do(thd)
 
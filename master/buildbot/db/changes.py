@@ -53,6 +53,10 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
       string)
     """
 
+    MAX_IN_LIST = 500
+    """maximum number of changeids to include in a single C{IN} clause; SQLite
+    limits the number of variables in a statement to 999."""
+
     def addChange(self, author=None, files=None, comments=None, is_dir=0,
             links=None, revision=None, when_timestamp=None, branch=None,
             category=None, revlink='', properties={}, repository='',
@@ -190,10 +194,62 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             if not row:
                 return None
             # and fetch the ancillary data (links, files, properties)
-            return self._chdict_from_change_row_thd(conn, row)
+            return self._chdicts_from_change_rows_thd(conn, [ row ])[changeid]
         d = self.db.pool.do(thd)
         return d
 
+    def getChanges(self, changeids):
+        """
+        Get a list of change dictionaries for the given changeids, in the same
+        order.  Changes which are not in the C{chdicts} cache are fetched with
+        a fixed number of queries per L{MAX_IN_LIST} changes, rather than
+        several queries per change as for L{getChange}, and then added to the
+        cache.
+
+        @param changeids: ids of the change instances to fetch
+        @type changeids: list of integers
+
+        @returns: list of change dictionaries (or None for changes that do not
+        exist) via Deferred
+        """
+        cache = self.getChange.cache
+        found = {}
+        to_fetch = []
+        for changeid in changeids:
+            assert changeid >= 0
+            if changeid in found:
+                continue
+            chdict = cache.peek(changeid)
+            if chdict is not None:
+                found[changeid] = chdict
+            else:
+                found[changeid] = None
+                to_fetch.append(changeid)
+
+        def thd(conn):
+            changes_tbl = self.db.model.changes
+            rv = {}
+            for i in xrange(0, len(to_fetch), self.MAX_IN_LIST):
+                batch = to_fetch[i:i+self.MAX_IN_LIST]
+                q = changes_tbl.select(
+                        whereclause=changes_tbl.c.changeid.in_(batch))
+                rows = conn.execute(q).fetchall()
+                rv.update(self._chdicts_from_change_rows_thd(conn, rows))
+            return rv
+        if to_fetch:
+            d = self.db.pool.do(thd)
+        else:
+            d = defer.succeed({})
+
+        def cache_and_order(fetched):
+            for changeid in to_fetch:
+                chdict = fetched.get(changeid)
+                cache.add(changeid, chdict)
+                found[changeid] = chdict
+            return [ found[changeid] for changeid in changeids ]
+        d.addCallback(cache_and_order)
+        return d
+
     def getRecentChanges(self, count):
         """
         Get a list of the C{count} most recent changes, represented as
@@ -216,10 +272,11 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         d = self.db.pool.do(thd)
 
         # then turn those into changes, using the cache
-        def get_changes(changeids):
-            return defer.gatherResults([ self.getChange(changeid)
-                                         for changeid in changeids ])
-        d.addCallback(get_changes)
+        d.addCallback(self.getChanges)
+        def drop_missing(chdicts):
+            # changes pruned since the first query are simply omitted
+            return [ chdict for chdict in chdicts if chdict is not None ]
+        d.addCallback(drop_missing)
         return d
 
     def getLatestChangeid(self):
@@ -266,9 +323,11 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                     table.delete(table.c.changeid.in_(ids_to_delete)))
         return self.db.pool.do(thd)
 
-    def _chdict_from_change_row_thd(self, conn, ch_row):
-        # This method must be run in a db.pool thread, and returns a chdict
-        # given a row from the 'changes' table
+    def _chdicts_from_change_rows_thd(self, conn, ch_rows):
+        # This method must be run in a db.pool thread, and returns a dictionary
+        # mapping changeid to chdict given a list of rows from the 'changes'
+        # table.  The ancillary data is fetched with one query per table,
+        # regardless of the number of rows.
         change_links_tbl = self.db.model.change_links
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
@@ -277,7 +336,9 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             if epoch:
                 return epoch2datetime(epoch)
 
-        chdict = ChDict(
+        chdicts = {}
+        for ch_row in ch_rows:
+            chdicts[ch_row.changeid] = ChDict(
                 changeid=ch_row.changeid,
                 author=ch_row.author,
                 files=[], # see below
@@ -293,17 +354,21 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 repository=ch_row.repository,
                 project=ch_row.project)
 
+        if not chdicts:
+            return chdicts
+        changeids = chdicts.keys()
+
         query = change_links_tbl.select(
-                whereclause=(change_links_tbl.c.changeid == ch_row.changeid))
+                whereclause=change_links_tbl.c.changeid.in_(changeids))
         rows = conn.execute(query)
         for r in rows:
-            chdict['links'].append(r.link)
+            chdicts[r.changeid]['links'].append(r.link)
 
         query = change_files_tbl.select(
-                whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
+                whereclause=change_files_tbl.c.changeid.in_(changeids))
         rows = conn.execute(query)
         for r in rows:
-            chdict['files'].append(r.filename)
+            chdicts[r.changeid]['files'].append(r.filename)
 
         # and properties must be given without a source, so strip that, but
         # be flexible in case users have used a development version where the
@@ -318,10 +383,10 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             return v, s
 
         query = change_properties_tbl.select(
-                whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
+                whereclause=change_properties_tbl.c.changeid.in_(changeids))
         rows = conn.execute(query)
         for r in rows:
             v, s = split_vs(json.loads(r.property_value))
-            chdict['properties'][r.property_name] = (v,s)
+            chdicts[r.changeid]['properties'][r.property_name] = (v,s)
 
-        return chdict
+        return chdicts
@@ -34,13 +34,13 @@ class DBConnector(service.MultiService):
     # periodic cleanup actions on this schedule.
     CLEANUP_PERIOD = 3600
 
-    def __init__(self, master, db_url, basedir):
+    def __init__(self, master, db_url, basedir, pool_size=None):
         service.MultiService.__init__(self)
         self.master = master
         self.basedir = basedir
 
         self._engine = enginestrategy.create_engine(db_url, basedir=self.basedir)
-        self.pool = pool.DBThreadPool(self._engine)
+        self.pool = pool.DBThreadPool(self._engine, pool_size=pool_size)
 
         # set up components
         self.model = model.Model(self)
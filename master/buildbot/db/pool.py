@@ -17,11 +17,13 @@ import time
 import traceback
 import shutil
 import os
+import sys
 import sqlalchemy as sa
 import twisted
 import tempfile
 from twisted.internet import reactor, threads, defer
 from twisted.python import threadpool, failure, versions, log
+from buildbot.process import metrics
 
 # set this to True for *very* verbose query debugging output; this can
 # be monkey-patched from master.cfg, too:
@@ -59,10 +61,18 @@ class DBThreadPool(threadpool.ThreadPool):
     If the engine has an C{optimal_thread_pool_size} attribute, then the
     maxthreads of the thread pool will be set to that value.  This is most
     useful for SQLite in-memory connections, where exactly one connection
-    (and thus thread) should be used.
+    (and thus thread) should be used.  A C{pool_size} can also be given (from
+    C{c['db_pool_size']}), but is limited to C{optimal_thread_pool_size}.
+
+    Each query run with L{do} is attributed to the method that called L{do},
+    and the time it spent waiting for a thread and executing is logged as a
+    L{metrics.MetricHistogramEvent} named C{DBThreadPool.queue_wait.<method>}
+    and C{DBThreadPool.execution.<method>}.  When queries are waiting for a
+    thread, the C{DBThreadPool.saturation} alarm is raised.
     """
 
     running = False
+    _stop_evt = None
 
     # Some versions of SQLite incorrectly cache metadata about which tables are
     # and are not present on a per-connection basis.  This cache can be flushed
@@ -72,15 +82,20 @@ class DBThreadPool(threadpool.ThreadPool):
     # in bug #1810.
     __broken_sqlite = False
 
-    def __init__(self, engine):
-        pool_size = 5
-        if hasattr(engine, 'optimal_thread_pool_size'):
-            pool_size = engine.optimal_thread_pool_size
+    def __init__(self, engine, pool_size=None):
+        self.engine = engine
         threadpool.ThreadPool.__init__(self,
                         minthreads=1,
-                        maxthreads=pool_size,
+                        maxthreads=self._limitPoolSize(pool_size),
                         name='DBThreadPool')
-        self.engine = engine
+
+        # number of queries queued or running, and the current level of the
+        # saturation alarm; both are only accessed from the reactor thread
+        self._in_flight = 0
+        self._saturation = metrics.ALARM_OK
+        # code object : calling method name, for metrics
+        self._caller_names = {}
+
         if engine.dialect.name == 'sqlite':
             log.msg("applying SQLite workaround from Buildbot bug #1810")
             self.__broken_sqlite = self.detect_bug1810()
@@ -91,6 +106,26 @@ class DBThreadPool(threadpool.ThreadPool):
             self.do = timed_do_fn(self.do)
             self.do_with_engine = timed_do_fn(self.do_with_engine)
 
+    def _limitPoolSize(self, pool_size):
+        max_size = getattr(self.engine, 'optimal_thread_pool_size', None)
+        if pool_size is None:
+            return max_size or 5
+        if max_size and pool_size > max_size:
+            log.msg("db_pool_size %d exceeds the %d connections available; "
+                    "using %d threads" % (pool_size, max_size, max_size))
+            return max_size
+        return pool_size
+
+    def setPoolSize(self, pool_size):
+        """
+        Change the maximum number of threads (and thus concurrent database
+        connections) used by this pool.
+
+        @param pool_size: new size, or None for the default
+        """
+        self.adjustPoolsize(maxthreads=self._limitPoolSize(pool_size))
+        self._checkSaturation()
+
     def _start(self):
         self._start_evt = None
         if not self.running:
@@ -121,7 +156,12 @@ class DBThreadPool(threadpool.ThreadPool):
 
         Note: do not return any SQLAlchemy objects via this deferred!
         """
+        name = self._getCallerName(sys._getframe(1).f_code)
+        queued_at = time.time()
+        # start and finish times, set in the thread
+        times = []
         def thd():
+            times.append(time.time())
             conn = self.engine.contextual_connect()
             if self.__broken_sqlite: # see bug #1810
                 conn.execute("select * from sqlite_master")
@@ -131,8 +171,49 @@ class DBThreadPool(threadpool.ThreadPool):
                         "do not return ResultProxy objects!"
             finally:
                 conn.close()
+                times.append(time.time())
             return rv
-        return threads.deferToThreadPool(reactor, self, thd)
+        self._in_flight += 1
+        self._checkSaturation()
+        d = threads.deferToThreadPool(reactor, self, thd)
+        d.addBoth(self._queryDone, name, queued_at, times)
+        return d
+
+    def _getCallerName(self, code):
+        try:
+            return self._caller_names[code]
+        except KeyError:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = self._caller_names[code] = "%s.%s" % (module, code.co_name)
+            return name
+
+    def _queryDone(self, res, name, queued_at, times):
+        self._in_flight -= 1
+        if len(times) == 2:
+            started_at, finished_at = times
+            metrics.MetricHistogramEvent.log(
+                    'DBThreadPool.queue_wait.%s' % name, started_at - queued_at)
+            metrics.MetricHistogramEvent.log(
+                    'DBThreadPool.execution.%s' % name, finished_at - started_at)
+        self._checkSaturation()
+        return res
+
+    def _checkSaturation(self):
+        # raise the alarm when queries are waiting for a thread, and make it
+        # critical when as many are waiting as there are threads
+        waiting = self._in_flight - self.max
+        if waiting <= 0:
+            level = metrics.ALARM_OK
+        elif waiting < self.max:
+            level = metrics.ALARM_WARN
+        else:
+            level = metrics.ALARM_CRIT
+        if level != self._saturation:
+            self._saturation = level
+            metrics.MetricAlarmEvent.log('DBThreadPool.saturation',
+                    msg="%d queries waiting for %d threads"
+                            % (max(waiting, 0), self.max),
+                    level=level)
 
     def do_with_engine(self, callable, *args, **kwargs):
         """
@@ -20,8 +20,10 @@ Support for schedulers in the database
 from buildbot.util import json
 import sqlalchemy as sa
 import sqlalchemy.exc
-from twisted.python import log
+from twisted.internet import defer
+from twisted.python import log, failure
 from buildbot.db import base
+from buildbot.util import eventual
 
 class SchedulersConnectorComponent(base.DBConnectorComponent):
     """
@@ -55,34 +57,189 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
             conn.execute(q, state=json.dumps(state))
         return self.db.pool.do(thd)
 
-    # TODO: maybe only the singular is needed?
+    MAX_ROWS_PER_STATEMENT = 250
+    """maximum number of classifications written by a single multi-row
+    statement; larger sets are written in chunks, to stay well within
+    databases' limits on the number of bound parameters."""
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # classifications queued by queueChangeClassifications, as a
+        # dictionary mapping (schedulerid, changeid) to IMPORTANT, with the
+        # Deferreds to fire when they are written
+        self._queued = {}
+        self._queued_ds = []
+        # Deferreds to fire when the write in progress, if any, is done
+        self._writing_ds = None
+        self._write_scheduled = False
+
     def classifyChanges(self, schedulerid, classifications):
         """Record a collection of classifications in the scheduler_changes
         table. CLASSIFICATIONS is a dictionary mapping CHANGEID to IMPORTANT
-        (boolean).  Returns a Deferred."""
+        (boolean).  Existing classifications of the same changes are
+        replaced.  Returns a Deferred."""
+        rows = [ (schedulerid, changeid, important)
+                 for changeid, important in classifications.items() ]
+        def thd(conn):
+            self._writeClassifications(conn, rows)
+        return self.db.pool.do(thd)
+
+    def queueChangeClassifications(self, schedulerid, classifications):
+        """
+        Like L{classifyChanges}, but the classifications are written in a
+        later reactor turn, together with those queued by any other caller
+        in the meantime (including while a previous write is in progress).
+        This lets a busy master classify many changes, for many schedulers,
+        in a few database statements.
+
+        L{getChangeClassifications} and L{flushChangeClassifications} wait
+        for queued classifications to be written before running.
+
+        @param schedulerid: scheduler that classified the changes
+        @param classifications: dictionary mapping changeid to a boolean
+        (important)
+        @returns: Deferred that fires when the classifications are written
+        """
+        for changeid, important in classifications.items():
+            self._queued[(schedulerid, changeid)] = important
+        d = defer.Deferred()
+        self._queued_ds.append(d)
+        if self._writing_ds is None and not self._write_scheduled:
+            self._write_scheduled = True
+            eventual.eventually(self._writeQueued)
+        return d
+
+    def waitForQueuedClassifications(self):
+        """Return a Deferred that fires (with None) when all of the
+        classifications queued so far have been written, or have failed to
+        be written."""
+        if not self._queued and self._writing_ds is None:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        if self._queued:
+            # the queued classifications are written after the write in
+            # progress, if any
+            self._queued_ds.append(d)
+        else:
+            self._writing_ds.append(d)
+        d.addErrback(lambda _ : None)
+        return d
+
+    def _writeQueued(self):
+        self._write_scheduled = False
+        if self._writing_ds is not None or not self._queued:
+            return
+        rows = [ (schedulerid, changeid, important)
+                 for (schedulerid, changeid), important
+                 in self._queued.iteritems() ]
+        self._writing_ds = self._queued_ds
+        self._queued = {}
+        self._queued_ds = []
         def thd(conn):
-            tbl = self.db.model.scheduler_changes
-            ins_q = tbl.insert()
-            upd_q = tbl.update(
-                    ((tbl.c.schedulerid == schedulerid)
-                    & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
-            for changeid, important in classifications.items():
+            self._writeClassifications(conn, rows)
+        d = self.db.pool.do(thd)
+        def done(res):
+            waiters, self._writing_ds = self._writing_ds, None
+            for waiter in waiters:
+                if isinstance(res, failure.Failure):
+                    waiter.errback(res)
+                else:
+                    waiter.callback(None)
+            # write anything that was queued in the meantime
+            self._writeQueued()
+        d.addBoth(done)
+
+    def _writeClassifications(self, conn, rows, dialect=None,
+                              sqlite_version=None):
+        # Write (schedulerid, changeid, important) rows with one multi-row
+        # statement per chunk, replacing any existing rows for the same
+        # scheduler and change.  SQLite and MySQL can do this in a single
+        # statement; elsewhere, existing rows are deleted first, in the same
+        # transaction.  If that fails, e.g., because another master inserted
+        # a conflicting row at the same time, fall back to writing the rows
+        # one by one.  SQLite before 3.7.11 cannot take several rows in one
+        # VALUES clause, so there each row gets its own INSERT OR REPLACE,
+        # in a single transaction.
+        if dialect is None:
+            dialect = conn.engine.dialect.name
+        if dialect == 'sqlite':
+            if sqlite_version is None:
+                sqlite_version = conn.engine.dialect.dbapi.sqlite_version_info
+            if sqlite_version < (3, 7, 11):
+                self._writeClassificationsSQLiteRowByRow(conn, rows)
+                return
+        tbl = self.db.model.scheduler_changes
+        chunk_size = self.MAX_ROWS_PER_STATEMENT
+        for i in xrange(0, len(rows), chunk_size):
+            chunk = rows[i:i+chunk_size]
+            params = {}
+            values = []
+            for j, (schedulerid, changeid, important) in enumerate(chunk):
+                values.append("(:s%d, :c%d, :i%d)" % (j, j, j))
                 # convert the 'important' value into an integer, since that
                 # is the column type
-                imp_int = important and 1 or 0
-                try:
-                    conn.execute(ins_q,
-                            schedulerid=schedulerid,
-                            changeid=changeid,
-                            important=imp_int)
-                except (sqlalchemy.exc.ProgrammingError,
-                        sqlalchemy.exc.IntegrityError):
-                    # insert failed, so try an update
-                    conn.execute(upd_q,
-                            wc_changeid=changeid,
-                            important=imp_int)
+                params['s%d' % j] = schedulerid
+                params['c%d' % j] = changeid
+                params['i%d' % j] = important and 1 or 0
+            insert = ("INTO %s (schedulerid, changeid, important) VALUES %s"
+                      % (tbl.name, ", ".join(values)))
+            if dialect == 'sqlite':
+                conn.execute(sa.text("INSERT OR REPLACE " + insert), **params)
+                continue
+            if dialect == 'mysql':
+                conn.execute(sa.text("INSERT " + insert +
+                        " ON DUPLICATE KEY UPDATE important=VALUES(important)"),
+                        **params)
+                continue
+            transaction = conn.begin()
+            try:
+                for schedulerid in set([ row[0] for row in chunk ]):
+                    changeids = [ row[1] for row in chunk
+                                  if row[0] == schedulerid ]
+                    conn.execute(tbl.delete(whereclause=(
+                        (tbl.c.schedulerid == schedulerid) &
+                        (tbl.c.changeid.in_(changeids)))))
+                conn.execute(sa.text("INSERT " + insert), **params)
+                transaction.commit()
+            except (sqlalchemy.exc.ProgrammingError,
+                    sqlalchemy.exc.IntegrityError):
+                transaction.rollback()
+                self._writeClassificationsOneByOne(conn, chunk)
 
-        return self.db.pool.do(thd)
+    def _writeClassificationsSQLiteRowByRow(self, conn, rows):
+        tbl = self.db.model.scheduler_changes
+        q = sa.text("INSERT OR REPLACE INTO %s (schedulerid, changeid, "
+                    "important) VALUES (:s, :c, :i)" % tbl.name)
+        transaction = conn.begin()
+        try:
+            conn.execute(q, [ dict(s=schedulerid, c=changeid,
+                                   i=important and 1 or 0)
+                              for schedulerid, changeid, important in rows ])
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+
+    def _writeClassificationsOneByOne(self, conn, rows):
+        tbl = self.db.model.scheduler_changes
+        ins_q = tbl.insert()
+        upd_q = tbl.update(
+                ((tbl.c.schedulerid == sa.bindparam('wc_schedulerid'))
+                & (tbl.c.changeid == sa.bindparam('wc_changeid'))))
+        for schedulerid, changeid, important in rows:
+            imp_int = important and 1 or 0
+            try:
+                conn.execute(ins_q,
+                        schedulerid=schedulerid,
+                        changeid=changeid,
+                        important=imp_int)
+            except (sqlalchemy.exc.ProgrammingError,
+                    sqlalchemy.exc.IntegrityError):
+                # insert failed, so try an update
+                conn.execute(upd_q,
+                        wc_schedulerid=schedulerid,
+                        wc_changeid=changeid,
+                        important=imp_int)
 
     def flushChangeClassifications(self, schedulerid, less_than=None):
         """
@@ -96,7 +253,9 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
                 wc = wc & (scheduler_changes_tbl.c.changeid < less_than)
             q = scheduler_changes_tbl.delete(whereclause=wc)
             conn.execute(q)
-        return self.db.pool.do(thd)
+        d = self.waitForQueuedClassifications()
+        d.addCallback(lambda _ : self.db.pool.do(thd))
+        return d
 
     class Thunk: pass
     def getChangeClassifications(self, schedulerid, branch=Thunk):
@@ -126,7 +285,9 @@ class SchedulersConnectorComponent(base.DBConnectorComponent):
                 [ scheduler_changes_tbl.c.changeid, scheduler_changes_tbl.c.important ],
                 whereclause=wc)
             return dict([ (r.changeid, [False,True][r.important]) for r in conn.execute(q) ])
-        return self.db.pool.do(thd)
+        d = self.waitForQueuedClassifications()
+        d.addCallback(lambda _ : self.db.pool.do(thd))
+        return d
 
     def getSchedulerId(self, sched_name, sched_class):
         """
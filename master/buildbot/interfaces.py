@@ -811,6 +811,11 @@ class IStatusLog(Interface):
         trailing newline).
         """
 
+    def iterLines(channels=(LOG_CHANNEL_STDOUT, LOG_CHANNEL_STDERR)):
+        """Read lines from the given channels of the logfile, as for
+        readlines. The log is read incrementally, so this is suitable for
+        scanning very large logs."""
+
     def getTextWithHeaders():
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
@@ -14,33 +14,70 @@
 # Copyright Buildbot Team Members
 
 
+from collections import deque
 from twisted.python import log
 from twisted.internet import reactor, defer
 from buildbot import util
+from buildbot.process import metrics
 
 if False: # for debugging
     debuglog = log.msg
 else:
     debuglog = lambda m: None
 
+class _Waiter(object):
+    # an entry in a lock's queue of waiters
+    __slots__ = [ 'owner', 'access', 'd', 'woken', 'since', 'gone' ]
+
+    def __init__(self, owner, access, d, since):
+        self.owner = owner
+        self.access = access
+        self.d = d
+        self.woken = False
+        self.since = since
+        self.gone = False
+
 class BaseLock:
     """
     Class handling claiming and releasing of L{self}, and keeping track of
     current and waiting owners.
 
-    @note: Ideally, we'd like to maintain FIFO order. The place to do that
-           would be the L{isAvailable()} function. However, this function is
-           called by builds/steps both for the first time, and after waking
-           them up by L{self} from the L{self.waiting} queue. There is
-           currently no way of distinguishing between them.
+    The lock is granted to waiters in strict FIFO order.  When it is
+    released, the waiters at the head of the queue that can now hold it are
+    woken up, and the lock is reserved for them until they claim it (with
+    L{claim}) or stop waiting (with L{stopWaitingUntilAvailable}).  While
+    anyone is waiting, the lock is not available to owners that are not in
+    the queue, so that they cannot overtake the waiters.
+
+    The numbers of exclusive and counting owners and reservations are kept
+    as counters, so that checking, claiming and releasing the lock do not
+    depend on the number of owners or waiters.
+
+    The number of waiters and the time each owner waited for the lock are
+    reported in the C{<metricName>.waiting} counter and the
+    C{<metricName>.wait} histogram metrics.
     """
     description = "<BaseLock>"
 
+    _reactor = reactor # for tests
+
     def __init__(self, name, maxCount=1):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (LockAccess, deferred)
-        self.owners = []          # Current owners, tuples (owner, LockAccess)
         self.maxCount = maxCount  # maximal number of counting owners
+        self.metricName = "Lock.%s" % name
+        # Current owners, as a dictionary mapping (owner, LockAccess) to the
+        # number of times it was claimed
+        self.owners = {}
+        # Current queue of _Waiter instances, and the same, by owner.  Waiters
+        # that stopped waiting are removed from the queue lazily.
+        self.waiting = deque()
+        self.waiters = {}
+        self._numExclusive = 0
+        self._numCounting = 0
+        self._reservedExclusive = 0
+        self._reservedCounting = 0
+        self._numSleeping = 0     # waiters that have not been woken yet
+        self._numGone = 0         # waiters still in the queue that are gone
 
     def __repr__(self):
         return self.description
@@ -50,39 +87,57 @@ class BaseLock:
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else: # mode == 'counting'
-                num_counting = num_counting + 1
-
-        assert (num_excl == 1 and num_counting == 0) \
-                or (num_excl == 0 and num_counting <= self.maxCount)
-        return num_excl, num_counting
-
-
-    def isAvailable(self, access):
-        """ Return a boolean whether the lock is available for claiming """
-        debuglog("%s isAvailable(%s): self.owners=%r"
-                                            % (self, access, self.owners))
-        num_excl, num_counting = self._getOwnersCount()
+        return self._numExclusive, self._numCounting
+
+    def getWaitingCount(self):
+        """Return the number of owners waiting for this lock"""
+        return len(self.waiters)
+
+    def _fits(self, access):
+        # can ACCESS be granted, given the current owners and reservations?
+        if self._numExclusive + self._reservedExclusive > 0:
+            return False
         if access.mode == 'counting':
-            # Wants counting access
-            return num_excl == 0 and num_counting < self.maxCount
+            return (self._numCounting + self._reservedCounting
+                    < self.maxCount)
         else:
-            # Wants exclusive access
-            return num_excl == 0 and num_counting == 0
+            return self._numCounting + self._reservedCounting == 0
+
+    def isAvailable(self, requester, access):
+        """ Return a boolean whether the lock is available for claiming by
+        REQUESTER """
+        debuglog("%s isAvailable(%s, %s)" % (self, requester, access.mode))
+        waiter = self.waiters.get(requester)
+        if waiter is not None:
+            # the lock is reserved for woken waiters
+            return waiter.woken
+        if self._numSleeping:
+            # don't overtake the waiters
+            return False
+        return self._fits(access)
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
         debuglog("%s claim(%s, %s)" % (self, owner, access.mode))
         assert owner is not None
-        assert self.isAvailable(access), "ask for isAvailable() first"
+        assert self.isAvailable(owner, access), "ask for isAvailable() first"
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
-        self.owners.append((owner, access))
+        waiter = self.waiters.get(owner)
+        if waiter is not None:
+            self._removeWaiter(waiter)
+            metrics.MetricHistogramEvent.log(self.metricName + '.wait',
+                    self._reactor.seconds() - waiter.since)
+        entry = (owner, access)
+        self.owners[entry] = self.owners.get(entry, 0) + 1
+        if access.mode == 'exclusive':
+            self._numExclusive += 1
+        else:
+            self._numCounting += 1
+        assert (self._numExclusive == 1 and self._numCounting == 0) \
+                or (self._numExclusive == 0
+                    and self._numCounting <= self.maxCount)
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
     def release(self, owner, access):
@@ -92,27 +147,65 @@ class BaseLock:
         debuglog("%s release(%s, %s)" % (self, owner, access.mode))
         entry = (owner, access)
         assert entry in self.owners
-        self.owners.remove(entry)
-        # who can we wake up?
-        # After an exclusive access, we may need to wake up several waiting.
-        # Break out of the loop when the first waiting client should not be awakened.
-        num_excl, num_counting = self._getOwnersCount()
-        while len(self.waiting) > 0:
-            access, d = self.waiting[0]
-            if access.mode == 'counting':
-                if num_excl > 0 or num_counting == self.maxCount:
-                    break
-                else:
-                    num_counting = num_counting + 1
+        if self.owners[entry] == 1:
+            del self.owners[entry]
+        else:
+            self.owners[entry] -= 1
+        if access.mode == 'exclusive':
+            self._numExclusive -= 1
+        else:
+            self._numCounting -= 1
+        self._wakeWaiters()
+
+    def _wakeWaiters(self):
+        # wake up, and reserve the lock for, the waiters at the head of the
+        # queue that can hold the lock along with the current owners and any
+        # earlier waiters.  After an exclusive access, we may need to wake up
+        # several waiting.
+        while self.waiting and self.waiting[0].gone:
+            self.waiting.popleft()
+            self._numGone -= 1
+        if not self._numSleeping:
+            return
+        for waiter in self.waiting:
+            if waiter.gone or waiter.woken:
+                continue
+            if not self._fits(waiter.access):
+                break
+            if waiter.access.mode == 'exclusive':
+                self._reservedExclusive += 1
+            else:
+                self._reservedCounting += 1
+            waiter.woken = True
+            self._numSleeping -= 1
+            self._reactor.callLater(0, self._wake, waiter.d)
+
+    def _wake(self, d):
+        # the waiter may have been interrupted, and its Deferred fired,
+        # before it had a chance to be woken
+        if not d.called:
+            d.callback(self)
+
+    def _removeWaiter(self, waiter):
+        del self.waiters[waiter.owner]
+        waiter.gone = True
+        self._numGone += 1
+        if waiter.woken:
+            if waiter.access.mode == 'exclusive':
+                self._reservedExclusive -= 1
             else:
-                # access.mode == 'exclusive'
-                if num_excl > 0 or num_counting > 0:
-                    break
-                else:
-                    num_excl = num_excl + 1
+                self._reservedCounting -= 1
+        else:
+            self._numSleeping -= 1
+        # compact the queue if it is mostly made of waiters that are gone
+        if self._numGone > 100 and self._numGone > len(self.waiters):
+            self.waiting = deque([ w for w in self.waiting if not w.gone ])
+            self._numGone = 0
+        self._logWaiting()
 
-            del self.waiting[0]
-            reactor.callLater(0, d.callback, self)
+    def _logWaiting(self):
+        metrics.MetricCountEvent.log(self.metricName + '.waiting',
+                len(self.waiters), absolute=True)
 
     def waitUntilMaybeAvailable(self, owner, access):
         """Fire when the lock *might* be available. The caller will need to
@@ -120,29 +213,57 @@ class BaseLock:
         used to avoid deadlocks. If we were interested in a stronger form,
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
+
+        The owner keeps its place in the queue until it claims the lock or
+        calls L{stopWaitingUntilAvailable}.
         """
         debuglog("%s waitUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        if self.isAvailable(access):
+        if self.isAvailable(owner, access):
             return defer.succeed(self)
         d = defer.Deferred()
-        self.waiting.append((access, d))
+        waiter = self.waiters.get(owner)
+        if waiter is not None:
+            # already in the queue, but not yet woken
+            waiter.d = d
+            return d
+        waiter = _Waiter(owner, access, d, self._reactor.seconds())
+        self.waiting.append(waiter)
+        self.waiters[owner] = waiter
+        self._numSleeping += 1
+        self._logWaiting()
         return d
 
-    def stopWaitingUntilAvailable(self, owner, access, d):
+    def stopWaitingUntilAvailable(self, owner, access, d=None):
+        """Give up OWNER's place in the queue for this lock, if it has one,
+        waking up the next waiters if they can now hold the lock."""
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (access, d) in self.waiting
-        self.waiting.remove( (access, d) )
+        waiter = self.waiters.get(owner)
+        if waiter is None:
+            return
+        assert d is None or waiter.d is d
+        self._removeWaiter(waiter)
+        self._wakeWaiters()
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
 
 
+def lockOrder(lock_and_access):
+    """Sort key for (lock, access) pairs, giving the order in which an
+    owner acquires several locks.  An owner waiting for one lock keeps its
+    reservations on the locks before it in this order, so every owner must
+    use the same order to avoid deadlocks."""
+    lock = lock_and_access[0]
+    return (lock.name, lock.description)
+
+
 class RealMasterLock(BaseLock):
     def __init__(self, lockid):
         BaseLock.__init__(self, lockid.name, lockid.maxCount)
         self.description = "<MasterLock(%s, %s)>" % (self.name, self.maxCount)
+        self.metricName = "MasterLock.%s" % self.name
 
     def getLock(self, slave):
         return self
@@ -169,6 +290,7 @@ class RealSlaveLock:
             desc = "<SlaveLock(%s, %s)[%s] %d>" % (self.name, maxCount,
                                                    slavename, id(lock))
             lock.description = desc
+            lock.metricName = "SlaveLock.%s.%s" % (self.name, slavename)
             self.locks[slavename] = lock
         return self.locks[slavename]
 
@@ -30,7 +30,8 @@ import buildbot.pbmanager
 from buildbot.util import safeTranslate, subscription, epoch2datetime
 from buildbot.process.builder import Builder
 from buildbot.status.master import Status
-from buildbot.changes import changes
+from buildbot.status import logfile, logcompressor, buildlayout, build
+from buildbot.changes import changes, routing
 from buildbot.changes.manager import ChangeManager
 from buildbot import interfaces, locks
 from buildbot.process.properties import Properties
@@ -79,6 +80,17 @@ class BuildMaster(service.MultiService):
     # database poll operation.
     WARNING_UNCLAIMED_COUNT = 10000
 
+    # frequency with which to scan the whole buildrequests table for unclaimed
+    # requests.  Between these sweeps, only requests with IDs above the
+    # highest one seen so far are read, so this bounds the delay before
+    # noticing a request that was unclaimed (or claimed and released) by
+    # another master.
+    UNCLAIMED_SWEEP_INTERVAL = 2*60
+
+    # number of changes to fetch and deliver at once when catching up with the
+    # changes table; the master's state is updated after each page
+    CHANGE_POLL_PAGE_SIZE = 100
+
     def __init__(self, basedir, configFileName="master.cfg"):
         service.MultiService.__init__(self)
         self.setName("buildmaster")
@@ -122,6 +134,7 @@ class BuildMaster(service.MultiService):
         self.db = None
         self.db_url = None
         self.db_poll_interval = _Unset
+        self.db_pool_size = None
 
         self.metrics = None
 
@@ -135,7 +148,7 @@ class BuildMaster(service.MultiService):
 
         # subscription points
         self._change_subs = \
-                subscription.SubscriptionPoint("changes")
+                routing.ChangeRouter("changes")
         self._new_buildrequest_subs = \
                 subscription.SubscriptionPoint("buildrequest_additions")
         self._new_buildset_subs = \
@@ -241,9 +254,13 @@ class BuildMaster(service.MultiService):
                           "title", "titleURL",
                           "buildbotURL", "properties", "prioritizeBuilders",
                           "eventHorizon", "buildCacheSize", "changeCacheSize",
+                          "buildCacheBytes", "buildCacheTotalBytes",
                           "logHorizon", "buildHorizon", "changeHorizon",
                           "logMaxSize", "logMaxTailSize", "logCompressionMethod",
                           "db_url", "multiMaster", "db_poll_interval",
+                          "db_pool_size", "logCompressionWorkers",
+                          "logCompressionProcesses", "buildDirectoryLayout",
+                          "buildPickleFormat",
                           "metrics", "caches"
                           )
             for k in config.keys():
@@ -263,6 +280,11 @@ class BuildMaster(service.MultiService):
                 # optional
                 db_url = config.get("db_url", "sqlite:///state.sqlite")
                 db_poll_interval = config.get("db_poll_interval", None)
+                db_pool_size = config.get("db_pool_size", None)
+                if db_pool_size is not None and not \
+                        (isinstance(db_pool_size, int) and db_pool_size > 0):
+                    raise ValueError("db_pool_size needs to be None or a "
+                                     "positive int")
                 debugPassword = config.get('debugPassword')
                 manhole = config.get('manhole')
                 status = config.get('status', [])
@@ -274,6 +296,15 @@ class BuildMaster(service.MultiService):
                 properties = config.get('properties', {})
                 buildCacheSize = config.get('buildCacheSize', None)
                 changeCacheSize = config.get('changeCacheSize', None)
+                buildCacheBytes = config.get('buildCacheBytes')
+                if buildCacheBytes is not None and not \
+                        isinstance(buildCacheBytes, int):
+                    raise ValueError("buildCacheBytes needs to be None or int")
+                buildCacheTotalBytes = config.get('buildCacheTotalBytes')
+                if buildCacheTotalBytes is not None and not \
+                        isinstance(buildCacheTotalBytes, int):
+                    raise ValueError("buildCacheTotalBytes needs to be None "
+                                     "or int")
                 eventHorizon = config.get('eventHorizon', 50)
                 logHorizon = config.get('logHorizon', None)
                 buildHorizon = config.get('buildHorizon', None)
@@ -282,8 +313,30 @@ class BuildMaster(service.MultiService):
                         isinstance(logCompressionLimit, int):
                     raise ValueError("logCompressionLimit needs to be bool or int")
                 logCompressionMethod = config.get('logCompressionMethod', "bz2")
-                if logCompressionMethod not in ('bz2', 'gz'):
-                    raise ValueError("logCompressionMethod needs to be 'bz2', or 'gz'")
+                if logCompressionMethod not in logfile.COMPRESSION_METHODS:
+                    raise ValueError("logCompressionMethod needs to be one of "
+                        + ", ".join([ "'%s'" % m for m in
+                                      sorted(logfile.COMPRESSION_METHODS) ]))
+                logCompressionWorkers = config.get('logCompressionWorkers')
+                if logCompressionWorkers is not None and (not
+                        isinstance(logCompressionWorkers, int)
+                        or logCompressionWorkers < 1):
+                    raise ValueError("logCompressionWorkers needs to be None "
+                                     "or a positive int")
+                logCompressionProcesses = bool(
+                        config.get('logCompressionProcesses', False))
+                if logCompressionProcesses and not logcompressor.multiprocessing:
+                    raise ValueError("logCompressionProcesses requires the "
+                                     "multiprocessing module")
+                buildDirectoryLayout = config.get('buildDirectoryLayout',
+                                                  buildlayout.FLAT)
+                if buildDirectoryLayout not in buildlayout.LAYOUTS:
+                    raise ValueError("buildDirectoryLayout needs to be 'flat' "
+                                     "or 'sharded'")
+                buildPickleFormat = config.get('buildPickleFormat', build.FULL)
+                if buildPickleFormat not in build.PICKLE_FORMATS:
+                    raise ValueError("buildPickleFormat needs to be 'full' "
+                                     "or 'compact'")
                 logMaxSize = config.get('logMaxSize')
                 if logMaxSize is not None and not \
                         isinstance(logMaxSize, int):
@@ -485,6 +538,10 @@ class BuildMaster(service.MultiService):
             self.status.logCompressionMethod = logCompressionMethod
             self.status.logMaxSize = logMaxSize
             self.status.logMaxTailSize = logMaxTailSize
+            self.status.buildDirectoryLayout = buildDirectoryLayout
+            self.status.buildPickleFormat = buildPickleFormat
+            logcompressor.compressor.configure(logCompressionWorkers,
+                                               logCompressionProcesses)
             # Update any of our existing builders with the current log parameters.
             # This is required so that the new value is picked up after a
             # reconfig.
@@ -493,6 +550,9 @@ class BuildMaster(service.MultiService):
                 builder.builder_status.setLogCompressionMethod(logCompressionMethod)
                 builder.builder_status.setLogMaxSize(logMaxSize)
                 builder.builder_status.setLogMaxTailSize(logMaxTailSize)
+                builder.builder_status.setBuildDirectoryLayout(
+                                                    buildDirectoryLayout)
+                builder.builder_status.setBuildPickleFormat(buildPickleFormat)
 
             if mergeRequests is not None:
                 self.botmaster.mergeRequests = mergeRequests
@@ -500,6 +560,8 @@ class BuildMaster(service.MultiService):
                 self.botmaster.prioritizeBuilders = prioritizeBuilders
 
             self.buildCacheSize = buildCacheSize
+            self.buildCacheBytes = buildCacheBytes
+            self.status.setBuildCacheTotalBytes(buildCacheTotalBytes)
             self.changeCacheSize = changeCacheSize
             self.eventHorizon = eventHorizon
             self.logHorizon = logHorizon
@@ -508,7 +570,8 @@ class BuildMaster(service.MultiService):
 
             # Set up the database
             d.addCallback(lambda res:
-                          self.loadConfig_Database(db_url, db_poll_interval))
+                          self.loadConfig_Database(db_url, db_poll_interval,
+                                                   db_pool_size))
 
             # set up slaves
             d.addCallback(lambda res: self.loadConfig_Slaves(slaves))
@@ -577,11 +640,14 @@ class BuildMaster(service.MultiService):
             caches_config['changes'] = changeCacheSize
         self.caches.load_config(caches_config)
 
-    def loadDatabase(self, db_url, db_poll_interval=None):
+    def loadDatabase(self, db_url, db_poll_interval=None, db_pool_size=None):
         if self.db:
+            # the pool size, unlike the rest, can change on reconfig
+            self.db.pool.setPoolSize(db_pool_size)
             return
 
-        self.db = connector.DBConnector(self, db_url, self.basedir)
+        self.db = connector.DBConnector(self, db_url, self.basedir,
+                                        pool_size=db_pool_size)
         self.db.setServiceParent(self)
 
         # make sure it's up to date
@@ -618,10 +684,11 @@ class BuildMaster(service.MultiService):
         d.addCallback(set_up_db_dependents)
         return d
 
-    def loadConfig_Database(self, db_url, db_poll_interval):
+    def loadConfig_Database(self, db_url, db_poll_interval, db_pool_size=None):
         self.db_url = db_url
         self.db_poll_interval = db_poll_interval
-        return self.loadDatabase(db_url, db_poll_interval)
+        self.db_pool_size = db_pool_size
+        return self.loadDatabase(db_url, db_poll_interval, db_pool_size)
 
     def loadConfig_Slaves(self, new_slaves):
         return self.botmaster.loadConfig_Slaves(new_slaves)
@@ -917,14 +984,16 @@ class BuildMaster(service.MultiService):
         d.addCallback(notify)
         return d
 
-    def subscribeToChanges(self, callback):
+    def subscribeToChanges(self, callback, change_filter=None):
         """
         Request that C{callback} be called with each Change object added to the
-        cluster.
+        cluster.  If C{change_filter} is given, C{callback} is only called with
+        changes that might pass it (see L{routing.ChangeRouter}); it must
+        still check the filter itself.
 
         Note: this method will go away in 0.9.x
         """
-        return self._change_subs.subscribe(callback)
+        return self._change_subs.subscribe(callback, change_filter)
 
     def addBuildset(self, **kwargs):
         """
@@ -1096,27 +1165,50 @@ class BuildMaster(service.MultiService):
             timer.stop()
             return
 
-        while True:
-            changeid = self._last_processed_change + 1
+        # fetch the new changes in pages of ids, hydrating each page in bulk
+        # and checkpointing the state after each page, so that a restart
+        # during a long catch-up does not redeliver everything
+        wfd = defer.waitForDeferred(
+            self.db.changes.getLatestChangeid())
+        yield wfd
+        latest = wfd.getResult() or 0
+
+        while self._last_processed_change < latest:
+            first = self._last_processed_change + 1
+            last = min(first + self.CHANGE_POLL_PAGE_SIZE - 1, latest)
             wfd = defer.waitForDeferred(
-                self.db.changes.getChange(changeid))
+                self.db.changes.getChanges(range(first, last + 1)))
             yield wfd
-            chdict = wfd.getResult()
+            chdicts = wfd.getResult()
 
-            # if there's no such change, we've reached the end and can
-            # stop polling
-            if not chdict:
-                break
+            gap = False
+            for chdict in chdicts:
+                # if there's no such change, we've reached a gap and must
+                # stop until the next poll
+                if not chdict:
+                    gap = True
+                    break
 
-            wfd = defer.waitForDeferred(
-                changes.Change.fromChdict(self, chdict))
-            yield wfd
-            change = wfd.getResult()
+                wfd = defer.waitForDeferred(
+                    changes.Change.fromChdict(self, chdict))
+                yield wfd
+                change = wfd.getResult()
 
-            self._change_subs.deliver(change)
+                self._change_subs.deliver(change)
 
-            self._last_processed_change = changeid
-            need_setState = True
+                self._last_processed_change = chdict['changeid']
+                need_setState = True
+
+            if gap:
+                break
+
+            if need_setState and self._last_processed_change < latest:
+                wfd = defer.waitForDeferred(
+                    self._setState('last_processed_change',
+                                   self._last_processed_change))
+                yield wfd
+                wfd.getResult()
+                need_setState = False
 
         # write back the updated state, if it's changed
         if need_setState:
@@ -1129,6 +1221,8 @@ class BuildMaster(service.MultiService):
 
     _last_unclaimed_brids_set = None
     _last_claim_cleanup = None
+    _last_seen_brid = None
+    _last_unclaimed_sweep = None
     @defer.deferredGenerator
     def pollDatabaseBuildRequests(self):
         # deal with cleaning up unclaimed requests, and (if necessary)
@@ -1163,6 +1257,15 @@ class BuildMaster(service.MultiService):
         # the last poll, it notifies the subscribers.  It only tracks that
         # state within the master instance, though; on startup, it notifies for
         # all unclaimed requests in the database.
+        #
+        # Reading every unclaimed request on every poll is expensive, so most
+        # polls only read the requests above the high-water mark
+        # _last_seen_brid, the highest id seen so far, whether claimed or not.
+        # A full sweep of the incomplete requests every
+        # UNCLAIMED_SWEEP_INTERVAL replaces the whole set, so requests which
+        # have been claimed drop out, and those which were unclaimed after
+        # being claimed, or were committed out of ID order by another master,
+        # are notified.
 
         last_unclaimed = self._last_unclaimed_brids_set or set()
         if len(last_unclaimed) > self.WARNING_UNCLAIMED_COUNT:
@@ -1170,12 +1273,58 @@ class BuildMaster(service.MultiService):
                     "producing builds for which no builder is running?"
                     % len(last_unclaimed))
 
-        # get the current set of unclaimed buildrequests
-        wfd = defer.waitForDeferred(
-            self.db.buildrequests.getBuildRequests(claimed=False))
-        yield wfd
-        now_unclaimed_brdicts = wfd.getResult()
-        now_unclaimed = set([ brd['brid'] for brd in now_unclaimed_brdicts ])
+        now = reactor.seconds()
+        sweep = (self._last_seen_brid is None or
+                 now - self._last_unclaimed_sweep >=
+                                        self.UNCLAIMED_SWEEP_INTERVAL)
+        if sweep:
+            # read the high-water mark first, so that requests added during
+            # the sweep are picked up by the next incremental poll
+            wfd = defer.waitForDeferred(
+                self.db.buildrequests.getLatestBuildRequestId())
+            yield wfd
+            latest_brid = wfd.getResult()
+
+            # get all incomplete buildrequests; claimed requests are read too,
+            # so that the rows returned are the rows scanned (via the index on
+            # the complete column)
+            wfd = defer.waitForDeferred(
+                self.db.buildrequests.getBuildRequests(complete=False))
+            yield wfd
+            brdicts = wfd.getResult()
+            self._last_unclaimed_sweep = now
+            self._last_seen_brid = max(self._last_seen_brid, latest_brid, 0)
+
+            metrics.MetricCountEvent.log(
+                    "BuildMaster.pollDatabaseBuildRequests.sweep_rows_scanned",
+                    len(brdicts))
+        else:
+            # read every buildrequest added since the last poll, claimed or
+            # not, and move the high-water mark past all of them
+            wfd = defer.waitForDeferred(
+                self.db.buildrequests.getBuildRequests(
+                                    after_brid=self._last_seen_brid))
+            yield wfd
+            brdicts = wfd.getResult()
+            if brdicts:
+                self._last_seen_brid = max(self._last_seen_brid,
+                        max([ brd['brid'] for brd in brdicts ]))
+
+            metrics.MetricCountEvent.log("BuildMaster."
+                    "pollDatabaseBuildRequests.incremental_rows_scanned",
+                    len(brdicts))
+
+        now_unclaimed_brdicts = [ brd for brd in brdicts
+                        if not brd['claimed'] and not brd['complete'] ]
+        if sweep:
+            now_unclaimed = set()
+        else:
+            now_unclaimed = last_unclaimed - set([ brd['brid']
+                                                   for brd in brdicts ])
+        now_unclaimed.update([ brd['brid'] for brd in now_unclaimed_brdicts ])
+
+        metrics.MetricCountEvent.log(
+                "BuildMaster.pollDatabaseBuildRequests.polls", 1)
 
         # and store that for next time
         self._last_unclaimed_brids_set = now_unclaimed
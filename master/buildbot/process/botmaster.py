@@ -21,7 +21,7 @@ from twisted.spread import pb
 from twisted.application import service
 
 from buildbot.process.builder import Builder
-from buildbot import interfaces, locks
+from buildbot import interfaces, locks, util
 from buildbot.process import metrics
 
 class BotMaster(service.MultiService):
@@ -291,6 +291,9 @@ class BotMaster(service.MultiService):
 
     def startService(self):
         def buildRequestAdded(notif):
+            bldr = self.builders.get(notif['buildername'])
+            if bldr:
+                bldr.buildRequestAdded(notif['brid'])
             self.maybeStartBuildsForBuilder(notif['buildername'])
         self.buildrequest_sub = \
             self.master.subscribeToBuildRequests(buildRequestAdded)
@@ -355,8 +358,18 @@ class BuildRequestDistributor(service.Service):
     are still working on the previous build request, then this class will
     correctly re-prioritize invocations of builders' C{maybeStartBuild}
     methods.
+
+    Up to L{MAX_CONCURRENT_BUILDERS} builders' C{maybeStartBuild} methods run
+    at once, started in priority order.  Builders which share slaves compete
+    for the same resources, so a builder is not started while a builder with
+    any of the same slaves is running, or is waiting ahead of it in the
+    priority order.
     """
 
+    MAX_CONCURRENT_BUILDERS = 10
+    """maximum number of builders whose C{maybeStartBuild} methods may run at
+    the same time"""
+
     def __init__(self, botmaster):
         self.botmaster = botmaster
         self.master = botmaster.master
@@ -365,17 +378,29 @@ class BuildRequestDistributor(service.Service):
         self.pending_builders_lock = defer.DeferredLock()
 
         # sorted list of names of builders that need their maybeStartBuild
-        # method invoked.
+        # method invoked, and the time at which each was added
         self._pending_builders = []
-        self.activity_lock = defer.DeferredLock()
+        self._pending_since = {}
+
+        # builder name : set of slave names, for each builder whose
+        # maybeStartBuild method is running
+        self._active_builders = {}
+
+        # Deferred on which the activity loop waits for a builder to finish
+        # or for new pending builders; and Deferreds waiting for all active
+        # builders to finish
+        self._wakeup = None
+        self._idle_waiters = []
         self.active = False
 
     def stopService(self):
-        # let the parent stopService succeed between activity; then the loop
-        # will stop calling itself, since self.running is false
-        d = self.activity_lock.acquire()
-        d.addCallback(lambda _ : service.Service.stopService(self))
-        d.addBoth(lambda _ : self.activity_lock.release())
+        # stop starting builders immediately, but let the parent stopService
+        # succeed only once the active builders are finished
+        service.Service.stopService(self)
+        if not self._active_builders:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._idle_waiters.append(d)
         return d
 
     @defer.deferredGenerator
@@ -388,6 +413,7 @@ class BuildRequestDistributor(service.Service):
         @param new_builders: names of new builders that should be given the
         opportunity to check for new requests.
         """
+        now = util.now()
         new_builders = set(new_builders)
         existing_pending = set(self._pending_builders)
 
@@ -412,10 +438,17 @@ class BuildRequestDistributor(service.Service):
                 self._sortBuilders(list(existing_pending | new_builders)))
             yield wfd
             self._pending_builders = wfd.getResult()
+            since = self._pending_since
+            self._pending_since = dict((n, since.get(n, now))
+                                       for n in self._pending_builders)
+            self._logQueueDepth()
 
-            # start the activity loop, if we aren't already working on that.
+            # start the activity loop, if we aren't already working on that;
+            # otherwise, wake it up to look at the new pending builders
             if not self.active:
                 self._activityLoop()
+            else:
+                self._wake()
         except:
             log.err(Failure(),
                     "while attempting to start builds on %s" % self.name)
@@ -449,9 +482,10 @@ class BuildRequestDistributor(service.Service):
             return cmp(a,b)
         xformed.sort(cmp=nonecmp)
 
-        # and reverse the transform
-        yield [ xf[1] for xf in xformed ]
+        # and reverse the transform (stopping the timer first, as nothing
+        # after the final yield is executed)
         timer.stop()
+        yield [ xf[1] for xf in xformed ]
 
     @defer.deferredGenerator
     def _sortBuilders(self, buildernames):
@@ -482,8 +516,8 @@ class BuildRequestDistributor(service.Service):
             log.err(Failure())
 
         # and return the names
-        yield [ b.name for b in builders ]
         timer.stop()
+        yield [ b.name for b in builders ]
 
     @defer.deferredGenerator
     def _activityLoop(self):
@@ -493,42 +527,95 @@ class BuildRequestDistributor(service.Service):
         timer.start()
 
         while 1:
-            wfd = defer.waitForDeferred(
-                self.activity_lock.acquire())
-            yield wfd
-            wfd.getResult()
-
-            # lock pending_builders, pop an element from it, and release
+            # lock pending_builders and start as many as possible
             wfd = defer.waitForDeferred(
                 self.pending_builders_lock.acquire())
             yield wfd
             wfd.getResult()
 
-            # bail out if we shouldn't keep looping
-            if not self.running or not self._pending_builders:
-                self.pending_builders_lock.release()
-                self.activity_lock.release()
-                break
-
-            bldr_name = self._pending_builders.pop(0)
+            if self.running:
+                self._startPendingBuilders()
             self.pending_builders_lock.release()
 
-            try:
-                wfd = defer.waitForDeferred(
-                    self._callABuilder(bldr_name))
-                yield wfd
-                wfd.getResult()
-            except:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
-
-            self.activity_lock.release()
+            # bail out if we shouldn't keep looping
+            if not self._active_builders:
+                if not self.running or not self._pending_builders:
+                    break
+                continue
+
+            # wait for a builder to finish, or for new pending builders
+            self._wakeup = defer.Deferred()
+            wfd = defer.waitForDeferred(self._wakeup)
+            yield wfd
+            wfd.getResult()
 
         timer.stop()
 
         self.active = False
         self._quiet()
 
+    def _startPendingBuilders(self):
+        # walk the pending builders in priority order.  Slaves of running
+        # builders and of builders left waiting are marked busy, so that a
+        # builder never overtakes a higher-priority builder for a slave.
+        busy_slaves = set()
+        for slavenames in self._active_builders.itervalues():
+            busy_slaves.update(slavenames)
+
+        still_pending = []
+        for bldr_name in self._pending_builders:
+            if (not self.running or len(self._active_builders)
+                                    >= self.MAX_CONCURRENT_BUILDERS):
+                still_pending.append(bldr_name)
+                continue
+
+            bldr = self.botmaster.builders.get(bldr_name)
+            slavenames = set(bldr and bldr.slavenames or [])
+            if (bldr_name in self._active_builders
+                    or slavenames & busy_slaves):
+                still_pending.append(bldr_name)
+            else:
+                self._startBuilder(bldr_name, slavenames)
+            busy_slaves.update(slavenames)
+
+        self._pending_builders = still_pending
+        self._logQueueDepth()
+
+    def _startBuilder(self, bldr_name, slavenames):
+        since = self._pending_since.pop(bldr_name, None)
+        if since is not None:
+            metrics.MetricTimeEvent.log(
+                    'BuildRequestDistributor.dispatch_latency.%s' % bldr_name,
+                    util.now() - since)
+
+        self._active_builders[bldr_name] = slavenames
+        d = defer.maybeDeferred(self._callABuilder, bldr_name)
+        d.addErrback(log.err,
+                "from maybeStartBuild for builder '%s'" % (bldr_name,))
+        def finished(_):
+            del self._active_builders[bldr_name]
+            metrics.MetricCountEvent.log(
+                    'BuildRequestDistributor.active_builders',
+                    len(self._active_builders), absolute=True)
+            if not self._active_builders:
+                waiters, self._idle_waiters = self._idle_waiters, []
+                for waiter in waiters:
+                    waiter.callback(None)
+            self._wake()
+        d.addCallback(finished)
+        d.addErrback(log.err, 'while finishing builder %r' % (bldr_name,))
+
+    def _wake(self):
+        if self._wakeup:
+            d, self._wakeup = self._wakeup, None
+            d.callback(None)
+
+    def _logQueueDepth(self):
+        metrics.MetricCountEvent.log('BuildRequestDistributor.pending_builders',
+                len(self._pending_builders), absolute=True)
+        metrics.MetricCountEvent.log('BuildRequestDistributor.active_builders',
+                len(self._active_builders), absolute=True)
+
     def _callABuilder(self, bldr_name):
         # get the actual builder object
         bldr = self.botmaster.builders.get(bldr_name)
@@ -276,9 +276,20 @@ class Build:
         if self.stopped:
             return defer.succeed(None)
         log.msg("acquireLocks(build %s, locks %s)" % (self, self.locks))
-        for lock, access in self.locks:
-            if not lock.isAvailable(access):
+        # take the locks in a fixed order, keeping the reservations of the
+        # earlier ones while waiting for a later one, so that an owner
+        # needing several contended locks is not starved
+        ordered = sorted(self.locks, key=locks.lockOrder)
+        for i, (lock, access) in enumerate(ordered):
+            if not lock.isAvailable(self, access):
                 log.msg("Build %s waiting for lock %s" % (self, lock))
+                # give up any place in the queues of the later locks, so
+                # that they are not held up (or deadlocked) while this build
+                # waits for this one
+                for other_lock, other_access in ordered[i+1:]:
+                    if other_lock is not lock:
+                        other_lock.stopWaitingUntilAvailable(self,
+                                                             other_access)
                 d = lock.waitUntilMaybeAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
@@ -481,6 +492,10 @@ class Build:
         if self._acquiringLock:
             lock, access, d = self._acquiringLock
             lock.stopWaitingUntilAvailable(self, access, d)
+            # and any reservations of the locks acquired before it
+            for other_lock, other_access in self.locks:
+                if other_lock is not lock:
+                    other_lock.stopWaitingUntilAvailable(self, other_access)
             d.callback(None)
 
     def allStepsDone(self):
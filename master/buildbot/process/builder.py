@@ -27,6 +27,7 @@ from buildbot.status.builder import RETRY
 from buildbot.status.buildrequest import BuildRequestStatus
 from buildbot.process.properties import Properties
 from buildbot.process import buildrequest, slavebuilder
+from buildbot.process.buildrequestqueue import BuildRequestQueue
 from buildbot.process.slavebuilder import BUILDING
 from buildbot.db import buildrequests
 
@@ -67,6 +68,10 @@ class Builder(pb.Referenceable, service.MultiService):
 
     @type slaves: list of L{buildbot.buildslave.BuildSlave} objects
     @ivar slaves: the slaves currently available for building
+
+    @type pending_requests: L{BuildRequestQueue}
+    @ivar pending_requests: index of the unclaimed build requests for this
+                            builder
     """
 
     expectations = None # this is created the first time we get a good build
@@ -123,6 +128,9 @@ class Builder(pb.Referenceable, service.MultiService):
         # Build is about to start, to make sure that they're still alive.
         self.slaves = []
 
+        # unclaimed build requests, kept up to date incrementally
+        self.pending_requests = BuildRequestQueue(self)
+
         self.builder_status = builder_status
         self.builder_status.setSlavenames(self.slavenames)
         self.builder_status.buildHorizon = self.buildHorizon
@@ -192,26 +200,15 @@ class Builder(pb.Referenceable, service.MultiService):
     def __repr__(self):
         return "<Builder '%r' at %d>" % (self.name, id(self))
 
-    @defer.deferredGenerator
     def getOldestRequestTime(self):
-
         """Returns the submitted_at of the oldest unclaimed build request for
-        this builder, or None if there are no build requests.
+        this builder, or None if there are no build requests.  This is
+        maintained by L{pending_requests}, so the database is only consulted
+        when that index needs to be refreshed.
 
         @returns: datetime instance or None, via Deferred
         """
-        wfd = defer.waitForDeferred(
-            self.master.db.buildrequests.getBuildRequests(
-                        buildername=self.name, claimed=False))
-        yield wfd
-        unclaimed = wfd.getResult()
-
-        if unclaimed:
-            unclaimed = [ brd['submitted_at'] for brd in unclaimed ]
-            unclaimed.sort()
-            yield unclaimed[0]
-        else:
-            yield None
+        return self.pending_requests.getOldestRequestTime()
 
     def consumeTheSoulOfYourPredecessor(self, old):
         """Suck the brain out of an old Builder.
@@ -584,7 +581,20 @@ class Builder(pb.Referenceable, service.MultiService):
 
     def _resubmit_buildreqs(self, build):
         brids = [br.id for br in build.requests]
-        return self.db.buildrequests.unclaimBuildRequests(brids)
+        d = self.db.buildrequests.unclaimBuildRequests(brids)
+        # the requests are pending again
+        d.addCallback(lambda _ : self.pending_requests.refresh(brids))
+        return d
+
+    def buildRequestAdded(self, brid):
+        """
+        Note that a new build request has been added for this builder.  The
+        caller is responsible for subsequently calling
+        C{botmaster.maybeStartBuildsForBuilder}.
+
+        @param brid: ID of the new build request
+        """
+        self.pending_requests.addBrid(brid)
 
     def setExpectations(self, progress):
         """Mark the build as successful and update expectations for the next
@@ -625,20 +635,17 @@ class Builder(pb.Referenceable, service.MultiService):
             self.updateBigStatus()
             return
 
-        # now, get the available build requests
+        # now, get the available build requests, sorted by submitted_at so
+        # the first is the oldest
         wfd = defer.waitForDeferred(
-                self.master.db.buildrequests.getBuildRequests(
-                        buildername=self.name, claimed=False))
+                self.pending_requests.getRequests())
         yield wfd
-        unclaimed_requests = wfd.getResult()
+        unclaimed_requests = list(wfd.getResult())
 
         if not unclaimed_requests:
             self.updateBigStatus()
             return
 
-        # sort by submitted_at, so the first is the oldest
-        unclaimed_requests.sort(key=lambda brd : brd['submitted_at'])
-
         # get the mergeRequests function for later
         mergeRequests_fn = self._getMergeRequestsFn()
 
@@ -681,22 +688,25 @@ class Builder(pb.Referenceable, service.MultiService):
             brdicts = wfd.getResult()
 
             # try to claim the build requests
+            brids = [ brdict['brid'] for brdict in brdicts ]
             try:
                 wfd = defer.waitForDeferred(
-                        self.master.db.buildrequests.claimBuildRequests(
-                            [ brdict['brid'] for brdict in brdicts ]))
+                        self.master.db.buildrequests.claimBuildRequests(brids))
                 yield wfd
                 wfd.getResult()
             except buildrequests.AlreadyClaimedError:
                 # one or more of the build requests was already claimed;
-                # re-fetch the now-partially-claimed build requests and keep
-                # trying to match them
-                self._breakBrdictRefloops(unclaimed_requests)
+                # re-read just those requests and keep trying to match the
+                # remainder
+                wfd = defer.waitForDeferred(
+                        self.pending_requests.refresh(brids))
+                yield wfd
+                wfd.getResult()
+
                 wfd = defer.waitForDeferred(
-                        self.master.db.buildrequests.getBuildRequests(
-                                buildername=self.name, claimed=False))
+                        self.pending_requests.getRequests())
                 yield wfd
-                unclaimed_requests = wfd.getResult()
+                unclaimed_requests = list(wfd.getResult())
 
                 # go around the loop again
                 continue
@@ -716,12 +726,11 @@ class Builder(pb.Referenceable, service.MultiService):
 
             # and finally remove the buildrequests and slavebuilder from the
             # respective queues
-            self._breakBrdictRefloops(brdicts)
             for brdict in brdicts:
+                self.pending_requests.remove(brdict['brid'])
                 unclaimed_requests.remove(brdict)
             available_slavebuilders.remove(slavebuilder)
 
-        self._breakBrdictRefloops(unclaimed_requests)
         self.updateBigStatus()
         return
 
@@ -793,16 +802,35 @@ class Builder(pb.Referenceable, service.MultiService):
             yield [ breq ]
             return
 
-        # we'll need BuildRequest objects, so get those first
-        wfd = defer.waitForDeferred(
-            defer.gatherResults(
-                [ self._brdictToBuildRequest(brdict)
-                  for brdict in unclaimed_requests ]))
-        yield wfd
-        unclaimed_request_objects = wfd.getResult()
+        # we'll need BuildRequest objects, so get those first; most of them
+        # are already cached in their dictionaries
+        missing = [ brdict for brdict in unclaimed_requests
+                    if 'brobj' not in brdict ]
+        if missing:
+            wfd = defer.waitForDeferred(
+                defer.gatherResults(
+                    [ self._brdictToBuildRequest(brdict)
+                      for brdict in missing ]))
+            yield wfd
+            wfd.getResult()
+        unclaimed_request_objects = [ brdict['brobj']
+                                      for brdict in unclaimed_requests ]
         breq_object = unclaimed_request_objects.pop(
                 unclaimed_requests.index(breq))
 
+        # the default function is an equivalence relation on (memoized) merge
+        # keys, so the mergeable requests can be found without calling it
+        if mergeRequests_fn == buildrequest.BuildRequest.canBeMergedWith:
+            key = breq_object.getMergeKey()
+            if key is None:
+                yield [ breq ]
+                return
+            merged_request_objects = [breq_object] + [ br
+                    for br in unclaimed_request_objects
+                    if br.getMergeKey() == key ]
+            yield [ br.brdict for br in merged_request_objects ]
+            return
+
         # gather the mergeable requests
         merged_request_objects = [breq_object]
         for other_breq_object in unclaimed_request_objects:
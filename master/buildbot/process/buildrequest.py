@@ -138,6 +138,17 @@ class BuildRequest(object):
     def canBeMergedWith(self, other):
         return self.source.canBeMergedWith(other.source)
 
+    def getMergeKey(self):
+        """Return a hashable key such that two requests can be merged by
+        L{canBeMergedWith} exactly when their keys are equal, or None if this
+        request cannot be merged with any other.  The key is computed once,
+        since a request's source stamp does not change."""
+        try:
+            return self._merge_key
+        except AttributeError:
+            self._merge_key = key = self.source.getMergeKey()
+            return key
+
     def mergeWith(self, others):
         return self.source.mergeWith([o.source for o in others])
 
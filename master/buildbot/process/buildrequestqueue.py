@@ -0,0 +1,217 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import heapq
+from twisted.internet import defer, reactor
+from buildbot.process import metrics
+
+class BuildRequestQueue(object):
+    """
+    An in-memory index of the unclaimed build requests for a single builder,
+    ordered by submission time.  This allows L{Builder.maybeStartBuild} to find
+    pending requests without querying the entire buildrequests table each
+    time.
+
+    The index is kept up to date by the builder: new requests are announced
+    with L{addBrid}, requests claimed or completed by this master are dropped
+    with L{remove}, and requests whose state is uncertain (after a failed claim
+    or an unclaim) are re-read with L{refresh}.  Requests claimed by other
+    masters cannot be seen directly, so the index is reconciled with the
+    database every L{RECONCILE_INTERVAL} seconds, or immediately after
+    L{invalidate}.
+
+    Build request dictionaries in the index may carry a cached C{brobj}
+    attribute (see L{Builder._brdictToBuildRequest}); the reference loop is
+    broken when the request leaves the index.
+    """
+
+    RECONCILE_INTERVAL = 5*60
+    """maximum interval, in seconds, between full reads of this builder's
+    unclaimed build requests from the database"""
+
+    # for testing
+    _reactor = reactor
+
+    def __init__(self, builder):
+        self.builder = builder
+
+        # brid : brdict
+        self.brdicts = {}
+        # heap of (submitted_at, brid); entries for brids not in self.brdicts
+        # are stale and are skipped
+        self.heap = []
+        # announced brids which have not yet been read from the database
+        self.unfetched = set()
+
+        self.last_reconcile = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.brdicts)
+
+    def invalidate(self):
+        """Arrange for the next call to L{getRequests} to re-read all of this
+        builder's unclaimed build requests from the database."""
+        self.last_reconcile = None
+
+    def addBrid(self, brid):
+        """Announce a new build request, which will be read from the database
+        on the next call to L{getRequests}."""
+        if brid not in self.brdicts:
+            self.unfetched.add(brid)
+
+    def add(self, brdict):
+        """Add or replace an unclaimed build request dictionary."""
+        brid = brdict['brid']
+        self.unfetched.discard(brid)
+        old = self.brdicts.get(brid)
+        if old is not None:
+            if old['submitted_at'] == brdict['submitted_at']:
+                # keep the existing dictionary and its cached BuildRequest
+                return
+            self._forget(old)
+        self.brdicts[brid] = brdict
+        heapq.heappush(self.heap, (brdict['submitted_at'], brid))
+        self._sorted = None
+
+    def remove(self, brid):
+        """Remove a build request from the index, e.g., because it has been
+        claimed."""
+        self.unfetched.discard(brid)
+        brdict = self.brdicts.pop(brid, None)
+        if brdict is not None:
+            self._forget(brdict)
+            self._sorted = None
+
+    def getOldest(self):
+        """Return the oldest build request dictionary in the index, or None.
+        Note that this does not consider unfetched build requests."""
+        heap = self.heap
+        while heap:
+            submitted_at, brid = heap[0]
+            brdict = self.brdicts.get(brid)
+            if brdict is not None and brdict['submitted_at'] == submitted_at:
+                return brdict
+            heapq.heappop(heap)
+        return None
+
+    @defer.deferredGenerator
+    def refresh(self, brids):
+        """
+        Re-read the given build requests from the database, adding those that
+        are unclaimed and removing the rest.
+
+        @param brids: build request IDs to refresh
+        @returns: Deferred
+        """
+        db = self.builder.master.db
+        for brid in brids:
+            wfd = defer.waitForDeferred(
+                db.buildrequests.getBuildRequest(brid))
+            yield wfd
+            self._update(brid, wfd.getResult())
+
+    @defer.deferredGenerator
+    def getRequests(self):
+        """
+        Get the unclaimed build requests for this builder, sorted by
+        submission time, oldest first.  The caller must not modify the
+        resulting list.
+
+        @returns: list of build request dictionaries, via Deferred
+        """
+        wfd = defer.waitForDeferred(
+            self._bringUpToDate())
+        yield wfd
+        wfd.getResult()
+
+        if self._sorted is None:
+            self._sorted = [ self.brdicts[brid]
+                             for _, brid in sorted(self.heap)
+                             if brid in self.brdicts ]
+            # compact the heap while we're at it
+            self.heap = [ (brd['submitted_at'], brd['brid'])
+                          for brd in self._sorted ]
+        yield self._sorted
+
+    @defer.deferredGenerator
+    def getOldestRequestTime(self):
+        """
+        Get the submission time of the oldest unclaimed build request for this
+        builder.  This only queries the database if the index is due for
+        reconciliation or has unfetched build requests.
+
+        @returns: datetime instance or None, via Deferred
+        """
+        wfd = defer.waitForDeferred(
+            self._bringUpToDate())
+        yield wfd
+        wfd.getResult()
+
+        brdict = self.getOldest()
+        if brdict:
+            yield brdict['submitted_at']
+        else:
+            yield None
+
+    @defer.deferredGenerator
+    def reconcile(self):
+        """
+        Re-read all of this builder's unclaimed build requests from the
+        database.
+
+        @returns: Deferred
+        """
+        self.last_reconcile = self._reactor.seconds()
+        self.unfetched.clear()
+        db = self.builder.master.db
+        wfd = defer.waitForDeferred(
+            db.buildrequests.getBuildRequests(
+                buildername=self.builder.name, claimed=False))
+        yield wfd
+        brdicts = wfd.getResult()
+        metrics.MetricCountEvent.log(
+                "BuildRequestQueue.reconciled_requests", len(brdicts))
+
+        seen = set()
+        for brdict in brdicts:
+            seen.add(brdict['brid'])
+            self.add(brdict)
+        for brid in self.brdicts.keys():
+            if brid not in seen:
+                self.remove(brid)
+
+    def _bringUpToDate(self):
+        now = self._reactor.seconds()
+        if (self.last_reconcile is None or
+                now - self.last_reconcile >= self.RECONCILE_INTERVAL):
+            return self.reconcile()
+        elif self.unfetched:
+            return self.refresh(sorted(self.unfetched))
+        return defer.succeed(None)
+
+    def _update(self, brid, brdict):
+        if (brdict is None or brdict['claimed'] or brdict['complete']
+                or brdict['buildername'] != self.builder.name):
+            self.remove(brid)
+        else:
+            self.add(brdict)
+
+    def _forget(self, brdict):
+        # break the reference loop created by Builder._brdictToBuildRequest
+        try:
+            del brdict['brobj'].brdict
+        except (KeyError, AttributeError):
+            pass
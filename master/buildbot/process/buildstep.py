@@ -250,6 +250,17 @@ class RemoteCommand(pb.Referenceable):
 
         return maybeFailure
 
+def _estimateSize(value):
+    # rough size, in bytes, of the data in an update value
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum([ _estimateSize(v) for v in value ])
+    if isinstance(value, dict):
+        return sum([ _estimateSize(k) + _estimateSize(v)
+                     for k, v in value.iteritems() ])
+    return 8
+
 class LoggedRemoteCommand(RemoteCommand):
     """
 
@@ -267,7 +278,13 @@ class LoggedRemoteCommand(RemoteCommand):
     Unless you tell me otherwise, when my command completes I will close all
     the LogFiles that I know about.
 
+    Other updates from the slave are kept in C{self.updates}, according to
+    the retention policy for their key in C{updateRetention}.  Log data is
+    only sent to the LogFiles, and is not retained.
+
     @ivar logs: maps logname to a LogFile instance
+    @ivar updates: maps update key to a list of the retained values for
+                   that key, oldest first
     @ivar _closeWhenFinished: maps logname to a boolean. If true, this
                               LogFile will be closed when the RemoteCommand
                               finishes. LogFiles which are shared between
@@ -278,10 +295,36 @@ class LoggedRemoteCommand(RemoteCommand):
     rc = None
     debug = False
 
+    UPDATE_KEEP_LAST = 'keep-last'
+    """retention policy: keep only the most recent value for the key"""
+
+    UPDATE_AGGREGATE = 'aggregate'
+    """retention policy: keep every value for the key"""
+
+    UPDATE_DISCARD = 'discard'
+    """retention policy: do not keep values for the key once they have been
+    handled"""
+
+    updateRetention = {
+        'stdout' : UPDATE_DISCARD,
+        'stderr' : UPDATE_DISCARD,
+        'header' : UPDATE_DISCARD,
+        'log' : UPDATE_DISCARD,
+        'rc' : UPDATE_DISCARD,
+        'elapsed' : UPDATE_KEEP_LAST,
+        'stat' : UPDATE_KEEP_LAST,
+        'got_revision' : UPDATE_KEEP_LAST,
+        'repo_downloaded' : UPDATE_KEEP_LAST,
+    }
+    """retention policy for each update key; keys not listed here are
+    aggregated.  Use L{setUpdateRetention} to change this for one command."""
+
     def __init__(self, *args, **kwargs):
         self.logs = {}
         self.delayedLogs = {}
         self._closeWhenFinished = {}
+        self.updates = {}
+        self._updateSizes = {}
         RemoteCommand.__init__(self, *args, **kwargs)
 
     def __repr__(self):
@@ -326,6 +369,26 @@ class LoggedRemoteCommand(RemoteCommand):
         assert logfileName not in self.delayedLogs
         self.delayedLogs[logfileName] = (activateCallBack, closeWhenFinished)
 
+    def setUpdateRetention(self, key, policy):
+        """
+        Set the retention policy for values of an update key from the slave,
+        for this command only.
+
+        @param key: update key, e.g., 'got_revision'
+        @param policy: one of L{UPDATE_KEEP_LAST}, L{UPDATE_AGGREGATE}, or
+                       L{UPDATE_DISCARD}
+        """
+        assert policy in (self.UPDATE_KEEP_LAST, self.UPDATE_AGGREGATE,
+                          self.UPDATE_DISCARD)
+        if 'updateRetention' not in self.__dict__:
+            self.updateRetention = self.updateRetention.copy()
+        self.updateRetention[key] = policy
+
+    def getRetainedUpdateSize(self):
+        """Return the approximate size, in bytes, of the values retained in
+        C{self.updates}."""
+        return sum(self._updateSizes.values())
+
     def start(self):
         log.msg("LoggedRemoteCommand.start")
         if 'stdio' not in self.logs:
@@ -333,6 +396,7 @@ class LoggedRemoteCommand(RemoteCommand):
                     "it isn't being logged to anything. This seems unusual."
                     % self)
         self.updates = {}
+        self._updateSizes = {}
         self._startTime = util.now()
         return RemoteCommand.start(self)
 
@@ -386,15 +450,23 @@ class LoggedRemoteCommand(RemoteCommand):
             self._remoteElapsed = update['elapsed']
 
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
-                if k not in self.updates:
-                    self.updates[k] = []
+            policy = self.updateRetention.get(k, self.UPDATE_AGGREGATE)
+            if policy == self.UPDATE_DISCARD:
+                continue
+            size = _estimateSize(update[k])
+            if policy == self.UPDATE_KEEP_LAST or k not in self.updates:
+                self.updates[k] = [ update[k] ]
+                self._updateSizes[k] = size
+            else:
                 self.updates[k].append(update[k])
+                self._updateSizes[k] += size
 
     def remoteComplete(self, maybeFailure):
         if self._startTime and self._remoteElapsed:
             delta = (util.now() - self._startTime) - self._remoteElapsed
             metrics.MetricTimeEvent.log("LoggedRemoteCommand.overhead", delta)
+        metrics.MetricHistogramEvent.log("LoggedRemoteCommand.retained_updates",
+                self.getRetainedUpdateSize())
 
         for name,loog in self.logs.items():
             if self._closeWhenFinished[name]:
@@ -448,6 +520,10 @@ class LogLineObserver(LogObserver):
         self.stderrParser.lineReceived = self.errLineReceived
         self.stderrParser.transport = self
 
+        # whether each parser holds an unterminated line, for flushLines
+        self._partial = { self.stdoutParser : False,
+                          self.stderrParser : False }
+
     def setMaxLineLength(self, max_length):
         """
         Set the maximum line length: lines longer than max_length are
@@ -458,10 +534,26 @@ class LogLineObserver(LogObserver):
         self.stderrParser.MAX_LENGTH = max_length
 
     def outReceived(self, data):
-        self.stdoutParser.dataReceived(data)
+        self._lineDataReceived(self.stdoutParser, data)
 
     def errReceived(self, data):
-        self.stderrParser.dataReceived(data)
+        self._lineDataReceived(self.stderrParser, data)
+
+    def _lineDataReceived(self, parser, data):
+        if data:
+            self._partial[parser] = not data.endswith(parser.delimiter)
+        parser.dataReceived(data)
+
+    def flushLines(self):
+        """
+        Deliver any unterminated final lines, as if they had been followed by
+        a delimiter.  Call this once the log is complete, e.g., from
+        createSummary.
+        """
+        for parser in (self.stdoutParser, self.stderrParser):
+            if self._partial[parser]:
+                self._partial[parser] = False
+                parser.dataReceived(parser.delimiter)
 
     def outLineReceived(self, line):
         """This will be called with complete stdout lines (not including the
@@ -483,7 +575,8 @@ class RemoteShellCommand(LoggedRemoteCommand):
     def __init__(self, workdir, command, env=None,
                  want_stdout=1, want_stderr=1,
                  timeout=20*60, maxTime=None, logfiles={},
-                 usePTY="slave-config", logEnviron=True):
+                 usePTY="slave-config", logEnviron=True,
+                 bufferTimeout=None, maxBufferSize=None):
         """
         @type  workdir: string
         @param workdir: directory where the command ought to run,
@@ -529,6 +622,14 @@ class RemoteShellCommand(LoggedRemoteCommand):
         @param maxTime: tell the remote that if the command fails to complete
                         in this number of seconds, the command should be
                         killed.  Use None to disable maxTime.
+
+        @param bufferTimeout: longest time, in seconds, that the slave should
+                              hold output before sending it.  None uses the
+                              slave's default.
+
+        @param maxBufferSize: largest amount of output, in bytes, that the
+                              slave should collect before sending it.  None
+                              uses the slave's default.
         """
 
         self.command = command # stash .command, set it later
@@ -547,6 +648,12 @@ class RemoteShellCommand(LoggedRemoteCommand):
                 'usePTY': usePTY,
                 'logEnviron': logEnviron,
                 }
+        # only send the buffering options if they are given, as older slaves
+        # do not know about them
+        if bufferTimeout is not None:
+            args['bufferTimeout'] = bufferTimeout
+        if maxBufferSize is not None:
+            args['maxBufferSize'] = maxBufferSize
         LoggedRemoteCommand.__init__(self, "shell", args)
 
     def start(self):
@@ -769,10 +876,21 @@ class BuildStep:
         if self.stopped:
             return defer.succeed(None)
         log.msg("acquireLocks(step %s, locks %s)" % (self, self.locks))
-        for lock, access in self.locks:
-            if not lock.isAvailable(access):
+        # take the locks in a fixed order, keeping the reservations of the
+        # earlier ones while waiting for a later one, so that an owner
+        # needing several contended locks is not starved
+        ordered = sorted(self.locks, key=locks.lockOrder)
+        for i, (lock, access) in enumerate(ordered):
+            if not lock.isAvailable(self, access):
                 self.step_status.setWaitingForLocks(True)
                 log.msg("step %s waiting for lock %s" % (self, lock))
+                # give up any place in the queues of the later locks, so
+                # that they are not held up (or deadlocked) while this step
+                # waits for this one
+                for other_lock, other_access in ordered[i+1:]:
+                    if other_lock is not lock:
+                        other_lock.stopWaitingUntilAvailable(self,
+                                                             other_access)
                 d = lock.waitUntilMaybeAvailable(self, access)
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
@@ -895,6 +1013,10 @@ class BuildStep:
         if self._acquiringLock:
             lock, access, d = self._acquiringLock
             lock.stopWaitingUntilAvailable(self, access, d)
+            # and any reservations of the locks acquired before it
+            for other_lock, other_access in self.locks:
+                if other_lock is not lock:
+                    other_lock.stopWaitingUntilAvailable(self, other_access)
             d.callback(None)
 
     def releaseLocks(self):
@@ -1284,6 +1406,15 @@ class LoggingBuildStep(BuildStep):
 #   ...,
 #   log_eval_func=lambda c,s: regex_log_evaluator(c, s, regexs)
 # )
+#
+# Logs are searched a line at a time, so ^ and $ match at the beginning and
+# end of each line.  Patterns which can match across lines - those compiled
+# with re.DOTALL or re.MULTILINE, or containing a newline - are searched
+# against the whole text of each log, as before.
+def _matchesAcrossLines(regex):
+    return bool(regex.flags & (re.DOTALL | re.MULTILINE)
+                or "\n" in regex.pattern or r"\n" in regex.pattern)
+
 def regex_log_evaluator(cmd, step_status, regexes):
     worst = SUCCESS
     if cmd.rc != 0:
@@ -1294,10 +1425,17 @@ def regex_log_evaluator(cmd, step_status, regexes):
         # so we don't even need to check the log if that's the case
         if worst_status(worst, possible_status) == possible_status:
             if isinstance(err, (basestring)):
-                err = re.compile(".*%s.*" % err, re.DOTALL)
+                err = re.compile(err)
+            if _matchesAcrossLines(err):
+                for l in cmd.logs.values():
+                    if err.search(l.getText()):
+                        worst = possible_status
+                continue
             for l in cmd.logs.values():
-                if err.search(l.getText()):
-                    worst = possible_status
+                for line in l.iterLines():
+                    if err.search(line):
+                        worst = possible_status
+                        break
     return worst
 
 
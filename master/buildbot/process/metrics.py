@@ -65,6 +65,11 @@ class MetricTimeEvent(MetricEvent):
         self.timer = timer
         self.elapsed = elapsed
 
+class MetricHistogramEvent(MetricEvent):
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
 ALARM_OK, ALARM_WARN, ALARM_CRIT = range(3)
 ALARM_TEXT = ["OK", "WARN", "CRIT"]
 
@@ -153,6 +158,50 @@ class AveragingFiniteList(FiniteList):
 
         return self.average
 
+class Histogram(object):
+    """
+    A distribution of values (usually times, in seconds), counted in buckets
+    whose upper bounds double from 1ms.  Adding a value is cheap, and the
+    memory used does not grow with the number of values.
+    """
+    BOUNDS = [ 0.001 * 2**i for i in range(16) ] # 1ms .. ~33s
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        i = 0
+        for bound in self.BOUNDS:
+            if value <= bound:
+                break
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        if not self.count:
+            return 0
+        return float(self.total) / self.count
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket containing the given
+        percentile, or the maximum value if that is in the last bucket."""
+        if not self.count:
+            return 0
+        threshold = self.count * pct / 100.0
+        seen = 0
+        for bound, n in zip(self.BOUNDS, self.buckets):
+            seen += n
+            if seen >= threshold:
+                return min(bound, self.max)
+        return self.max
+
 class MetricHandler(object):
     def __init__(self, metrics):
         self.metrics = metrics
@@ -240,6 +289,40 @@ class MetricTimeHandler(MetricHandler):
             retval[timer] = self.get(timer)
         return dict(timers=retval)
 
+class MetricHistogramHandler(MetricHandler):
+    _histograms = None
+    def reset(self):
+        self._histograms = defaultdict(Histogram)
+
+    def handle(self, eventDict, metric):
+        self._histograms[metric.histogram].add(metric.value)
+
+    def keys(self):
+        return self._histograms.keys()
+
+    def get(self, histogram):
+        return self._histograms[histogram]
+
+    def report(self):
+        retval = []
+        for name in sorted(self.keys()):
+            h = self.get(name)
+            retval.append("Histogram %s: count=%i mean=%.3g p50=%.3g "
+                    "p90=%.3g p99=%.3g max=%.3g" % (name, h.count, h.mean(),
+                        h.percentile(50), h.percentile(90),
+                        h.percentile(99), h.max))
+        return "\n".join(retval)
+
+    def asDict(self):
+        retval = {}
+        for name in sorted(self.keys()):
+            h = self.get(name)
+            retval[name] = dict(count=h.count, mean=h.mean(), max=h.max,
+                    p50=h.percentile(50), p90=h.percentile(90),
+                    p99=h.percentile(99),
+                    buckets=zip(h.BOUNDS + [None], h.buckets))
+        return dict(histograms=retval)
+
 class MetricAlarmHandler(MetricHandler):
     _alarms = None
     def reset(self):
@@ -376,6 +459,8 @@ class MetricLogObserver(service.MultiService):
         self.registerHandler(MetricCountEvent, MetricCountHandler(self))
         self.registerHandler(MetricTimeEvent, MetricTimeHandler(self))
         self.registerHandler(MetricAlarmEvent, MetricAlarmHandler(self))
+        self.registerHandler(MetricHistogramEvent,
+                MetricHistogramHandler(self))
 
         # Make sure our changes poller is behaving
         self.getHandler(MetricTimeEvent).addWatcher(PollerWatcher(self))
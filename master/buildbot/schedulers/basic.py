@@ -102,6 +102,9 @@ class BaseBasicScheduler(base.BaseScheduler):
             self._stable_timers = {}
             self._stable_timers_lock.release()
         d.addCallback(cancel_timers)
+        # make sure that the changes classified so far are recorded
+        d.addCallback(lambda _ :
+                self.master.db.schedulers.waitForQueuedClassifications())
         return d
 
     @util.deferredLocked('_stable_timers_lock')
@@ -122,25 +125,38 @@ class BaseBasicScheduler(base.BaseScheduler):
         # and:
         # - for an important change, start the timer
         # - for an unimportant change, reset the timer if it is running
-        d = self.master.db.schedulers.classifyChanges(
+        #
+        # The classification is queued, to be written along with others that
+        # arrive at about the same time, rather than written before the next
+        # change can be handled; the database reads done when the timer fires
+        # wait for queued classifications to be written.
+        d = self.master.db.schedulers.queueChangeClassifications(
                 self.schedulerid, { change.number : important })
-        def fix_timer(_):
-            if not important and not self._stable_timers[timer_name]:
-                return
-            if self._stable_timers[timer_name]:
-                self._stable_timers[timer_name].cancel()
-            self._stable_timers[timer_name] = self._reactor.callLater(
-                    self.treeStableTimer, self.stableTimerFired, timer_name)
-        d.addCallback(fix_timer)
-        return d
+        d.addErrback(log.err, 'while classifying change %d' % change.number)
+
+        if important or self._stable_timers[timer_name]:
+            self._startStableTimer(timer_name)
+        return defer.succeed(None)
+
+    def _startStableTimer(self, timer_name):
+        # (re)start the named treeStableTimer; call with _stable_timers_lock
+        # held
+        if self._stable_timers.get(timer_name):
+            self._stable_timers[timer_name].cancel()
+        self._stable_timers[timer_name] = self._reactor.callLater(
+                self.treeStableTimer, self.stableTimerFired, timer_name)
 
     @defer.deferredGenerator
     def scanExistingClassifiedChanges(self):
-        # call gotChange for each classified change.  This is called at startup
-        # and is intended to re-start the treeStableTimer for any changes that
-        # had not yet been built when the scheduler was stopped.
-
-        # NOTE: this may double-call gotChange for changes that arrive just as
+        # re-start the treeStableTimer for any classified changes that had not
+        # yet been built when the scheduler was stopped.  This is called at
+        # startup.  The classifications are already in the database, so
+        # rather than calling gotChange for each change, the changes are
+        # fetched in bulk and the timers for those with important changes are
+        # started directly -- just as a series of gotChange calls would leave
+        # them.
+
+        # NOTE: this may restart the timer for a change that arrives just as
         # the scheduler starts up.  In practice, this doesn't hurt anything.
         wfd = defer.waitForDeferred(
             self.master.db.schedulers.getChangeClassifications(
@@ -148,25 +164,38 @@ class BaseBasicScheduler(base.BaseScheduler):
         yield wfd
         classifications = wfd.getResult()
 
-        # call gotChange for each change, after first fetching it from the db
-        for changeid, important in classifications.iteritems():
-            wfd = defer.waitForDeferred(
-                self.master.db.changes.getChange(changeid))
-            yield wfd
-            chdict = wfd.getResult()
-
-            if not chdict:
-                continue
-
-            wfd = defer.waitForDeferred(
-                changes.Change.fromChdict(self.master, chdict))
-            yield wfd
-            change = wfd.getResult()
-
-            wfd = defer.waitForDeferred(
-                self.gotChange(change, important))
-            yield wfd
-            wfd.getResult()
+        if not classifications:
+            return
+
+        wfd = defer.waitForDeferred(
+            self.master.db.changes.getChanges(sorted(classifications)))
+        yield wfd
+        chdicts = wfd.getResult()
+
+        wfd = defer.waitForDeferred(
+            defer.gatherResults([
+                changes.Change.fromChdict(self.master, chdict)
+                for chdict in chdicts if chdict ]))
+        yield wfd
+        changelist = wfd.getResult()
+
+        timer_names = []
+        for change in changelist:
+            timer_name = self.getTimerNameForChange(change)
+            if classifications[change.number] and \
+                    timer_name not in timer_names:
+                timer_names.append(timer_name)
+
+        wfd = defer.waitForDeferred(
+            self._startStableTimers(timer_names))
+        yield wfd
+        wfd.getResult()
+
+    @util.deferredLocked('_stable_timers_lock')
+    def _startStableTimers(self, timer_names):
+        for timer_name in timer_names:
+            self._startStableTimer(timer_name)
+        return defer.succeed(None)
 
     def getTimerNameForChange(self, change):
         raise NotImplementedError # see subclasses
@@ -13,7 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
-import time
+import time, calendar
 from buildbot import util
 from buildbot.schedulers import base
 from twisted.internet import defer, reactor
@@ -224,6 +224,60 @@ class Periodic(Timed):
     def startBuild(self):
         return self.addBuildsetForLatest(reason=self.reason, branch=self.branch)
 
+def _fieldValues(spec, low, high):
+    # return the values from low to high, inclusive, matching a Nightly
+    # field spec: '*', an int, or a collection of ints
+    if spec == '*':
+        return range(low, high + 1)
+    if isinstance(spec, int):
+        spec = [ spec ]
+    return sorted([ v for v in set(spec) if low <= v <= high ])
+
+def _localTimes(date, hour, minute):
+    # return the timestamps at which the local time is the given minute of the
+    # given date: usually one, but none if a DST transition skips it, and two
+    # if a transition repeats it
+    fields = date + (hour, minute)
+    times = []
+    # let mktime choose the DST flag, then, if this timezone has DST, try the
+    # other flag (this is slow in timezones without DST)
+    t = time.mktime(fields + (0, 0, 0, -1))
+    tt = time.localtime(t)
+    if tt[:5] == fields:
+        times.append(t)
+    if time.daylight:
+        t = time.mktime(fields + (0, 0, 0, 1 - tt[8]))
+        if time.localtime(t)[:5] == fields and t not in times:
+            times.append(t)
+        times.sort()
+    return times
+
+def _firstTimeOfDay(date, hours, minutes, start, isStartDay):
+    # return the first timestamp at or after start, on the given date, with
+    # one of the given hours and minutes, or None.  The first occurrences of
+    # a day's local times are in order, but a repeated local time may occur
+    # again after later local times have occurred.
+    best = None
+    for hour in hours:
+        if isStartDay:
+            # skip hours that are over before start
+            times = _localTimes(date, hour, 59)
+            if times and times[-1] < start:
+                continue
+        for minute in minutes:
+            times = _localTimes(date, hour, minute)
+            if not times:
+                continue
+            if times[0] >= start:
+                # no later local time can occur earlier than this
+                if best is None or times[0] < best:
+                    best = times[0]
+                return best
+            for t in times[1:]:
+                if t >= start and (best is None or t < best):
+                    best = t
+    return best
+
 class Nightly(Timed):
     compare_attrs = (Timed.compare_attrs
             + ('minute', 'hour', 'dayOfMonth', 'month',
@@ -276,55 +330,55 @@ class Nightly(Timed):
         return self.master.db.schedulers.classifyChanges(
                 self.schedulerid, { change.number : important })
 
-    def getNextBuildTime(self, lastActuated):
-        def addTime(timetuple, secs):
-            return time.localtime(time.mktime(timetuple)+secs)
-
-        def check(ourvalue, value):
-            if ourvalue == '*': return True
-            if isinstance(ourvalue, int): return value == ourvalue
-            return (value in ourvalue)
+    # years to search for a matching time; a schedule for February 29th may
+    # not match for up to 8 years
+    searchYears = 9
 
+    def getNextBuildTime(self, lastActuated):
         dateTime = time.localtime(lastActuated or self.now())
-
-        # Remove seconds by advancing to at least the next minute
-        dateTime = addTime(dateTime, 60-dateTime[5])
-
-        # Now we just keep adding minutes until we find something that matches
-        # TODO: use a smarter algorithm, now that we have thorough tests
-
-        yearLimit = dateTime[0]+2 # only check 2 years (a lot of minutes!)
-        def isRunTime(timetuple):
-
-            if not check(self.minute, timetuple[4]):
-                return False
-
-            if not check(self.hour, timetuple[3]):
-                return False
-
-            if not check(self.month, timetuple[1]):
-                return False
-
-            if self.dayOfMonth != '*' and self.dayOfWeek != '*':
-                # They specified both day(s) of month AND day(s) of week.
-                # This means that we only have to match one of the two. If
-                # neither one matches, this time is not the right time.
-                if not (check(self.dayOfMonth, timetuple[2]) or
-                        check(self.dayOfWeek, timetuple[6])):
-                    return False
-            else:
-                if not check(self.dayOfMonth, timetuple[2]):
-                    return False
-
-                if not check(self.dayOfWeek, timetuple[6]):
-                    return False
-
-            return True
-
-        while not isRunTime(dateTime):
-            dateTime = addTime(dateTime, 60)
-            assert dateTime[0] < yearLimit, 'Something is wrong with this code'
-        return defer.succeed(time.mktime(dateTime))
+        # the next build time is strictly later, and on a whole minute
+        start = time.mktime(dateTime) + 60 - dateTime[5]
+        return defer.succeed(self._nextRunTime(start))
+
+    def _nextRunTime(self, start):
+        # Rather than trying every minute until one matches, try only the
+        # matching months, days of those months, and hours and minutes of
+        # those days, in order.  Each day's times are converted to timestamps
+        # individually, so that local times that are skipped or repeated by
+        # DST transitions are handled correctly.
+        startTuple = time.localtime(start)
+        months = _fieldValues(self.month, 1, 12)
+        hours = _fieldValues(self.hour, 0, 23)
+        minutes = _fieldValues(self.minute, 0, 59)
+        for year in range(startTuple[0], startTuple[0] + self.searchYears):
+            for month in months:
+                if (year, month) < startTuple[:2]:
+                    continue
+                for day in self._matchingDays(year, month):
+                    date = (year, month, day)
+                    if date < startTuple[:3]:
+                        continue
+                    runTime = _firstTimeOfDay(date, hours, minutes, start,
+                                              date == startTuple[:3])
+                    if runTime is not None:
+                        return runTime
+        assert 0, 'Nightly scheduler %s never runs' % (self.name,)
+
+    def _matchingDays(self, year, month):
+        # return the matching days of the given month, in order
+        ndays = calendar.monthrange(year, month)[1]
+        days = _fieldValues(self.dayOfMonth, 1, ndays)
+        if self.dayOfWeek == '*':
+            return days
+        daysOfWeek = _fieldValues(self.dayOfWeek, 0, 6)
+        firstWeekday = calendar.weekday(year, month, 1)
+        weekdays = [ d for d in range(1, ndays + 1)
+                     if (firstWeekday + d - 1) % 7 in daysOfWeek ]
+        if self.dayOfMonth == '*':
+            return weekdays
+        # they specified both day(s) of month AND day(s) of week, so only
+        # one of the two has to match
+        return sorted(set(days) | set(weekdays))
 
     @defer.deferredGenerator
     def startBuild(self):
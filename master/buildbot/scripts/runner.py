@@ -512,6 +512,46 @@ def upgradeMaster(config):
         yield rc
 
 
+class MigrateBuildsOptions(MakerBase):
+    optParameters = [
+        ["layout", "l", "sharded",
+         "directory layout to move build files into: 'sharded' or 'flat'"],
+        ]
+
+    def getSynopsis(self):
+        return "Usage:    buildbot migrate-builds [options] [<basedir>]"
+
+    longdesc = """
+    This command moves the build pickles and logfiles in each builder
+    directory of a buildmaster into the given layout.  In the 'flat' layout,
+    all files are kept directly in the builder directory; in the 'sharded'
+    layout, they are kept in a subdirectory for every thousand builds.
+
+    Files are moved one at a time, and the buildmaster finds files in either
+    layout, so this can be run while the buildmaster is running.  Set
+    c['buildDirectoryLayout'] in master.cfg to the same layout, so that new
+    builds are saved in it, too.
+    """
+
+    def postOptions(self):
+        MakerBase.postOptions(self)
+        from buildbot.status import buildlayout
+        if self['layout'] not in buildlayout.LAYOUTS:
+            raise usage.UsageError("layout must be 'sharded' or 'flat'")
+
+def migrateBuilds(config):
+    from buildbot.status import buildlayout
+    basedir = config['basedir']
+    for name in sorted(os.listdir(basedir)):
+        builderdir = os.path.join(basedir, name)
+        if not os.path.isfile(os.path.join(builderdir, "builder")):
+            continue
+        moved = buildlayout.migrate(builderdir, config['layout'])
+        if not config['quiet']:
+            print "%s: moved %d files" % (name, moved)
+    return 0
+
+
 class MasterOptions(MakerBase):
     optFlags = [
         ["force", "f",
@@ -1160,6 +1200,8 @@ class Options(usage.Options):
          "Create and populate a directory for a new buildmaster"],
         ['upgrade-master', None, UpgradeMasterOptions,
          "Upgrade an existing buildmaster directory for the current version"],
+        ['migrate-builds', None, MigrateBuildsOptions,
+         "Move a buildmaster's build files into a different directory layout"],
         ['start', None, StartOptions, "Start a buildmaster"],
         ['stop', None, StopOptions, "Stop a buildmaster"],
         ['restart', None, RestartOptions,
@@ -1225,6 +1267,8 @@ def run():
         createMaster(so)
     elif command == "upgrade-master":
         upgradeMaster(so)
+    elif command == "migrate-builds":
+        migrateBuilds(so)
     elif command == "start":
         from buildbot.scripts.startup import start
 
@@ -112,13 +112,10 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
         if ssdict['changeids']:
             # sort the changeids in order, oldest to newest
             sorted_changeids = sorted(ssdict['changeids'])
-            def gci(id):
-                d = master.db.changes.getChange(id)
-                d.addCallback(lambda chdict :
-                    Change.fromChdict(master, chdict))
-                return d
-            d = defer.gatherResults([ gci(id)
-                                for id in sorted_changeids ])
+            d = master.db.changes.getChanges(sorted_changeids)
+            d.addCallback(lambda chdicts :
+                defer.gatherResults([ Change.fromChdict(master, chdict)
+                                      for chdict in chdicts ]))
         else:
             d = defer.succeed([])
         def got_changes(changes):
@@ -187,6 +184,17 @@ class SourceStamp(util.ComparableMixin, styles.Versioned):
 
         return False
 
+    def getMergeKey(self):
+        """Return a hashable key such that two SourceStamps can be merged (as
+        determined by L{canBeMergedWith}) exactly when their keys are equal,
+        or None if this SourceStamp cannot be merged with any other."""
+        if self.changes:
+            return (self.repository, self.branch, self.project, True)
+        if self.patch:
+            return None
+        return (self.repository, self.branch, self.project, False,
+                self.revision)
+
     def mergeWith(self, others):
         """Generate a SourceStamp for the merger of me and all the other
         SourceStamps. This is called by a Build when it starts, to figure
@@ -13,8 +13,8 @@
 #
 # Copyright Buildbot Team Members
 
-import os, shutil, re
-from cPickle import dump
+import os, shutil, re, new
+from cPickle import dump, dumps, load, loads
 from zope.interface import implements
 from twisted.python import log, runtime
 from twisted.persisted import styles
@@ -22,6 +22,43 @@ from twisted.internet import reactor, defer
 from buildbot import interfaces, util, sourcestamp
 from buildbot.process.properties import Properties
 from buildbot.status.buildstep import BuildStepStatus
+from buildbot.status import buildlayout
+
+FULL = "full"
+COMPACT = "compact"
+PICKLE_FORMATS = (FULL, COMPACT)
+
+COMPACT_MAGIC = "buildbot.status.build.BuildStatus:compact"
+COMPACT_VERSION = 1
+
+def loadBuild(f):
+    """
+    Load a build from an open build pickle file, written in either format
+    (see L{BuildStatus.saveYourself}).  The caller must set the build's
+    C{builder} and perform any upgrades, as for any unpickled
+    L{styles.Versioned} object.  The steps of a build in the C{compact}
+    format are loaded when they are first needed.
+
+    @param f: file opened for reading in binary mode
+    @returns: L{BuildStatus}
+    @raises ValueError: if the file was written in an unknown version of the
+    compact format
+    """
+    record = load(f)
+    if type(record) is not tuple or record[:1] != (COMPACT_MAGIC,):
+        return record
+    magic, version, state, stepsBlob = record
+    if version != COMPACT_VERSION:
+        raise ValueError("unknown compact build format version %r" % version)
+    propdict, runtime_props = state['properties']
+    properties = Properties()
+    properties.properties = propdict
+    properties.runtime = set(runtime_props)
+    state['properties'] = properties
+    state['_stepsBlob'] = stepsBlob
+    build = new.instance(BuildStatus)
+    build.__setstate__(state)
+    return build
 
 class BuildStatus(styles.Versioned):
     implements(interfaces.IBuildStatus, interfaces.IStatusEvent)
@@ -168,6 +205,9 @@ class BuildStatus(styles.Versioned):
     def getText(self):
         text = []
         text.extend(self.text)
+        if not self.stepsLoaded():
+            text.extend(self._stepsText2)
+            return text
         for s in self.steps:
             text.extend(s.text2)
         return text
@@ -313,6 +353,8 @@ class BuildStatus(styles.Versioned):
     def pruneSteps(self):
         # this build is very old: remove the build steps too
         self.steps = []
+        self.__dict__.pop('_stepsBlob', None)
+        self.__dict__.pop('_stepsText2', None)
 
     # persistence stuff
 
@@ -328,10 +370,14 @@ class BuildStatus(styles.Versioned):
         These files are kept in the Builder's basedir (rather than a
         per-Build subdirectory) because that makes cleanup easier: cron and
         find will help get rid of the old logs, but the empty directories are
-        more of a hassle to remove."""
+        more of a hassle to remove.  If the Builder uses the sharded layout
+        (see L{buildlayout}), they are kept in the bucket subdirectory for
+        this build instead."""
 
         starting_filename = "%d-log-%s-%s" % (self.number, stepname, logname)
         starting_filename = re.sub(r'[^\w\.\-]', '_', starting_filename)
+        starting_filename = buildlayout.placeFile(self.number,
+                starting_filename, self.builder.buildDirectoryLayout)
         # now make it unique
         unique_counter = 0
         filename = starting_filename
@@ -343,7 +389,41 @@ class BuildStatus(styles.Versioned):
             unique_counter += 1
         return filename
 
+    def __getattr__(self, name):
+        # the steps of a build loaded from a compact pickle are unpickled
+        # when they are first used
+        if name == 'steps' and '_stepsBlob' in self.__dict__:
+            self._loadSteps()
+            return self.steps
+        raise AttributeError(name)
+
+    def stepsLoaded(self):
+        """Return False if the steps of this build have not been unpickled
+        yet"""
+        return '_stepsBlob' not in self.__dict__
+
+    def _loadSteps(self):
+        steps = loads(self.__dict__.pop('_stepsBlob'))
+        self.__dict__.pop('_stepsText2', None)
+        for step in steps:
+            step.build = self
+        self.steps = steps
+        versioneds = styles.versionedsToUpgrade
+        styles.doUpgrade()
+        # this is done for all builds by BuilderStatus.getBuildByNumber, but
+        # for these it has to wait until now
+        self.upgradeLogfiles()
+        self.checkLogfiles()
+        if True in [ hasattr(o, 'wasUpgraded') for o in versioneds.values() ]:
+            log.msg("re-writing build pickle with upgraded steps")
+            self.saveYourself()
+
     def __getstate__(self):
+        if not self.stepsLoaded():
+            self._loadSteps()
+        return self._getPersistentState()
+
+    def _getPersistentState(self):
         d = styles.Versioned.__getstate__(self)
         # for now, a serialized Build is always "finished". We will never
         # save unfinished builds.
@@ -353,14 +433,37 @@ class BuildStatus(styles.Versioned):
             # was interrupted. The builder will have a 'shutdown' event, but
             # someone looking at just this build will be confused as to why
             # the last log is truncated.
-        for k in 'builder', 'watchers', 'updates', 'finishedWatchers':
+        for k in ('builder', 'watchers', 'updates', 'finishedWatchers',
+                  '_stepsBlob', '_stepsText2'):
             if k in d: del d[k]
         return d
 
+    def _dumpCompact(self, f):
+        # the compact format is a protocol-2 pickle of a tuple holding the
+        # build's attributes, except for its steps, with the properties
+        # flattened to builtin types and the steps' contributions to the
+        # build's text (see getText) added; and the steps, pickled separately
+        # so that they can be loaded lazily.  A blob that was never loaded is
+        # written back unchanged.
+        d = self._getPersistentState()
+        if self.stepsLoaded():
+            steps = d.pop('steps')
+            stepsBlob = dumps(steps, 2)
+            d['_stepsText2'] = [ t for s in steps for t in s.text2 ]
+        else:
+            stepsBlob = self.__dict__['_stepsBlob']
+            d['_stepsText2'] = self._stepsText2
+        # a saved build is always finished (see _getPersistentState), so it
+        # has no current step
+        d.pop('currentStep', None)
+        properties = d['properties']
+        d['properties'] = (properties.properties, list(properties.runtime))
+        dump((COMPACT_MAGIC, COMPACT_VERSION, d, stepsBlob), f, 2)
+
     def __setstate__(self, d):
         styles.Versioned.__setstate__(self, d)
         # self.builder must be filled in by our parent when loading
-        for step in self.steps:
+        for step in d.get('steps', []):
             step.build = self
         self.watchers = []
         self.updates = {}
@@ -413,13 +516,30 @@ class BuildStatus(styles.Versioned):
             s.checkLogfiles()
 
     def saveYourself(self):
-        filename = os.path.join(self.builder.basedir, "%d" % self.number)
+        """Write this build to its pickle file, in the format selected by
+        the builder's C{buildPickleFormat}: C{full} is a pickle of the
+        L{BuildStatus} object itself, while C{compact} (see L{loadBuild}) is
+        quicker to load, particularly when only the build's summary is
+        needed."""
+        filename = self.builder.makeBuildFilename(self.number)
         if os.path.isdir(filename):
             # leftover from 0.5.0, which stored builds in directories
             shutil.rmtree(filename, ignore_errors=True)
+        # a copy loaded from the other layout is replaced by this one
+        oldfilename = self.builder.findBuildFilename(self.number)
         tmpfilename = filename + ".tmp"
         try:
-            dump(self, open(tmpfilename, "wb"), -1)
+            dirname = os.path.dirname(filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            f = open(tmpfilename, "wb")
+            try:
+                if self.builder.buildPickleFormat == COMPACT:
+                    self._dumpCompact(f)
+                else:
+                    dump(self, f, -1)
+            finally:
+                f.close()
             if runtime.platformType  == 'win32':
                 # windows cannot rename a file on top of an existing one, so
                 # fall back to delete-first. There are ways this can fail and
@@ -428,6 +548,8 @@ class BuildStatus(styles.Versioned):
                 if os.path.exists(filename):
                     os.unlink(filename)
             os.rename(tmpfilename, filename)
+            if oldfilename and oldfilename != filename:
+                os.unlink(oldfilename)
         except:
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
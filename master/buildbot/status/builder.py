@@ -15,16 +15,20 @@
 
 
 import weakref
-import os, re, itertools
-from cPickle import load, dump
+import os, itertools
+from cPickle import dump
 
 from zope.interface import implements
 from twisted.python import log, runtime
 from twisted.persisted import styles
 from buildbot.process import metrics
 from buildbot import interfaces, util
+from buildbot.util import lru
 from buildbot.status.event import Event
-from buildbot.status.build import BuildStatus
+from buildbot.status.build import BuildStatus, loadBuild, PICKLE_FORMATS
+from buildbot.status.buildindex import BuildIndex
+from buildbot.status.logfile import LOGFILE_SUFFIXES, COMPRESSION_METHODS
+from buildbot.status import buildlayout
 from buildbot.status.buildrequest import BuildRequestStatus
 
 # user modules expect these symbols to be present here
@@ -61,6 +65,7 @@ class BuilderStatus(styles.Versioned):
     # main Builder pickle. The Build and LogFile pickles on disk must be
     # handled separately.
     buildCacheSize = 15
+    buildCacheBytes = None # no limit on the estimated size of cached builds
     eventHorizon = 50 # forget events beyond this
 
     # these limit on-disk storage
@@ -70,6 +75,14 @@ class BuilderStatus(styles.Versioned):
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
+    buildIndex = None # created by determineNextBuildNumber
+    buildDirectoryLayout = buildlayout.FLAT
+    buildPickleFormat = "full"
+    buildCacheBudget = None # master-wide build cache, set by our parent
+
+    ESTIMATED_BUILD_SIZE = 16*1024
+    """weight, in bytes, given in the build cache to builds whose pickle has
+    not been written yet"""
 
     def __init__(self, buildername, category=None):
         self.name = buildername
@@ -85,8 +98,7 @@ class BuilderStatus(styles.Versioned):
         self.currentBuilds = []
         self.nextBuild = None
         self.watchers = []
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self._initBuildCache()
         self.logCompressionLimit = False # default to no compression for tests
         self.logCompressionMethod = "bz2"
         self.logMaxSize = None # No default limit
@@ -102,7 +114,8 @@ class BuilderStatus(styles.Versioned):
         d = styles.Versioned.__getstate__(self)
         d['watchers'] = []
         del d['buildCache']
-        del d['buildCache_LRU']
+        del d['buildLRU']
+        d.pop('buildCacheBudget', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -112,14 +125,14 @@ class BuilderStatus(styles.Versioned):
         del d['basedir']
         del d['status']
         del d['nextBuildNumber']
+        d.pop('buildIndex', None)
         return d
 
     def __setstate__(self, d):
         # when loading, re-initialize the transient stuff. Remember that
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
-        self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self._initBuildCache()
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -131,6 +144,8 @@ class BuilderStatus(styles.Versioned):
         # gets pickled and unpickled.
         if buildmaster.buildCacheSize is not None:
             self.buildCacheSize = buildmaster.buildCacheSize
+        self.buildCacheBytes = buildmaster.buildCacheBytes
+        self.buildLRU.set_limits(self.buildCacheSize, self.buildCacheBytes)
 
     def upgradeToVersion1(self):
         if hasattr(self, 'slavename'):
@@ -141,26 +156,45 @@ class BuilderStatus(styles.Versioned):
         self.wasUpgraded = True
 
     def determineNextBuildNumber(self):
-        """Scan our directory of saved BuildStatus instances to determine
+        """Load the index of our saved BuildStatus instances to determine
         what our self.nextBuildNumber should be. Set it one larger than the
-        highest-numbered build we discover. This is called by the top-level
+        highest-numbered build we know about. This is called by the top-level
         Status object shortly after we are created or loaded from disk.
+
+        The index is rebuilt by scanning our directory if it is missing, or
+        if it is evidently out of date.
         """
-        existing_builds = [int(f)
-                           for f in os.listdir(self.basedir)
-                           if re.match("^\d+$", f)]
-        if existing_builds:
-            self.nextBuildNumber = max(existing_builds) + 1
-        else:
-            self.nextBuildNumber = 0
+        self.buildIndex = BuildIndex(self.basedir)
+        self.buildIndex.load()
+        self.nextBuildNumber = self._nextIndexedNumber()
+        if self.findBuildFilename(self.nextBuildNumber):
+            # builds were saved without updating the index
+            log.msg("build index for builder %s is out of date; rebuilding"
+                    % self.name)
+            self.buildIndex.rebuild()
+            self.nextBuildNumber = self._nextIndexedNumber()
+
+    def _nextIndexedNumber(self):
+        highest = self.buildIndex.getMaxNumber()
+        if highest is None:
+            return 0
+        return highest + 1
 
     def setLogCompressionLimit(self, lowerLimit):
         self.logCompressionLimit = lowerLimit
 
     def setLogCompressionMethod(self, method):
-        assert method in ("bz2", "gz")
+        assert method in COMPRESSION_METHODS
         self.logCompressionMethod = method
 
+    def setBuildDirectoryLayout(self, layout):
+        assert layout in buildlayout.LAYOUTS
+        self.buildDirectoryLayout = layout
+
+    def setBuildPickleFormat(self, format):
+        assert format in PICKLE_FORMATS
+        self.buildPickleFormat = format
+
     def setLogMaxSize(self, upperLimit):
         self.logMaxSize = upperLimit
 
@@ -173,6 +207,7 @@ class BuilderStatus(styles.Versioned):
                 # interrupted build, need to save it anyway.
                 # BuildStatus.saveYourself will mark it as interrupted.
                 b.saveYourself()
+                self._indexBuild(b)
         filename = os.path.join(self.basedir, "builder")
         tmpfilename = filename + ".tmp"
         try:
@@ -190,13 +225,83 @@ class BuilderStatus(styles.Versioned):
     # build cache management
 
     def makeBuildFilename(self, number):
-        return os.path.join(self.basedir, "%d" % number)
+        """Return the filename where the given build's pickle is saved, in
+        the current layout"""
+        return os.path.join(self.basedir, buildlayout.buildFilename(number,
+                                                self.buildDirectoryLayout))
+
+    def findBuildFilename(self, number):
+        """Return the filename of the given build's pickle in whichever layout
+        it is stored, or None if it does not exist"""
+        relname = buildlayout.findFile(self.basedir,
+                buildlayout.buildFilename(number, self.buildDirectoryLayout))
+        if relname is None:
+            return None
+        return os.path.join(self.basedir, relname)
+
+    def _indexBuild(self, build):
+        # record a saved build in the build index
+        start, end = build.getTimes()
+        ss = build.getSourceStamp()
+        branch = None
+        if ss:
+            branch = ss.branch
+        self.buildIndex.record(build.number, pickle=True,
+                start=start, end=end, results=build.getResults(), branch=branch,
+                logs=[ l.filename for l in build.getLogs() if l.filename ])
+
+    def _getIndexEntry(self, number):
+        # get the build index entry for a build that is not running, or None
+        if self.buildIndex is None:
+            return None
+        for b in self.currentBuilds:
+            if b.number == number:
+                return None
+        return self.buildIndex.get(number)
+
+    def _initBuildCache(self):
+        # buildCache holds every build that is still referenced somewhere,
+        # while buildLRU keeps the most recently used ones alive, limited by
+        # count and by estimated size
+        self.buildCache = weakref.WeakValueDictionary()
+        self.buildLRU = lru.LRUCache(self.buildCacheSize, self.buildCacheBytes,
+                                     evict_fn=self._buildEvicted)
+
+    def _buildEvicted(self, number, build):
+        if self.buildCacheBudget is not None:
+            self.buildCacheBudget.remove((self, number))
+
+    def estimateBuildSize(self, number):
+        """Estimate the memory used by the given build, in bytes, from the
+        size of its pickle"""
+        filename = self.findBuildFilename(number)
+        if filename is not None:
+            try:
+                return os.path.getsize(filename)
+            except OSError:
+                pass
+        return self.ESTIMATED_BUILD_SIZE
+
+    def touchBuildCache(self, build, size=None):
+        """
+        Record a use of the given build in the build cache, adding it if
+        necessary.
 
-    def touchBuildCache(self, build):
-        self.buildCache[build.number] = build
-        if build in self.buildCache_LRU:
-            self.buildCache_LRU.remove(build)
-        self.buildCache_LRU = self.buildCache_LRU[-(self.buildCacheSize-1):] + [ build ]
+        @param build: the L{BuildStatus}
+        @param size: estimated size of the build, in bytes, if known
+        @returns: the build
+        """
+        number = build.number
+        self.buildCache[number] = build
+        if self.buildLRU.get(number) is not build:
+            if size is None:
+                size = self.estimateBuildSize(number)
+            self.buildLRU.put(number, build, size)
+        budget = self.buildCacheBudget
+        if budget is None or budget.max_weight is None:
+            return build
+        if budget.get((self, number)) is not build:
+            budget.put((self, number), build, self.buildLRU.weights[number])
         return build
 
     def getBuildByNumber(self, number):
@@ -206,17 +311,21 @@ class BuilderStatus(styles.Versioned):
                 return self.touchBuildCache(b)
 
         # then in the buildCache
-        if number in self.buildCache:
+        build = self.buildCache.get(number)
+        if build is not None:
             metrics.MetricCountEvent.log("buildCache.hits", 1)
-            return self.touchBuildCache(self.buildCache[number])
+            metrics.MetricCountEvent.log("buildCache.hits.%s" % self.name, 1)
+            return self.touchBuildCache(build)
         metrics.MetricCountEvent.log("buildCache.misses", 1)
+        metrics.MetricCountEvent.log("buildCache.misses.%s" % self.name, 1)
 
         # then fall back to loading it from disk
-        filename = self.makeBuildFilename(number)
         try:
             log.msg("Loading builder %s's build %d from on-disk pickle"
                 % (self.name, number))
-            build = load(open(filename, "rb"))
+            f = self._openBuildPickle(number)
+            size = os.fstat(f.fileno()).st_size
+            build = loadBuild(f)
             build.builder = self
 
             # (bug #1068) if we need to upgrade, we probably need to rewrite
@@ -230,16 +339,31 @@ class BuilderStatus(styles.Versioned):
                 log.msg("re-writing upgraded build pickle")
                 build.saveYourself()
 
-            # handle LogFiles from after 0.5.0 and before 0.6.5
-            build.upgradeLogfiles()
-            # check that logfiles exist
-            build.checkLogfiles()
-            return self.touchBuildCache(build)
+            # steps that are loaded lazily get these checks when loaded
+            if build.stepsLoaded():
+                # handle LogFiles from after 0.5.0 and before 0.6.5
+                build.upgradeLogfiles()
+                # check that logfiles exist
+                build.checkLogfiles()
+            return self.touchBuildCache(build, size)
         except IOError:
             raise IndexError("no such build %d" % number)
-        except EOFError:
+        except (EOFError, ValueError):
             raise IndexError("corrupted build pickle %d" % number)
 
+    def _openBuildPickle(self, number):
+        # the pickle may be moved to the other layout at any time by a
+        # migration, so look for it again if it vanishes after being found
+        for attempt in range(2):
+            filename = self.findBuildFilename(number)
+            if filename is None:
+                break
+            try:
+                return open(filename, "rb")
+            except IOError:
+                pass
+        raise IOError("no pickle for build %d" % number)
+
     def prune(self, events_only=False):
         # begin by pruning our own events
         self.events = self.events[-self.eventHorizon:]
@@ -264,33 +388,62 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
-        # skim the directory and delete anything that shouldn't be there anymore
-        build_re = re.compile(r"^([0-9]+)$")
-        build_log_re = re.compile(r"^([0-9]+)-.*$")
         # if the directory doesn't exist, bail out here
         if not os.path.exists(self.basedir):
             return
 
-        for filename in os.listdir(self.basedir):
-            num = None
-            mo = build_re.match(filename)
-            is_logfile = False
-            if mo:
-                num = int(mo.group(1))
-            else:
-                mo = build_log_re.match(filename)
-                if mo:
-                    num = int(mo.group(1))
-                    is_logfile = True
-
-            if num is None: continue
-            if num in self.buildCache: continue
+        # use the build index to find the files that shouldn't be there
+        # anymore, skimming the directory only for builds whose logfiles are
+        # not indexed (e.g., after a crash during the build)
+        index = self.buildIndex
+        prunable = [ num for num in index.getNumbers()
+                     if num < earliest_log and num not in self.buildCache ]
+        if not prunable:
+            return
 
-            if (is_logfile and num < earliest_log) or num < earliest_build:
+        unindexed = dict([ (num, []) for num in prunable
+                           if index.get(num)['logs'] is None ])
+        if unindexed:
+            for num, filename, pickle in buildlayout.listBuildFiles(
+                                                self.basedir, unindexed):
+                if not pickle and num in unindexed:
+                    unindexed[num].append(filename)
+
+        removed = []
+        buckets = set()
+        for num in prunable:
+            entry = index.get(num)
+            if num in unindexed:
+                filenames = unindexed[num]
+            else:
+                # the logfiles may have been migrated to the other layout
+                filenames = []
+                for logname in entry['logs']:
+                    for name in (logname,
+                                 buildlayout.alternateFilename(logname)):
+                        if name:
+                            filenames.extend([ name + suffix
+                                            for suffix in LOGFILE_SUFFIXES ])
+            if num < earliest_build:
+                if entry['pickle']:
+                    filenames.extend([ buildlayout.buildFilename(num, layout)
+                                       for layout in buildlayout.LAYOUTS ])
+                removed.append(num)
+                buckets.add(buildlayout.bucketName(num))
+            elif entry['logs'] == []:
+                continue # logs already pruned
+
+            for filename in filenames:
                 pathname = os.path.join(self.basedir, filename)
-                log.msg("pruning '%s'" % pathname)
-                try: os.unlink(pathname)
-                except OSError: pass
+                if os.path.exists(pathname):
+                    log.msg("pruning '%s'" % pathname)
+                    try: os.unlink(pathname)
+                    except OSError: pass
+
+            if num >= earliest_build:
+                index.record(num, logs=[])
+        index.remove(removed)
+        buildlayout.removeEmptyBuckets(self.basedir, buckets)
 
     # IBuilderStatus methods
     def getName(self):
@@ -353,12 +506,25 @@ class BuilderStatus(styles.Versioned):
                 break
             if Nb > max_search:
                 break
-            build = self.getBuild(-Nb)
-            if build is None:
-                continue
+            number = self.nextBuildNumber - Nb
             if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
+                if number > max_buildnum:
                     continue
+            # use the build index to skip builds without loading them
+            entry = self._getIndexEntry(number)
+            if entry is not None:
+                if not entry['pickle']:
+                    continue
+                if entry['end'] is not None:
+                    if finished_before is not None:
+                        if entry['end'] >= finished_before:
+                            continue
+                    if branches:
+                        if entry['branch'] not in branches:
+                            continue
+            build = self.getBuild(number)
+            if build is None:
+                continue
             if not build.isFinished():
                 continue
             if finished_before is not None:
@@ -391,6 +557,14 @@ class BuilderStatus(styles.Versioned):
         eventIndex = -1
         e = self.getEvent(eventIndex)
         for Nb in range(1, self.nextBuildNumber+1):
+            # use the build index to skip builds without loading them
+            entry = self._getIndexEntry(self.nextBuildNumber - Nb)
+            if entry is not None and entry['pickle'] and \
+                    entry['end'] is not None:
+                if entry['start'] < minTime:
+                    break
+                if branches and not entry['branch'] in branches:
+                    continue
             b = self.getBuild(-Nb)
             if not b:
                 # HACK: If this is the first build we are looking at, it is
@@ -490,10 +664,9 @@ class BuilderStatus(styles.Versioned):
         Steps). Create a BuildStatus object that it can use."""
         number = self.nextBuildNumber
         self.nextBuildNumber += 1
-        # TODO: self.saveYourself(), to make sure we don't forget about the
-        # build number we've just allocated. This is not quite as important
-        # as it was before we switch to determineNextBuildNumber, but I think
-        # it may still be useful to have the new build save itself.
+        # record the build number we've just allocated in the index, so that
+        # it is not re-used if we crash before the build is saved
+        self.buildIndex.record(number)
         s = BuildStatus(self, number)
         s.waitUntilFinished().addCallback(self._buildFinished)
         return s
@@ -530,6 +703,7 @@ class BuilderStatus(styles.Versioned):
         assert s in self.currentBuilds
         s.saveYourself()
         self.currentBuilds.remove(s)
+        self._indexBuild(s)
 
         name = self.getName()
         results = s.getResults()
@@ -0,0 +1,201 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+from twisted.python import log, runtime
+from buildbot.util import json
+from buildbot.status import buildlayout
+
+class BuildIndex(object):
+    """
+    A persistent index of the builds stored in a builder's directory, so that
+    L{BuilderStatus} can find build numbers, and filter builds by time, result
+    and branch, without listing the directory or loading build pickles.
+
+    The index is stored in the builder directory as a file of JSON lines, one
+    per update; later lines for the same build number replace earlier lines.
+    The file is rewritten in compact form when it accumulates too many stale
+    lines.  If the file is missing or cannot be read, the index is rebuilt
+    from the directory contents, in which case only the build numbers and
+    filenames are known.
+
+    Each entry is a dictionary with keys
+
+     - C{number}: the build number
+     - C{pickle}: true if a build pickle has been written
+     - C{start}, C{end}: build times; C{end} is None if the build has not
+       finished, or if its details are not known
+     - C{results}: the build's results
+     - C{branch}: the branch of the build's source stamp
+     - C{logs}: list of the build's logfile names, relative to the builder
+       directory (without any compression or index suffix), or None if they
+       are not known
+    """
+
+    FILENAME = "builds.index"
+    """name of the index file in the builder directory"""
+
+    COMPACT_SLACK = 100
+    """number of stale lines allowed in the index file, beyond the number of
+    entries, before it is compacted"""
+
+    build_re = buildlayout.build_re
+    build_log_re = buildlayout.build_log_re
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.filename = os.path.join(basedir, self.FILENAME)
+        self.entries = {}
+        self.lines = 0
+
+    def load(self):
+        """Load the index from disk, rebuilding it from the directory contents
+        if necessary."""
+        self.entries = {}
+        self.lines = 0
+        try:
+            f = open(self.filename, "r")
+        except IOError:
+            self.rebuild()
+            return
+        try:
+            try:
+                for line in f:
+                    self._apply(json.loads(line))
+                    self.lines += 1
+            except (ValueError, KeyError, TypeError):
+                log.msg("corrupt build index '%s'; rebuilding" % self.filename)
+                self.rebuild()
+                return
+        finally:
+            f.close()
+        self._maybeCompact()
+
+    def rebuild(self):
+        """Rebuild the index by scanning the builder directory, in both
+        layouts (see L{buildlayout}).  Only build numbers, pickle presence and
+        log filenames can be recovered this way."""
+        entries = {}
+        def entry(num):
+            if num not in entries:
+                entries[num] = self._makeEntry(num, logs=[])
+            return entries[num]
+        if os.path.isdir(self.basedir):
+            for num, relname, pickle in buildlayout.listBuildFiles(
+                                                            self.basedir):
+                if pickle:
+                    entry(num)['pickle'] = True
+                    continue
+                dirname, filename = os.path.split(relname)
+                mo = self.build_log_re.match(filename)
+                logname = os.path.join(dirname, "%s-%s" % mo.group(1, 2))
+                logs = entry(num)['logs']
+                if logname not in logs:
+                    logs.append(logname)
+        self.entries = entries
+        self.compact()
+
+    def compact(self):
+        """Rewrite the index file with one line per entry."""
+        tmpfilename = self.filename + ".tmp"
+        try:
+            f = open(tmpfilename, "w")
+            try:
+                for num in sorted(self.entries):
+                    f.write(json.dumps(self.entries[num]) + "\n")
+            finally:
+                f.close()
+            if runtime.platformType  == 'win32':
+                # windows cannot rename a file on top of an existing one
+                if os.path.exists(self.filename):
+                    os.unlink(self.filename)
+            os.rename(tmpfilename, self.filename)
+            self.lines = len(self.entries)
+        except (IOError, OSError):
+            log.msg("unable to write build index '%s'" % self.filename)
+            log.err()
+
+    def get(self, number):
+        """Get the entry for the given build number, or None"""
+        return self.entries.get(number)
+
+    def getNumbers(self):
+        """Get the indexed build numbers, in increasing order"""
+        return sorted(self.entries)
+
+    def getMaxNumber(self):
+        """Get the highest indexed build number, or None"""
+        if not self.entries:
+            return None
+        return max(self.entries)
+
+    def record(self, number, **fields):
+        """
+        Add or update the entry for a build, and append it to the index file.
+
+        @param number: build number
+        @param fields: entry fields to set; fields not given keep their
+        current values
+        """
+        entry = self.entries.get(number)
+        if entry is None:
+            entry = self._makeEntry(number)
+        else:
+            entry = entry.copy()
+        entry.update(fields)
+        self.entries[number] = entry
+        self._append([ entry ])
+
+    def remove(self, numbers):
+        """Remove the given build numbers from the index."""
+        removed = [ dict(number=num, removed=True)
+                    for num in numbers if num in self.entries ]
+        for num in numbers:
+            self.entries.pop(num, None)
+        self._append(removed)
+
+    def _makeEntry(self, number, **fields):
+        entry = dict(number=number, pickle=False, start=None, end=None,
+                     results=None, branch=None, logs=None)
+        entry.update(fields)
+        return entry
+
+    def _apply(self, line):
+        num = line['number']
+        if line.get('removed'):
+            self.entries.pop(num, None)
+        else:
+            self.entries[num] = self._makeEntry(num, **dict(
+                (str(k), v) for k, v in line.iteritems() if k != 'number'))
+
+    def _append(self, lines):
+        if not lines:
+            return
+        try:
+            f = open(self.filename, "a")
+            try:
+                for line in lines:
+                    f.write(json.dumps(line) + "\n")
+            finally:
+                f.close()
+            self.lines += len(lines)
+        except IOError:
+            log.msg("unable to update build index '%s'" % self.filename)
+            log.err()
+        self._maybeCompact()
+
+    def _maybeCompact(self):
+        if self.lines > len(self.entries) + self.COMPACT_SLACK:
+            self.compact()
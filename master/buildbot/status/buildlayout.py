@@ -0,0 +1,188 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Placement of build pickles and logfiles within a builder's directory.
+
+In the C{flat} layout, every build pickle (named by its build number) and
+every logfile (named C{<number>-log-...}, see
+L{BuildStatus.generateLogfileName}) is stored directly in the builder
+directory.  In the C{sharded} layout, they are stored in bucket
+subdirectories of L{BUCKET_SIZE} builds each, named by the build number
+divided by L{BUCKET_SIZE}, so that build 12345 is stored as C{00012/12345}.
+This keeps directory listings short for builders with long histories.
+
+Files are always looked for in both layouts, so a builder directory can be
+switched from one layout to the other (with L{migrate}) while the master is
+running.
+"""
+
+import os, re
+from twisted.python import log
+
+FLAT = "flat"
+SHARDED = "sharded"
+LAYOUTS = (FLAT, SHARDED)
+
+BUCKET_SIZE = 1000
+"""number of builds in each bucket directory of the sharded layout"""
+
+build_re = re.compile(r"^([0-9]+)$")
+build_log_re = re.compile(r"^([0-9]+)-(.*?)(\.bz2|\.gz|\.xz|\.idx)?$")
+bucket_re = re.compile(r"^[0-9]{5}$")
+
+def bucketName(number):
+    """Return the name of the bucket directory for the given build number"""
+    return "%05d" % (number // BUCKET_SIZE)
+
+def placeFile(number, filename, layout):
+    """
+    Return the name, relative to the builder directory, of a file belonging
+    to the given build.
+
+    @param number: build number
+    @param filename: base filename, e.g., C{12345-log-compile-stdio}
+    @param layout: L{FLAT} or L{SHARDED}
+    """
+    if layout == SHARDED:
+        return os.path.join(bucketName(number), filename)
+    return filename
+
+def buildFilename(number, layout):
+    """Return the name, relative to the builder directory, of the pickle for
+    the given build."""
+    return placeFile(number, "%d" % number, layout)
+
+def alternateFilename(relname):
+    """
+    Return the name of a build's file in the other layout, or None if the
+    name does not belong to a build.
+
+    @param relname: filename relative to the builder directory, in either
+    layout
+    """
+    head, tail = os.path.split(relname)
+    if head:
+        if bucket_re.match(head):
+            return tail
+        return None
+    mo = build_re.match(tail) or build_log_re.match(tail)
+    if not mo:
+        return None
+    return placeFile(int(mo.group(1)), tail, SHARDED)
+
+def listBucketDirs(builderdir):
+    """Return the names of the bucket directories in a builder directory"""
+    return [ name for name in os.listdir(builderdir)
+             if bucket_re.match(name)
+             and os.path.isdir(os.path.join(builderdir, name)) ]
+
+def listBuildFiles(builderdir, numbers=None):
+    """
+    List the files in a builder directory that belong to builds, in either
+    layout.
+
+    @param builderdir: the builder directory
+    @param numbers: if given, only bucket directories that may contain files
+    for these build numbers are listed; files directly in the builder
+    directory are always listed
+    @returns: list of (build number, relative filename, is pickle) tuples
+    """
+    found = []
+    def scan(dirname):
+        path = os.path.join(builderdir, dirname)
+        for filename in os.listdir(path):
+            if filename.endswith(".tmp"):
+                continue
+            mo = build_re.match(filename)
+            pickle = mo is not None
+            if pickle:
+                if os.path.isdir(os.path.join(path, filename)):
+                    continue
+            else:
+                mo = build_log_re.match(filename)
+                if not mo:
+                    continue
+            found.append((int(mo.group(1)), os.path.join(dirname, filename),
+                          pickle))
+    scan("")
+    buckets = listBucketDirs(builderdir)
+    if numbers is not None:
+        wanted = set([ bucketName(num) for num in numbers ])
+        buckets = [ b for b in buckets if b in wanted ]
+    for bucket in buckets:
+        scan(bucket)
+    return found
+
+def findFile(builderdir, relname):
+    """
+    Return the name of an existing build file, looking in both layouts and
+    preferring C{relname}, or None if it does not exist.
+    """
+    if os.path.exists(os.path.join(builderdir, relname)):
+        return relname
+    other = alternateFilename(relname)
+    if other and os.path.exists(os.path.join(builderdir, other)):
+        return other
+    return None
+
+def migrate(builderdir, layout):
+    """
+    Move the pickles and logfiles of finished builds in a builder directory
+    into the given layout.  Each file is moved with a single rename, and the
+    master looks for files in both layouts, so this is safe while the master
+    is running.  Files of builds without a pickle (builds in progress, or
+    interrupted by a crash) and temporary files are left alone.
+
+    @param builderdir: the builder directory
+    @param layout: L{FLAT} or L{SHARDED}
+    @returns: number of files moved
+    """
+    assert layout in LAYOUTS
+    files = listBuildFiles(builderdir)
+    finished = set([ num for num, _, pickle in files if pickle ])
+    moved = 0
+    for num, relname, pickle in files:
+        if num not in finished:
+            continue
+        target = placeFile(num, os.path.basename(relname), layout)
+        if target == relname:
+            continue
+        src = os.path.join(builderdir, relname)
+        dst = os.path.join(builderdir, target)
+        if os.path.exists(dst):
+            log.msg("not moving '%s': '%s' already exists" % (src, dst))
+            continue
+        dstdir = os.path.dirname(dst)
+        if not os.path.isdir(dstdir):
+            os.makedirs(dstdir)
+        os.rename(src, dst)
+        moved += 1
+    if layout == FLAT:
+        removeEmptyBuckets(builderdir)
+    return moved
+
+def removeEmptyBuckets(builderdir, buckets=None):
+    """Remove bucket directories that are empty.
+
+    @param buckets: names of the bucket directories to consider; all of them
+    by default"""
+    if buckets is None:
+        buckets = listBucketDirs(builderdir)
+    for bucket in buckets:
+        try:
+            os.rmdir(os.path.join(builderdir, bucket))
+        except OSError:
+            pass # not empty, or already gone
@@ -0,0 +1,170 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import time
+from collections import deque
+from twisted.internet import defer, threads, reactor
+from twisted.python import threadpool, failure
+from buildbot.process import metrics
+
+try:
+    import multiprocessing
+    assert multiprocessing
+except ImportError:
+    multiprocessing = None
+
+class LogCompressor(object):
+    """
+    A dedicated executor for compressing finished logfiles, so that log
+    compression neither ties up the reactor's thread pool nor compresses an
+    unbounded number of logs at once.
+
+    At most L{maxWorkers} jobs run at a time; further jobs wait in a FIFO
+    queue.  Each job runs in a thread of a private thread pool.  If
+    L{useProcesses} is set, that thread hands the job to a C{multiprocessing}
+    pool of the same size, so that CPU-bound codecs are not limited by the
+    GIL; submitted functions and their arguments must then be picklable.
+
+    The number of jobs queued or running is logged as the
+    C{LogCompressor.queue_depth} count, the time each job spends waiting as
+    the C{LogCompressor.queue_wait} histogram, and the throughput of each job
+    as the C{LogCompressor.bytes_per_sec} histogram.
+    """
+
+    DEFAULT_WORKERS = 2
+    """default number of concurrent compression jobs"""
+
+    maxWorkers = DEFAULT_WORKERS
+    useProcesses = False
+
+    threadpool = None
+    procpool = None
+    _stop_evt = None
+
+    # for testing
+    _reactor = reactor
+
+    def __init__(self):
+        # (deferred, nbytes, queued_at, fn, args) for each waiting job
+        self.queue = deque()
+        self.active = 0
+
+    def configure(self, maxWorkers=None, useProcesses=False):
+        """
+        Change the number of concurrent jobs, and whether they run in
+        separate processes.  Jobs already running are not affected.
+
+        @param maxWorkers: maximum number of concurrent jobs, or None for the
+        default
+        @param useProcesses: if true, run jobs in a process pool
+        """
+        if maxWorkers is None:
+            maxWorkers = self.DEFAULT_WORKERS
+        assert maxWorkers >= 1
+        if useProcesses and multiprocessing is None:
+            raise RuntimeError("log compression in separate processes "
+                               "requires the multiprocessing module")
+        if maxWorkers != self.maxWorkers or useProcesses != self.useProcesses:
+            # a new process pool of the right size is started on demand;
+            # the old one exits once its jobs are complete
+            if self.procpool:
+                self.procpool.close()
+                self.procpool = None
+        self.maxWorkers = maxWorkers
+        self.useProcesses = useProcesses
+        if self.threadpool:
+            self.threadpool.adjustPoolsize(maxthreads=maxWorkers)
+        self._runQueue()
+
+    def submit(self, nbytes, fn, *args):
+        """
+        Queue a compression job.
+
+        @param nbytes: size of the uncompressed data, for throughput metrics
+        @param fn: function to call in a worker thread or process; it must
+        be defined at module level if L{useProcesses} is set
+        @param args: arguments for C{fn}
+        @returns: the result of C{fn}, via Deferred
+        """
+        d = defer.Deferred()
+        self.queue.append((d, nbytes, time.time(), fn, args))
+        self._logQueueDepth()
+        self._runQueue()
+        return d
+
+    def stop(self):
+        """Stop the worker pools, after waiting for any running jobs.  This is
+        done automatically when the reactor stops; they are restarted on
+        demand."""
+        if self._stop_evt:
+            self._reactor.removeSystemEventTrigger(self._stop_evt)
+        self._stop()
+
+    def _stop(self):
+        self._stop_evt = None
+        if self.procpool:
+            self.procpool.close()
+        if self.threadpool:
+            self.threadpool.stop()
+        if self.procpool:
+            self.procpool.join()
+        self.threadpool = self.procpool = None
+
+    def _startPools(self):
+        if not self.threadpool:
+            self.threadpool = threadpool.ThreadPool(minthreads=0,
+                    maxthreads=self.maxWorkers, name='LogCompressor')
+            self.threadpool.start()
+            self._stop_evt = self._reactor.addSystemEventTrigger(
+                    'during', 'shutdown', self._stop)
+        if self.useProcesses and not self.procpool:
+            self.procpool = multiprocessing.Pool(self.maxWorkers)
+
+    def _runQueue(self):
+        while self.queue and self.active < self.maxWorkers:
+            d, nbytes, queued_at, fn, args = self.queue.popleft()
+            self.active += 1
+            self._startPools()
+            started_at = time.time()
+            metrics.MetricHistogramEvent.log('LogCompressor.queue_wait',
+                    started_at - queued_at)
+            d2 = threads.deferToThreadPool(self._reactor, self.threadpool,
+                    self._runJob, self.procpool, fn, args)
+            d2.addBoth(self._jobDone, nbytes, started_at)
+            d2.chainDeferred(d)
+
+    def _runJob(self, procpool, fn, args):
+        # runs in a worker thread
+        if procpool:
+            return procpool.apply(fn, args)
+        return fn(*args)
+
+    def _jobDone(self, res, nbytes, started_at):
+        self.active -= 1
+        elapsed = time.time() - started_at
+        if elapsed > 0 and not isinstance(res, failure.Failure):
+            metrics.MetricHistogramEvent.log('LogCompressor.bytes_per_sec',
+                    nbytes / elapsed)
+        self._logQueueDepth()
+        self._runQueue()
+        return res
+
+    def _logQueueDepth(self):
+        metrics.MetricCountEvent.log('LogCompressor.queue_depth',
+                len(self.queue) + self.active, absolute=True)
+
+compressor = LogCompressor()
+"""the executor used by L{LogFile.compressLog}, configured from
+C{c['logCompressionWorkers']} and C{c['logCompressionProcesses']}"""
@@ -14,21 +14,55 @@
 # Copyright Buildbot Team Members
 
 import os
-from cStringIO import StringIO
-from bz2 import BZ2File
-from gzip import GzipFile
+import bz2
+import zlib
+import struct
 
 from zope.interface import implements
 from twisted.python import log, runtime
-from twisted.internet import defer, threads, reactor
+from twisted.internet import defer, reactor
 from buildbot.util import netstrings
 from buildbot.util.eventual import eventually
+from buildbot.status import logcompressor, buildlayout
 from buildbot import interfaces
 
+try:
+    # the standard library module in Python 3.3, or backports.lzma
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    assert lzma.LZMADecompressor
+except (ImportError, AttributeError):
+    lzma = None
+
 STDOUT = interfaces.LOG_CHANNEL_STDOUT
 STDERR = interfaces.LOG_CHANNEL_STDERR
 HEADER = interfaces.LOG_CHANNEL_HEADER
 ChunkTypes = ["stdout", "stderr", "header"]
+TEXT_CHANNELS = (STDOUT, STDERR)
+
+def _gzipFrame(level):
+    def compress(buf):
+        c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress(buf) + c.flush()
+    return compress
+
+# compression method : (suffix, function to compress one frame); the methods
+# sharing a suffix produce the same format, at different compression levels
+COMPRESSION_METHODS = {
+    "bz2" : (".bz2", bz2.compress),
+    "gz" : (".gz", _gzipFrame(9)),
+    "gz-fast" : (".gz", _gzipFrame(1)),
+}
+if lzma:
+    COMPRESSION_METHODS["xz"] = (".xz", lzma.compress)
+
+# suffixes of compressed logfiles, in the order they are looked for
+COMPRESSED_SUFFIXES = (".bz2", ".gz", ".xz")
+
+# suffixes of the files that may be present on disk for a logfile
+LOGFILE_SUFFIXES = ("",) + COMPRESSED_SUFFIXES + (".idx",)
 
 class LogFileScanner(netstrings.NetstringParser):
     def __init__(self, chunk_cb, channels=[]):
@@ -41,6 +75,139 @@ class LogFileScanner(netstrings.NetstringParser):
         if not self.channels or (channel in self.channels):
             self.chunk_cb((channel, line[1:]))
 
+class LogChunkIndex:
+    """A read-only view of the sidecar index of a L{LogFile}.  The index has
+    one fixed-size record for each chunk in the logfile, giving
+
+     - the offset of the compressed frame containing the chunk (always 0 for
+       an uncompressed logfile)
+     - the offset of the chunk within the uncompressed frame
+     - the chunk's channel
+     - the length of the stdout and stderr text preceding the chunk
+     - the number of newlines in the stdout and stderr text preceding the
+       chunk
+
+    The last two fields never decrease, so records can be found by binary
+    search."""
+
+    FRAME, OFFSET, CHANNEL, TEXT_START, LINE_START = range(5)
+
+    RECORD_FORMAT = "!QQBQQ"
+    RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+    def __init__(self, filename):
+        self.f = open(filename, "rb")
+        self.f.seek(0, 2)
+        # ignore any trailing partial record
+        self.count = self.f.tell() // self.RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def packRecord(cls, frame, offset, channel, text_start, line_start):
+        return struct.pack(cls.RECORD_FORMAT, frame, offset, channel,
+                           text_start, line_start)
+
+    def getRecord(self, i):
+        self.f.seek(i * self.RECORD_SIZE)
+        return struct.unpack(self.RECORD_FORMAT,
+                             self.f.read(self.RECORD_SIZE))
+
+    def findLast(self, field, value):
+        """Return the number of the last record for which C{field} is at
+        most C{value}, or -1 if there is no such record."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.getRecord(mid)[field] <= value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+class CompressedLogReader:
+    """A read-only file-like object for a compressed logfile, which may be
+    made up of several independently compressed frames (see
+    L{LogFile.compressLog}).  Reading begins at the current position of
+    C{rawfile}, which must be the start of a frame, and continues through the
+    following frames.  Positions are relative to that starting point.
+    Seeking backward is supported, but requires decompressing from the start
+    again."""
+
+    BUFFERSIZE = 64*1024
+
+    def __init__(self, rawfile, method):
+        self.rawfile = rawfile
+        self.method = method
+        self.rawstart = rawfile.tell()
+        self._reset()
+
+    def _reset(self):
+        self.rawfile.seek(self.rawstart)
+        self.decompressor = None
+        self.pending = '' # compressed data not yet decompressed
+        self.buffer = ''
+        self.bufpos = 0
+        self.pos = 0
+        self.eof = False
+
+    def _decompress(self):
+        # decompress more data, but not beyond the end of the current frame,
+        # since frames of very compressible data can be very small
+        if not self.pending:
+            self.pending = self.rawfile.read(self.BUFFERSIZE)
+            if not self.pending:
+                self.eof = True
+                return ''
+        if self.decompressor is None:
+            if self.method == "bz2":
+                self.decompressor = bz2.BZ2Decompressor()
+            elif self.method == "xz":
+                self.decompressor = lzma.LZMADecompressor()
+            else:
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = self.decompressor.decompress(self.pending)
+        except EOFError:
+            # bz2 and lzma raise this when given data after the end of a
+            # frame
+            self.decompressor = None
+            return ''
+        # anything left over belongs to the next frame
+        self.pending = self.decompressor.unused_data
+        if self.pending:
+            self.decompressor = None
+        return data
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or
+                                len(self.buffer) - self.bufpos < size):
+            data = self._decompress()
+            if data:
+                self.buffer = self.buffer[self.bufpos:] + data
+                self.bufpos = 0
+        if size < 0:
+            size = len(self.buffer) - self.bufpos
+        data = self.buffer[self.bufpos:self.bufpos+size]
+        self.bufpos += len(data)
+        self.pos += len(data)
+        return data
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        assert whence == 0, "only absolute seeks are supported"
+        if offset < self.pos:
+            self._reset()
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, self.BUFFERSIZE)):
+                break
+
+    def close(self):
+        self.rawfile.close()
+
 class LogFileProducer:
     """What's the plan?
 
@@ -185,7 +352,11 @@ class LogFile:
     upgraded. The L{BuilderStatus} is responsible for doing this, when it
     loads the L{BuildStatus} into memory. The Build pickle is not modified,
     so users who go from 0.6.5 back to 0.6.4 don't have to lose their
-    logs."""
+    logs.
+
+    Each chunk written to the file is also recorded in a sidecar index file
+    (see L{LogChunkIndex}), so that the tail of the log, or a range of its
+    text, can be read without scanning the whole file."""
 
     implements(interfaces.IStatusLog, interfaces.ILogFile)
 
@@ -205,7 +376,13 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    indexfile = None
     compressMethod = "bz2"
+    frameSize = 1024*1024 # uncompressed size of each compressed frame
+    # length and number of newlines of the stdout and stderr text written to
+    # the file so far
+    textLength = 0
+    textLines = 0
 
     def __init__(self, parent, name, logfilename):
         """
@@ -230,6 +407,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.indexfile = open(self.getIndexFilename(), "wb")
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -238,10 +416,50 @@ class LogFile:
     def getFilename(self):
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
+    def getIndexFilename(self):
+        return self.getFilename() + ".idx"
+
+    def getChunkIndex(self):
+        """Return the L{LogChunkIndex} for this logfile, or None if there is
+        no usable index (for example, for logs written by older versions)."""
+        if self.indexfile:
+            self.indexfile.flush()
+        try:
+            index = LogChunkIndex(self.getIndexFilename())
+        except IOError:
+            if not self._relocate():
+                return None
+            try:
+                index = LogChunkIndex(self.getIndexFilename())
+            except IOError:
+                return None
+        if not len(index):
+            return None
+        return index
+
     def hasContents(self):
-        return os.path.exists(self.getFilename() + '.bz2') or \
-            os.path.exists(self.getFilename() + '.gz') or \
-            os.path.exists(self.getFilename())
+        return self._exists(self.getFilename()) or self._relocate()
+
+    def _exists(self, filename):
+        for suffix in COMPRESSED_SUFFIXES + ("",):
+            if os.path.exists(filename + suffix):
+                return True
+        return False
+
+    def _relocate(self):
+        # the files of a finished logfile may have been moved to the other
+        # layout of the builder directory (see L{buildlayout.migrate}) since
+        # its build was saved; if so, follow them and return True
+        if self.openfile or not self.filename:
+            return False
+        other = buildlayout.alternateFilename(self.filename)
+        if other is None:
+            return False
+        basedir = self.step.build.builder.basedir
+        if not self._exists(os.path.join(basedir, other)):
+            return False
+        self.filename = other
+        return True
 
     def getName(self):
         return self.name
@@ -259,21 +477,32 @@ class LogFile:
             self.finishedWatchers.append(d)
         return d
 
-    def getFile(self):
+    def getFile(self, frame=0):
+        """Get a file-like object for reading the logfile.  If the log is
+        compressed, reading starts at the compressed frame at offset C{frame}
+        in the file; offsets in the resulting object are relative to the
+        start of that frame."""
         if self.openfile:
             # this is the filehandle we're using to write to the log, so
             # don't close it!
             return self.openfile
         # otherwise they get their own read-only handle
-        # try a compressed log first
-        try:
-            return BZ2File(self.getFilename() + ".bz2", "r")
-        except IOError:
-            pass
         try:
-            return GzipFile(self.getFilename() + ".gz", "r")
+            return self._openFile(frame)
         except IOError:
-            pass
+            if not self._relocate():
+                raise
+            return self._openFile(frame)
+
+    def _openFile(self, frame):
+        # try a compressed log first
+        for suffix in COMPRESSED_SUFFIXES:
+            try:
+                rawfile = open(self.getFilename() + suffix, "rb")
+            except IOError:
+                continue
+            rawfile.seek(frame)
+            return CompressedLogReader(rawfile, suffix[1:])
         return open(self.getFilename(), "r")
 
     def getText(self):
@@ -284,6 +513,9 @@ class LogFile:
         return "".join(self.getChunks(onlyText=True))
 
     def getChunks(self, channels=[], onlyText=False):
+        return self._getChunksFrom(0, 0, channels, onlyText)
+
+    def _getChunksFrom(self, frame, offset, channels=[], onlyText=False):
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
@@ -296,13 +528,13 @@ class LogFile:
         # data, you must insure that nothing will be added to the log during
         # yield() calls.
 
-        f = self.getFile()
+        # start at the chunk at the given offset in the given frame (see
+        # LogChunkIndex)
+        f = self.getFile(frame)
         if not self.finished:
-            offset = 0
             f.seek(0, 2)
-            remaining = f.tell()
+            remaining = f.tell() - offset
         else:
-            offset = 0
             remaining = None
 
         leftover = None
@@ -351,15 +583,164 @@ class LogFile:
             else:
                 yield leftover
 
+    def getTail(self, lines, channels=[]):
+        """
+        Generate the chunks making up the last C{lines} lines of stdout and
+        stderr text in this log, including any chunks from other channels
+        that are interleaved with those lines.
+
+        This uses the chunk index, when available, to avoid reading more of
+        the log than necessary.
+
+        @param lines: number of lines
+        @param channels: if given, only generate chunks for these channels
+        @returns: iterator of (channel, text) tuples
+        """
+        index = self.getChunkIndex()
+        if index is None:
+            # count the lines the hard way, then start from the beginning
+            total, lastchar = 0, None
+            for channel, text in self.getChunks(TEXT_CHANNELS):
+                total += text.count("\n")
+                if text:
+                    lastchar = text[-1]
+        else:
+            # count the lines in the last indexed chunk and anything since
+            last = index.getRecord(len(index) - 1)
+            total, lastchar = last[index.LINE_START], None
+            for channel, text in self._getChunksFrom(
+                    last[index.FRAME], last[index.OFFSET]):
+                if channel in TEXT_CHANNELS:
+                    total += text.count("\n")
+                    if text:
+                        lastchar = text[-1]
+            # if that was all headers, find the last character of text
+            i = len(index) - 2
+            while lastchar is None and i >= 0:
+                record = index.getRecord(i)
+                if record[index.CHANNEL] in TEXT_CHANNELS:
+                    for channel, text in self._getChunksFrom(
+                            record[index.FRAME], record[index.OFFSET]):
+                        lastchar = text[-1:] or None
+                        break
+                i -= 1
+
+        # skip everything up to and including the skip'th newline; an
+        # unterminated final line counts as a line
+        skip = total - lines
+        if lastchar is not None and lastchar != "\n":
+            skip += 1
+        start = None
+        if index is not None and skip > 0:
+            start = index.getRecord(index.findLast(index.LINE_START, skip - 1))
+            skip -= start[index.LINE_START]
+
+        if start is None:
+            chunks = self.getChunks()
+        else:
+            chunks = self._getChunksFrom(start[index.FRAME],
+                                         start[index.OFFSET])
+        for channel, text in chunks:
+            if skip > 0:
+                if channel not in TEXT_CHANNELS:
+                    continue
+                newlines = text.count("\n")
+                if newlines < skip:
+                    skip -= newlines
+                    continue
+                pos = -1
+                while skip:
+                    pos = text.index("\n", pos + 1)
+                    skip -= 1
+                text = text[pos+1:]
+                if not text:
+                    continue
+            if not channels or channel in channels:
+                yield (channel, text)
+
+    def getTextLength(self):
+        """Return the total length of the stdout and stderr text in this log,
+        using the chunk index when available."""
+        index = self.getChunkIndex()
+        if index is None:
+            frame = offset = length = 0
+        else:
+            last = index.getRecord(len(index) - 1)
+            frame, offset, length = (last[index.FRAME], last[index.OFFSET],
+                                     last[index.TEXT_START])
+        for text in self._getChunksFrom(frame, offset, TEXT_CHANNELS,
+                                        onlyText=True):
+            length += len(text)
+        return length
+
+    def getTextRange(self, start, end=None):
+        """
+        Generate the stdout and stderr text from offset C{start} up to (but
+        not including) offset C{end} in the text of this log, using the chunk
+        index when available to avoid reading the log up to C{start}.
+
+        @param start: starting text offset
+        @param end: ending text offset, or None for the end of the log
+        @returns: iterator of strings
+        """
+        index = self.getChunkIndex()
+        if index is None:
+            chunks = self.getChunks(TEXT_CHANNELS, onlyText=True)
+            skip = start
+        else:
+            record = index.getRecord(
+                    max(0, index.findLast(index.TEXT_START, start)))
+            chunks = self._getChunksFrom(record[index.FRAME],
+                    record[index.OFFSET], TEXT_CHANNELS, onlyText=True)
+            skip = start - record[index.TEXT_START]
+
+        if end is not None:
+            remaining = end - start
+        for text in chunks:
+            if skip:
+                if len(text) <= skip:
+                    skip -= len(text)
+                    continue
+                text = text[skip:]
+                skip = 0
+            if end is not None:
+                if remaining <= 0:
+                    break
+                text = text[:remaining]
+                remaining -= len(text)
+            yield text
+
     def readlines(self, channel=STDOUT):
         """Return an iterator that produces newline-terminated lines,
         excluding header chunks."""
-        # TODO: make this memory-efficient, by turning it into a generator
-        # that retrieves chunks as necessary, like a pull-driven version of
-        # twisted.protocols.basic.LineReceiver
-        alltext = "".join(self.getChunks([channel], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        return self.iterLines([channel])
+
+    def iterLines(self, channels=TEXT_CHANNELS):
+        """
+        Generate the lines of text in the given channels, reading the log a
+        chunk at a time, so that the whole log is never held in memory.  Each
+        line is newline-terminated, except possibly the last.
+
+        @param channels: channels to include; by default, stdout and stderr
+        @returns: iterator of strings
+        """
+        partial = []
+        for text in self.getChunks(list(channels), onlyText=True):
+            lines = text.split("\n")
+            if len(lines) == 1:
+                partial.append(text)
+                continue
+            # complete any line that spans chunks
+            partial.append(lines[0])
+            yield "".join(partial) + "\n"
+            last = lines.pop()
+            for i in xrange(1, len(lines)):
+                yield lines[i] + "\n"
+            partial = []
+            if last:
+                partial.append(last)
+        if partial:
+            yield "".join(partial)
 
     def subscribe(self, receiver, catchup):
         if self.finished:
@@ -394,6 +775,7 @@ class LogFile:
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
+            self._indexChunk(f.tell(), channel, text[offset:offset+size])
             f.write("%d:%d" % (1 + size, channel))
             f.write(text[offset:offset+size])
             f.write(",")
@@ -401,6 +783,14 @@ class LogFile:
         self.runEntries = []
         self.runLength = 0
 
+    def _indexChunk(self, fileoffset, channel, text):
+        if self.indexfile:
+            self.indexfile.write(LogChunkIndex.packRecord(0, fileoffset,
+                channel, self.textLength, self.textLines))
+        if channel in TEXT_CHANNELS:
+            self.textLength += len(text)
+            self.textLines += text.count("\n")
+
     def addEntry(self, channel, text):
         assert not self.finished
 
@@ -470,6 +860,9 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             del self.openfile
+        if self.indexfile:
+            self.indexfile.close()
+            del self.indexfile
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -479,34 +872,26 @@ class LogFile:
 
 
     def compressLog(self):
-        # bail out if there's no compression support
-        if self.compressMethod == "bz2":
-            compressed = self.getFilename() + ".bz2.tmp"
-        elif self.compressMethod == "gz":
-            compressed = self.getFilename() + ".gz.tmp"
-        d = threads.deferToThread(self._compressLog, compressed)
+        """Compress the logfile, as a series of independently compressed
+        frames of L{frameSize} bytes each, so that it can be read starting
+        from any frame.  The result is an ordinary bz2, gzip or xz file with
+        multiple streams.  The chunk index, if any, is rewritten to refer
+        to the frames.  The work is done by the shared
+        L{logcompressor.LogCompressor}, which limits the number of logs
+        compressed at once."""
+        suffix = COMPRESSION_METHODS[self.compressMethod][0]
+        compressed = self.getFilename() + suffix + ".tmp"
+        d = logcompressor.compressor.submit(
+                os.path.getsize(self.getFilename()), compressLogFile,
+                self.getFilename(), compressed, self.compressMethod,
+                self.frameSize)
         d.addCallback(self._renameCompressedLog, compressed)
         d.addErrback(self._cleanupFailedCompress, compressed)
         return d
 
-    def _compressLog(self, compressed):
-        infile = self.getFile()
-        if self.compressMethod == "bz2":
-            cf = BZ2File(compressed, 'w')
-        elif self.compressMethod == "gz":
-            cf = GzipFile(compressed, 'w')
-        bufsize = 1024*1024
-        while True:
-            buf = infile.read(bufsize)
-            cf.write(buf)
-            if len(buf) < bufsize:
-                break
-        cf.close()
     def _renameCompressedLog(self, rv, compressed):
-        if self.compressMethod == "bz2":
-            filename = self.getFilename() + '.bz2'
-        else:
-            filename = self.getFilename() + '.gz'
+        suffix = COMPRESSION_METHODS[self.compressMethod][0]
+        filename = self.getFilename() + suffix
         if runtime.platformType  == 'win32':
             # windows cannot rename a file on top of an existing one, so
             # fall back to delete-first. There are ways this can fail and
@@ -515,11 +900,20 @@ class LogFile:
             if os.path.exists(filename):
                 os.unlink(filename)
         os.rename(compressed, filename)
+        # until the new index is in place, the old index refers to offsets
+        # from the start of the first frame, which are still valid
+        newindex = self.getIndexFilename() + ".tmp"
+        if os.path.exists(newindex):
+            if runtime.platformType  == 'win32':
+                if os.path.exists(self.getIndexFilename()):
+                    os.unlink(self.getIndexFilename())
+            os.rename(newindex, self.getIndexFilename())
         _tryremove(self.getFilename(), 1, 5)
     def _cleanupFailedCompress(self, failure, compressed):
         log.msg("failed to compress %s" % self.getFilename())
-        if os.path.exists(compressed):
-            _tryremove(compressed, 1, 5)
+        for filename in (compressed, self.getIndexFilename() + ".tmp"):
+            if os.path.exists(filename):
+                _tryremove(filename, 1, 5)
         failure.trap() # reraise the failure
 
     # persistence stuff
@@ -533,6 +927,8 @@ class LogFile:
             del d['finished']
         if d.has_key('openfile'):
             del d['openfile']
+        if d.has_key('indexfile'):
+            del d['indexfile']
         return d
 
     def __setstate__(self, d):
@@ -549,6 +945,7 @@ class LogFile:
         self.filename = logfilename
         if not os.path.exists(self.getFilename()):
             self.openfile = open(self.getFilename(), "w")
+            self.indexfile = open(self.getIndexFilename(), "wb")
             self.finished = False
             for channel,text in self.entries:
                 self.addEntry(channel, text)
@@ -584,6 +981,8 @@ class HTMLLogFile:
         return self.html
     def getChunks(self):
         return [(STDERR, self.html)]
+    def iterLines(self, channels=TEXT_CHANNELS):
+        return iter(self.html.splitlines(True))
 
     def subscribe(self, receiver, catchup):
         pass
@@ -602,6 +1001,57 @@ class HTMLLogFile:
         pass
 
 
+def compressLogFile(filename, compressed, method, frameSize):
+    """
+    Compress the logfile C{filename} into C{compressed}, and write a version
+    of its chunk index (if any) that refers to the compressed frames into
+    the index filename plus C{.tmp}.  See L{LogFile.compressLog}.  This runs
+    in a worker thread or process, so it must not touch any shared state.
+
+    @param filename: uncompressed logfile
+    @param compressed: filename for the compressed logfile
+    @param method: key of L{COMPRESSION_METHODS}
+    @param frameSize: uncompressed size of each frame
+    """
+    compress = COMPRESSION_METHODS[method][1]
+    infile = open(filename, "rb")
+    cf = open(compressed, 'wb')
+    # compressed offset of each frame
+    frames = []
+    try:
+        while True:
+            buf = infile.read(frameSize)
+            if not buf:
+                break
+            frames.append(cf.tell())
+            cf.write(compress(buf))
+            if len(buf) < frameSize:
+                break
+    finally:
+        infile.close()
+        cf.close()
+
+    # rewrite the index to point into the frames
+    indexfilename = filename + ".idx"
+    try:
+        index = LogChunkIndex(indexfilename)
+    except IOError:
+        return
+    if not len(index) or not frames:
+        index.f.close()
+        return
+    newindex = open(indexfilename + ".tmp", "wb")
+    try:
+        for i in xrange(len(index)):
+            record = list(index.getRecord(i))
+            frameno = min(record[index.OFFSET] // frameSize, len(frames) - 1)
+            record[index.FRAME] = frames[frameno]
+            record[index.OFFSET] -= frameno * frameSize
+            newindex.write(LogChunkIndex.packRecord(*record))
+    finally:
+        newindex.close()
+        index.f.close()
+
 def _tryremove(filename, timeout, retries):
     """Try to remove a file, and if failed, try again in timeout.
     Increases the timeout by a factor of 4, and only keeps trying for
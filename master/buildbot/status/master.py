@@ -20,7 +20,7 @@ from twisted.persisted import styles
 from twisted.internet import defer
 from zope.interface import implements
 from buildbot import interfaces
-from buildbot.util import bbcollections
+from buildbot.util import bbcollections, lru
 from buildbot.util.eventual import eventually
 from buildbot.changes import changes
 from buildbot.status import buildset, builder, buildrequest
@@ -43,6 +43,12 @@ class Status:
         # No default limit to the log size
         self.logMaxSize = None
         self.logMaxTailSize = None
+        self.buildDirectoryLayout = "flat"
+        self.buildPickleFormat = "full"
+        # builds cached by all builders, limited by their total estimated
+        # size (no limit by default)
+        self.buildCacheBudget = lru.LRUCache(max_size=None,
+                evict_fn=self._buildCacheEvicted)
 
         # subscribe to the things we need to know about
         self.master.subscribeToBuildsetCompletions(
@@ -294,6 +300,9 @@ class Status:
         builder_status.basedir = os.path.join(self.basedir, basedir)
         builder_status.name = name # it might have been updated
         builder_status.status = self
+        builder_status.setBuildDirectoryLayout(self.buildDirectoryLayout)
+        builder_status.setBuildPickleFormat(self.buildPickleFormat)
+        builder_status.buildCacheBudget = self.buildCacheBudget
 
         if not os.path.isdir(builder_status.basedir):
             os.makedirs(builder_status.basedir)
@@ -310,6 +319,17 @@ class Status:
 
         return builder_status
 
+    def _buildCacheEvicted(self, key, build):
+        builder_status, number = key
+        builder_status.buildLRU.remove(number)
+
+    def setBuildCacheTotalBytes(self, limit):
+        """Set the limit on the total estimated size of the builds cached by
+        all builders, or None for no limit"""
+        if limit is None:
+            self.buildCacheBudget.clear()
+        self.buildCacheBudget.set_limits(None, limit)
+
     def builderRemoved(self, name):
         for t in self.watchers:
             if hasattr(t, 'builderRemoved'):
@@ -17,7 +17,7 @@
 from zope.interface import implements
 from twisted.python import components
 from twisted.spread import pb
-from twisted.web import server
+from twisted.web import server, http
 from twisted.web.resource import Resource
 from twisted.web.error import NoResource
 
@@ -48,7 +48,41 @@ class ChunkConsumer:
         self.textlog.finished()
 
 
+def parseByteRange(header, length):
+    """
+    Parse an HTTP Range header specifying a single byte range, for content of
+    the given length.
+
+    @returns: (start, end) tuple, where end is exclusive; None if the header
+    is not understood and should be ignored; or (None, None) if the range is
+    not satisfiable
+    """
+    try:
+        units, spec = header.split("=", 1)
+        if units.strip() != "bytes" or "," in spec:
+            return None
+        first, last = [ p.strip() for p in spec.split("-", 1) ]
+        if not first:
+            # suffix range: the last N bytes
+            start = max(0, length - int(last))
+            end = length
+        else:
+            start = int(first)
+            if last:
+                end = min(int(last) + 1, length)
+            else:
+                end = length
+    except ValueError:
+        return None
+    if start >= length:
+        return (None, None)
+    if start < 0 or end <= start:
+        return None
+    return (start, end)
+
 # /builders/$builder/builds/$buildnum/steps/$stepname/logs/$logname
+#   ?tail=N shows only the last N lines of the log
+#   the text version also supports single byte-range requests
 class TextLog(Resource):
     # a new instance of this Resource is created for each client who views
     # it, so we can afford to track the request in the Resource.
@@ -103,6 +137,22 @@ class TextLog(Resource):
         self._setContentType(req)
         self.req = req
 
+        if self.asText:
+            req.setHeader("accept-ranges", "bytes")
+            range_header = req.getHeader("range")
+            if range_header:
+                length = self.original.getTextLength()
+                byte_range = parseByteRange(range_header, length)
+                if byte_range is not None:
+                    return self._renderRange(req, byte_range, length)
+
+        tail = None
+        if "tail" in req.args:
+            try:
+                tail = int(req.args["tail"][0])
+            except ValueError:
+                pass
+
         if not self.asText:
             self.template = req.site.buildbot_service.templates.get_template("logs.html")                
             
@@ -113,9 +163,33 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
+        if tail is not None and tail >= 0:
+            # just the current tail of the log, without following it
+            consumer = ChunkConsumer(req, self)
+            for chunk in self.original.getTail(tail):
+                consumer.writeChunk(chunk)
+            consumer.finish()
+            return server.NOT_DONE_YET
+
         self.original.subscribeConsumer(ChunkConsumer(req, self))
         return server.NOT_DONE_YET
 
+    def _renderRange(self, req, byte_range, length):
+        start, end = byte_range
+        if start is None:
+            req.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            req.setHeader("content-range", "bytes */%d" % length)
+            return ''
+        req.setResponseCode(http.PARTIAL_CONTENT)
+        req.setHeader("content-range",
+                      "bytes %d-%d/%d" % (start, end - 1, length))
+        req.setHeader("content-length", end - start)
+        for text in self.original.getTextRange(start, end):
+            req.write(text)
+        req.finish()
+        self.req = None
+        return server.NOT_DONE_YET
+
     def _setContentType(self, req):
         if self.asText:
             req.setHeader("content-type", "text/plain; charset=utf-8")
@@ -17,7 +17,6 @@
 """Simple JSON exporter."""
 
 import datetime
-import os
 import re
 
 from twisted.internet import defer
@@ -494,11 +493,13 @@ class BuildsJsonResource(AllBuildsJsonResource):
         # This would load all the pickles and is way too heavy, especially that
         # it would trash the cache:
         # self.children['builds'].asDict(request)
-        # TODO(maruel) This list should also need to be cached but how?
+        # The build index knows which builds have pickles, in either
+        # directory layout, without listing the builder directory.
+        index = self.builder_status.buildIndex
         builds = dict([
-            (int(file), None)
-            for file in os.listdir(self.builder_status.basedir)
-            if _IS_INT.match(file)
+            (number, None)
+            for number in index.getNumbers()
+            if index.get(number)['pickle']
         ])
         return builds
 
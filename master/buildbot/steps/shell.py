@@ -15,8 +15,10 @@
 
 
 import re
+import sys
 from twisted.python import log, failure
 from twisted.spread import pb
+from buildbot import util
 from buildbot.process import buildstep
 from buildbot.status.results import SUCCESS, WARNINGS, FAILURE
 from buildbot.status.logfile import STDOUT, STDERR
@@ -332,10 +334,31 @@ class StringFileWriter(pb.Referenceable):
     def remote_close(self):
         pass
 
+class WarningLogObserver(buildstep.LogLineObserver):
+    """Feed each line of a step's log to its L{scanWarningLine} method, as
+    the lines arrive.  Used by L{WarningCountingShellCommand} when
+    C{incrementalWarnings} is true."""
+
+    def __init__(self):
+        buildstep.LogLineObserver.__init__(self)
+        # like createSummary, don't limit the line length
+        self.setMaxLineLength(sys.maxint)
+
+    def outLineReceived(self, line):
+        self.step.scanWarningLine(line)
+
+    def errLineReceived(self, line):
+        self.step.scanWarningLine(line)
+
 class WarningCountingShellCommand(ShellCommand):
     renderables = [ 'suppressionFile' ]
 
     warnCount = 0
+    incrementalWarnings = False
+    warningObserver = None
+    WARNING_TEXT_INTERVAL = 1
+    """minimum interval, in seconds, between updates of the step text with the
+    running warning count, when scanning incrementally"""
     warningPattern = '.*warning[: ].*'
     # The defaults work for GNU Make.
     directoryEnterPattern = (u"make.*: Entering directory " 
@@ -349,7 +372,7 @@ class WarningCountingShellCommand(ShellCommand):
     def __init__(self,
                  warningPattern=None, warningExtractor=None, maxWarnCount=None,
                  directoryEnterPattern=None, directoryLeavePattern=None,
-                 suppressionFile=None, **kwargs):
+                 suppressionFile=None, incrementalWarnings=False, **kwargs):
         # See if we've been given a regular expression to use to match
         # warnings. If not, use a default that assumes any line with "warning"
         # present is a warning. This may lead to false positives in some cases.
@@ -366,6 +389,7 @@ class WarningCountingShellCommand(ShellCommand):
         else:
             self.warningExtractor = WarningCountingShellCommand.warnExtractWholeLine
         self.maxWarnCount = maxWarnCount
+        self.incrementalWarnings = incrementalWarnings
 
         # And upcall to let the base class do its work
         ShellCommand.__init__(self, **kwargs)
@@ -375,10 +399,17 @@ class WarningCountingShellCommand(ShellCommand):
                                  directoryLeavePattern=directoryLeavePattern,
                                  warningExtractor=warningExtractor,
                                  maxWarnCount=maxWarnCount,
-                                 suppressionFile=suppressionFile)
+                                 suppressionFile=suppressionFile,
+                                 incrementalWarnings=incrementalWarnings)
         self.suppressions = []
         self.directoryStack = []
 
+        # in incremental mode, scan the log for warnings as it arrives,
+        # rather than all at once in createSummary
+        if self.incrementalWarnings:
+            self.warningObserver = WarningLogObserver()
+            self.addLogObserver('stdio', self.warningObserver)
+
     def addSuppression(self, suppressionList):
         """
         This method can be used to add patters of warnings that should
@@ -449,6 +480,9 @@ class WarningCountingShellCommand(ShellCommand):
         self.warnCount += 1
 
     def start(self):
+        if self.incrementalWarnings:
+            self.startWarningScan()
+
         if self.suppressionFile == None:
             return ShellCommand.start(self)
 
@@ -488,61 +522,95 @@ class WarningCountingShellCommand(ShellCommand):
         self.addSuppression(list)
         return ShellCommand.start(self)
 
-    def createSummary(self, log):
-        """
-        Match log lines against warningPattern.
-
-        Warnings are collected into another log for this step, and the
-        build-wide 'warnings-count' is updated."""
-
+    def startWarningScan(self):
+        """Prepare to scan lines of output for warnings with
+        L{scanWarningLine}."""
         self.warnCount = 0
+        self.loggedWarnings = []
+        self.warningTextUpdated = 0
+        self.warningsStatistic = self.step_status.getStatistic('warnings', 0)
 
         # Now compile a regular expression from whichever warning pattern we're
         # using
-        wre = self.warningPattern
-        if isinstance(wre, str):
-            wre = re.compile(wre)
-
-        directoryEnterRe = self.directoryEnterPattern
-        if (directoryEnterRe != None
-                and isinstance(directoryEnterRe, basestring)):
-            directoryEnterRe = re.compile(directoryEnterRe)
-
-        directoryLeaveRe = self.directoryLeavePattern
-        if (directoryLeaveRe != None
-                and isinstance(directoryLeaveRe, basestring)):
-            directoryLeaveRe = re.compile(directoryLeaveRe)
-
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
-        warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                    continue
-            if (directoryLeaveRe and
-                self.directoryStack and
-                directoryLeaveRe.search(line)):
-                    self.directoryStack.pop()
-                    continue
+        self.warningRe = self.warningPattern
+        if isinstance(self.warningRe, str):
+            self.warningRe = re.compile(self.warningRe)
 
-            match = wre.match(line)
+        self.directoryEnterRe = self.directoryEnterPattern
+        if (self.directoryEnterRe != None
+                and isinstance(self.directoryEnterRe, basestring)):
+            self.directoryEnterRe = re.compile(self.directoryEnterRe)
+
+        self.directoryLeaveRe = self.directoryLeavePattern
+        if (self.directoryLeaveRe != None
+                and isinstance(self.directoryLeaveRe, basestring)):
+            self.directoryLeaveRe = re.compile(self.directoryLeaveRe)
+
+    def scanWarningLine(self, line):
+        """
+        Check a line (without its newline) from the output of this command
+        against our warnings regular expressions.  If it matches, bump the
+        warnings count and add the line to the collection of lines with
+        warnings.  Lines entering or leaving directories update the
+        directory stack instead.
+        """
+        if self.directoryEnterRe:
+            match = self.directoryEnterRe.search(line)
             if match:
-                self.maybeAddWarning(warnings, line, match)
+                self.directoryStack.append(match.group(1))
+                return
+        if (self.directoryLeaveRe and
+            self.directoryStack and
+            self.directoryLeaveRe.search(line)):
+                self.directoryStack.pop()
+                return
+
+        match = self.warningRe.match(line)
+        if match:
+            oldCount = self.warnCount
+            self.maybeAddWarning(self.loggedWarnings, line, match)
+            if self.warningObserver and self.warnCount != oldCount:
+                self.warningCountChanged()
+
+    def warningCountChanged(self):
+        # show the running count in the step's status, but don't flood the
+        # status watchers with text changes
+        self.step_status.setStatistic('warnings',
+                self.warningsStatistic + self.warnCount)
+        now = util.now()
+        if now - self.warningTextUpdated >= self.WARNING_TEXT_INTERVAL:
+            self.warningTextUpdated = now
+            self.step_status.setText(self.describe(False) +
+                                     ["%d warnings" % self.warnCount])
+
+    def createSummary(self, log):
+        """
+        Match log lines against warningPattern.
+
+        Warnings are collected into another log for this step, and the
+        build-wide 'warnings-count' is updated.  If C{incrementalWarnings}
+        is set, the lines have already been matched as they arrived, so the
+        log is not read again."""
+
+        if self.warningObserver:
+            # pick up any unterminated final lines
+            self.warningObserver.flushLines()
+        else:
+            self.startWarningScan()
+            # read the log a line at a time, rather than as one big string
+            for line in log.iterLines():
+                if line.endswith("\n"):
+                    line = line[:-1]
+                self.scanWarningLine(line)
 
         # If there were any warnings, make the log if lines with warnings
         # available
         if self.warnCount:
             self.addCompleteLog("warnings (%d)" % self.warnCount,
-                    "\n".join(warnings) + "\n")
+                    "\n".join(self.loggedWarnings) + "\n")
 
-        warnings_stat = self.step_status.getStatistic('warnings', 0)
-        self.step_status.setStatistic('warnings', warnings_stat + self.warnCount)
+        self.step_status.setStatistic('warnings',
+                self.warningsStatistic + self.warnCount)
 
         try:
             old_count = self.getProperty("warnings-count")
@@ -199,7 +199,7 @@ class Mercurial(Source):
     def parseGotRevision(self, _):
         d = self._dovccmd(['identify', '--id', '--debug'])
         def _setrev(res):
-            revision = self.getLog('stdio').readlines()[-1].strip()
+            revision = list(self.getLog('stdio').readlines())[-1].strip()
             if len(revision) != 40:
                 raise ValueError("Incorrect revision id")
             log.msg("Got Mercurial revision %s" % (revision, ))
@@ -262,7 +262,7 @@ class Mercurial(Source):
         else:
             d = self._dovccmd(['identify', '--branch'])
             def _getbranch(res):
-                branch = self.getLog('stdio').readlines()[-1].strip()
+                branch = list(self.getLog('stdio').readlines())[-1].strip()
                 return branch
             d.addCallback(_getbranch).addErrback
             return d
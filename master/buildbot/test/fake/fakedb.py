@@ -349,6 +349,10 @@ class FakeChangesComponent(FakeDBComponent):
             ch = None
         return defer.succeed(self._ch2chdict(ch))
 
+    def getChanges(self, changeids):
+        return defer.succeed([ self._ch2chdict(self.changes.get(changeid))
+                               for changeid in changeids ])
+
     # TODO: addChange
     # TODO: getRecentChanges
 
@@ -412,6 +416,13 @@ class FakeSchedulersComponent(FakeDBComponent):
         self.classifications.setdefault(schedulerid, {}).update(classifications)
         return defer.succeed(None)
 
+    def queueChangeClassifications(self, schedulerid, classifications):
+        # written immediately
+        return self.classifyChanges(schedulerid, classifications)
+
+    def waitForQueuedClassifications(self):
+        return defer.succeed(None)
+
     def flushChangeClassifications(self, schedulerid, less_than=None):
         if less_than is not None:
             classifications = self.classifications.setdefault(schedulerid, {})
@@ -810,7 +821,7 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             return defer.succeed(None)
 
     def getBuildRequests(self, buildername=None, complete=None, claimed=None,
-                         bsid=None):
+                         bsid=None, after_brid=None):
         rv = []
         for br in self.reqs.itervalues():
             if buildername and br.buildername != buildername:
@@ -835,9 +846,17 @@ class FakeBuildRequestsComponent(FakeDBComponent):
             if bsid is not None:
                 if br.buildsetid != bsid:
                     continue
+            if after_brid is not None:
+                if br.id <= after_brid:
+                    continue
             rv.append(self._brdictFromRow(br))
         return defer.succeed(rv)
 
+    def getLatestBuildRequestId(self):
+        if self.reqs:
+            return defer.succeed(max(self.reqs.iterkeys()))
+        return defer.succeed(None)
+
     def claimBuildRequests(self, brids):
         for brid in brids:
             if brid not in self.reqs:
@@ -883,8 +902,8 @@ class FakeBuildRequestsComponent(FakeDBComponent):
                 and row.claimed_by_name is not None
                 and row.claimed_by_incarnation is not None):
             claimed = True
-            master_name = self.db.master.master_name
-            master_incarnation = self.db.master.master_incarnation
+            master_name = self.MASTER_NAME
+            master_incarnation = self.MASTER_INCARNATION
             if (row.claimed_by_name == master_name and
                 row.claimed_by_incarnation == master_incarnation):
                mine = True
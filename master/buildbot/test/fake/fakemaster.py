@@ -29,6 +29,8 @@ def make_master():
     def fake_get_cache(name, miss_fn):
         fake_cache = mock.Mock(name='fakemaster.caches[%r]' % name)
         fake_cache.get = miss_fn
+        fake_cache.peek = lambda key : None
+        fake_cache.add = lambda key, value : None
         return fake_cache
     fakemaster.caches.get_cache = fake_get_cache
 
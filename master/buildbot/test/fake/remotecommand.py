@@ -13,8 +13,11 @@
 #
 # Copyright Buildbot Team Members
 
+from StringIO import StringIO
+from zope.interface import implements
 from twisted.internet import defer
 from twisted.python import failure
+from buildbot import interfaces
 from buildbot.status.logfile import STDOUT, STDERR, HEADER
 
 
@@ -52,15 +55,21 @@ class FakeRemoteShellCommand(FakeLoggedRemoteCommand):
     def __init__(self, workdir, command, env=None,
                  want_stdout=1, want_stderr=1,
                  timeout=DEFAULT_TIMEOUT, maxTime=DEFAULT_MAXTIME, logfiles={},
-                 usePTY=DEFAULT_USEPTY, logEnviron=True):
+                 usePTY=DEFAULT_USEPTY, logEnviron=True,
+                 bufferTimeout=None, maxBufferSize=None):
         args = dict(workdir=workdir, command=command, env=env or {},
                 want_stdout=want_stdout, want_stderr=want_stderr,
                 timeout=timeout, maxTime=maxTime, logfiles=logfiles,
                 usePTY=usePTY, logEnviron=logEnviron)
+        if bufferTimeout is not None:
+            args['bufferTimeout'] = bufferTimeout
+        if maxBufferSize is not None:
+            args['maxBufferSize'] = maxBufferSize
         FakeLoggedRemoteCommand.__init__(self, "shell", args)
 
 
 class FakeLogFile(object):
+    implements(interfaces.IStatusLog)
 
     def __init__(self, name):
         self.name = name
@@ -68,21 +77,36 @@ class FakeLogFile(object):
         self.stdout = ''
         self.stderr = ''
         self.chunks = []
+        self.watchers = []
 
     def getName(self):
         return self.name
 
+    def subscribe(self, receiver, catchup):
+        if catchup:
+            for channel, data in self.chunks:
+                receiver.logChunk(None, None, self, channel, data)
+        self.watchers.append(receiver)
+
+    def unsubscribe(self, receiver):
+        self.watchers.remove(receiver)
+
     def addHeader(self, data):
         self.header += data
-        self.chunks.append((HEADER, data))
+        self._addChunk(HEADER, data)
 
     def addStdout(self, data):
         self.stdout += data
-        self.chunks.append((STDOUT, data))
+        self._addChunk(STDOUT, data)
 
     def addStderr(self, data):
         self.stderr += data
-        self.chunks.append((STDERR, data))
+        self._addChunk(STDERR, data)
+
+    def _addChunk(self, channel, data):
+        self.chunks.append((channel, data))
+        for w in self.watchers:
+            w.logChunk(None, None, self, channel, data)
 
     def readlines(self): # TODO: remove channel arg from logfile.py
         return self.stdout.split('\n')
@@ -90,6 +114,10 @@ class FakeLogFile(object):
     def getText(self):
         return self.stdout
 
+    def iterLines(self, channels=(STDOUT, STDERR)):
+        text = "".join(self.getChunks(channels, onlyText=True))
+        return iter(StringIO(text).readlines())
+
     def getChunks(self, channels=[], onlyText=False):
         if onlyText:
             return [ data
@@ -232,9 +260,14 @@ class ExpectShell(ExpectLogged):
     def __init__(self, workdir, command, env={},
                  want_stdout=1, want_stderr=1,
                  timeout=DEFAULT_TIMEOUT, maxTime=DEFAULT_MAXTIME, logfiles={},
-                 usePTY=DEFAULT_USEPTY, logEnviron=True):
+                 usePTY=DEFAULT_USEPTY, logEnviron=True,
+                 bufferTimeout=None, maxBufferSize=None):
         args = dict(workdir=workdir, command=command, env=env,
                 want_stdout=want_stdout, want_stderr=want_stderr,
                 timeout=timeout, maxTime=maxTime, logfiles=logfiles,
                 usePTY=usePTY, logEnviron=logEnviron)
+        if bufferTimeout is not None:
+            args['bufferTimeout'] = bufferTimeout
+        if maxBufferSize is not None:
+            args['maxBufferSize'] = maxBufferSize
         ExpectLogged.__init__(self, "shell", args)
@@ -123,3 +123,13 @@ class ChangeFilter(unittest.TestCase):
         self.yes(Change(project='p', repository='r', branch='b', category='c', ff=True),
                 "all match and fn returns True -> False")
         self.check()
+
+    def test_getExactValues(self):
+        self.assertEqual(filter.ChangeFilter().getExactValues(), None)
+        self.assertEqual(filter.ChangeFilter(branch_re='b').getExactValues(),
+                         None)
+        self.assertEqual(filter.ChangeFilter(branch=None).getExactValues(),
+                         ('branch', [ None ]))
+        self.assertEqual(filter.ChangeFilter(project=['p', 'q'],
+                            branch='b').getExactValues(),
+                         ('project', [ 'p', 'q' ]))
@@ -0,0 +1,105 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from twisted.python import log
+from buildbot.changes import routing, filter
+from buildbot.test.fake.state import State
+
+class Change(State):
+    project = ''
+    repository = ''
+    branch = ''
+    category = ''
+
+class ChangeRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = routing.ChangeRouter('changes')
+        self.delivered = []
+
+    def subscribe(self, name, **kwargs):
+        change_filter = None
+        if kwargs:
+            change_filter = filter.ChangeFilter(**kwargs)
+        return self.router.subscribe(
+                lambda change : self.delivered.append(name), change_filter)
+
+    def deliver(self, **kwargs):
+        self.delivered = []
+        self.router.deliver(Change(**kwargs))
+        return sorted(self.delivered)
+
+    def test_routing(self):
+        self.subscribe('all')
+        self.subscribe('trunk', branch=None)
+        self.subscribe('releases', branch=['1.0', '2.0'])
+        self.subscribe('proj', project='proj', branch='1.0')
+        self.subscribe('re', branch_re='2\\.')
+        self.subscribe('fn', category_fn=lambda c : True)
+        self.assertEqual(self.deliver(branch=None),
+                         [ 'all', 'fn', 're', 'trunk' ])
+        self.assertEqual(self.deliver(branch='1.0'),
+                         [ 'all', 'fn', 're', 'releases' ])
+        self.assertEqual(self.deliver(branch='1.0', project='proj'),
+                         [ 'all', 'fn', 'proj', 're', 'releases' ])
+        self.assertEqual(self.deliver(branch='3.0'), [ 'all', 'fn', 're' ])
+
+    def test_candidates_include_all_matches(self):
+        # every subscriber whose filter passes the change is a candidate
+        filters = [ dict(), dict(branch=None), dict(branch=['a', 'b']),
+                    dict(project=['p', 'q'], branch='a'),
+                    dict(repository='r', category_re='c'),
+                    dict(category=['c', None]), dict(branch_re='b') ]
+        subs = []
+        for kwargs in filters:
+            cf = kwargs and filter.ChangeFilter(**kwargs) or None
+            subs.append((cf, self.router.subscribe(lambda c : None, cf)))
+        for project in ('', 'p'):
+            for branch in (None, 'a', 'b', 'c'):
+                for category in (None, 'c', 'cc'):
+                    for repository in ('', 'r'):
+                        change = Change(project=project, branch=branch,
+                                        category=category,
+                                        repository=repository)
+                        candidates = self.router.getCandidates(change)
+                        for cf, sub in subs:
+                            if cf is None or cf.filter_change(change):
+                                self.assertIn(sub, candidates)
+
+    def test_unsubscribe(self):
+        sub = self.subscribe('releases', branch=['1.0', '2.0'])
+        sub2 = self.subscribe('all')
+        sub.unsubscribe()
+        sub2.unsubscribe()
+        self.assertEqual(self.deliver(branch='1.0'), [])
+        self.assertEqual(self.router.index, {})
+
+    def test_unhashable(self):
+        self.subscribe('lists', branch=[['a']])
+        self.assertEqual(self.deliver(branch=['a']), [ 'lists' ])
+
+    def test_fanout_metric(self):
+        self.subscribe('all')
+        self.subscribe('trunk', branch=None)
+        fanout = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                fanout.append((eventDict['metric'].histogram,
+                               eventDict['metric'].value))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        self.deliver(branch='1.0')
+        self.assertEqual(fanout, [ ('ChangeRouter.fanout', 1) ])
@@ -241,6 +241,40 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check)
         return d
 
+    def test_getBuildRequests_after_brid(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=70, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=71, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=72, buildsetid=self.BSID),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getBuildRequests(after_brid=70))
+        def check(brlist):
+            self.assertEqual(sorted([ br['brid'] for br in brlist ]),
+                             sorted([71, 72]))
+        d.addCallback(check)
+        return d
+
+    def test_getLatestBuildRequestId(self):
+        d = self.insertTestData([
+            fakedb.BuildRequest(id=70, buildsetid=self.BSID),
+            fakedb.BuildRequest(id=72, buildsetid=self.BSID, complete=1),
+            fakedb.BuildRequest(id=71, buildsetid=self.BSID),
+        ])
+        d.addCallback(lambda _ :
+                self.db.buildrequests.getLatestBuildRequestId())
+        def check(brid):
+            self.assertEqual(brid, 72)
+        d.addCallback(check)
+        return d
+
+    def test_getLatestBuildRequestId_empty(self):
+        d = self.db.buildrequests.getLatestBuildRequestId()
+        def check(brid):
+            self.assertEqual(brid, None)
+        d.addCallback(check)
+        return d
+
     def test_getBuildRequests_combo(self):
         d = self.insertTestData([
             # 44: everything we want
@@ -414,6 +448,15 @@ class TestBuildsetsConnectorComponent(
         d.addCallback(check_claims)
         return d
 
+    def test_claimBuildRequests_multiple_tmp_table(self):
+        # force the use of a temporary table for the ids
+        self.db.buildrequests.MAX_IN_LIST = 1
+        return self.test_claimBuildRequests_multiple()
+
+    def test_claimBuildRequests_race_multiple_tmp_table(self):
+        self.db.buildrequests.MAX_IN_LIST = 1
+        return self.test_claimBuildRequests_race_multiple()
+
     def test_claimBuildRequests_reclaim(self):
         return self.do_test_claimBuildRequests([
                 fakedb.BuildRequest(id=44, buildsetid=self.BSID,
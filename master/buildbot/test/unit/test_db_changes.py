@@ -20,6 +20,7 @@ from twisted.trial import unittest
 from twisted.internet import defer, task
 from buildbot.changes.changes import Change
 from buildbot.db import changes
+from buildbot.process import cache
 from buildbot.test.util import connector_component
 from buildbot.test.fake import fakedb
 from buildbot.util import epoch2datetime
@@ -410,3 +411,62 @@ class TestChangesConnectorComponent(
                         { 'notest' : ('no', 'Change') })
         d.addCallback(check)
         return d
+
+    def test_getChanges(self):
+        d = self.insertTestData(self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ :
+                self.db.changes.getChanges([14, 99, 13]))
+        def check(chdicts):
+            self.assertEqual(chdicts[0], self.change14_dict)
+            self.assertEqual(chdicts[1], None)
+            self.assertEqual(chdicts[2]['changeid'], 13)
+            self.assertEqual(sorted(chdicts[2]['files']),
+                        sorted(['master/README.txt', 'slave/README.txt']))
+            self.assertEqual(chdicts[2]['properties'],
+                        { 'notest' : ('no', 'Change') })
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_empty(self):
+        d = self.db.changes.getChanges([])
+        def check(chdicts):
+            self.assertEqual(chdicts, [])
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_batched(self):
+        self.patch(self.db.changes, 'MAX_IN_LIST', 2)
+        d = self.insertTestData([
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=12),
+        ] + self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ :
+                self.db.changes.getChanges([10, 11, 12, 13, 14]))
+        def check(chdicts):
+            self.assertEqual([ c['changeid'] for c in chdicts ],
+                             [10, 11, 12, 13, 14])
+            self.assertEqual(chdicts[4], self.change14_dict)
+        d.addCallback(check)
+        return d
+
+    def test_getChanges_uses_cache(self):
+        # use a real cache for this test
+        self.db.master.caches = cache.CacheManager()
+        self.db.master.caches.load_config(dict(chdicts=10))
+        self.db.changes = changes.ChangesConnectorComponent(self.db)
+
+        d = self.insertTestData(self.change13_rows + self.change14_rows)
+        d.addCallback(lambda _ : self.db.changes.getChange(13))
+        def keep13(chdict):
+            self.chdict13 = chdict
+            return self.db.changes.getChanges([13, 14])
+        d.addCallback(keep13)
+        def check(chdicts):
+            # change 13 came from the cache, and 14 is now cached
+            self.failUnless(chdicts[0] is self.chdict13)
+            self.assertEqual(chdicts[1], self.change14_dict)
+            self.failUnless(
+                self.db.changes.getChange.cache.peek(14) is chdicts[1])
+        d.addCallback(check)
+        return d
@@ -16,7 +16,9 @@
 import sqlalchemy as sa
 from twisted.trial import unittest
 from twisted.internet import defer
+from twisted.python import log
 from buildbot.db import pool
+from buildbot.process import metrics
 from buildbot.test.util import db
 
 class Basic(unittest.TestCase):
@@ -104,6 +106,69 @@ class Basic(unittest.TestCase):
         return d
 
 
+class Instrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = sa.create_engine('sqlite://')
+        self.engine.optimal_thread_pool_size = 1
+        self.pool = pool.DBThreadPool(self.engine)
+
+        self.events = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                self.events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_pool_size_default(self):
+        self.assertEqual(self.pool.max, 1)
+
+    def test_pool_size_limited(self):
+        self.engine.optimal_thread_pool_size = 15
+        self.pool.setPoolSize(20)
+        self.assertEqual(self.pool.max, 15)
+        self.pool.setPoolSize(3)
+        self.assertEqual(self.pool.max, 3)
+        self.pool.setPoolSize(None)
+        self.assertEqual(self.pool.max, 15)
+
+    def test_histograms(self):
+        def select_something(conn):
+            return conn.execute("SELECT 1").scalar()
+        d = self.pool.do(select_something)
+        def check(_):
+            names = sorted(ev.histogram for ev in self.events
+                           if isinstance(ev, metrics.MetricHistogramEvent))
+            # named for this test method, which called do
+            self.assertEqual(names, [
+                'DBThreadPool.execution.test_db_pool.test_histograms',
+                'DBThreadPool.queue_wait.test_db_pool.test_histograms' ])
+        d.addCallback(check)
+        return d
+
+    def test_saturation(self):
+        def select_something(conn):
+            return conn.execute("SELECT 1").scalar()
+        self.engine.optimal_thread_pool_size = 2
+        self.pool.setPoolSize(2)
+        # with two threads, one waiting query is a warning, and two are
+        # critical
+        dl = [ self.pool.do(select_something) for _ in range(5) ]
+        d = defer.gatherResults(dl)
+        def check(_):
+            levels = [ ev.level for ev in self.events
+                       if isinstance(ev, metrics.MetricAlarmEvent)
+                       and ev.alarm == 'DBThreadPool.saturation' ]
+            self.assertEqual(levels, [ metrics.ALARM_WARN,
+                    metrics.ALARM_CRIT, metrics.ALARM_WARN,
+                    metrics.ALARM_OK ])
+        d.addCallback(check)
+        return d
+
+
 class BasicWithDebug(Basic):
 
     # same thing, but with debug=True
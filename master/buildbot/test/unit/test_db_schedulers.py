@@ -163,6 +163,113 @@ class TestSchedulersConnectorComponent(
         d.addCallback(check)
         return d
 
+    def checkClassifications(self, _, expected):
+        def thd(conn):
+            sch_chgs_tbl = self.db.model.scheduler_changes
+            q = sch_chgs_tbl.select(order_by=[sch_chgs_tbl.c.schedulerid,
+                                              sch_chgs_tbl.c.changeid])
+            rows = [ (row.schedulerid, row.changeid, row.important)
+                     for row in conn.execute(q).fetchall() ]
+            self.assertEqual(rows, expected)
+        return self.db.pool.do(thd)
+
+    def test_classifyChanges_chunks(self):
+        self.db.schedulers.MAX_ROWS_PER_STATEMENT = 2
+        d = self.insertTestData([ self.change3, self.change4, self.change5,
+                                  self.change6, self.scheduler24,
+                fakedb.SchedulerChange(schedulerid=24, changeid=4, important=0),
+        ])
+        d.addCallback(lambda _ :
+                self.db.schedulers.classifyChanges(24,
+                    { 3 : False, 4 : True, 5 : True, 6 : False }))
+        d.addCallback(self.checkClassifications,
+                [ (24, 3, 0), (24, 4, 1), (24, 5, 1), (24, 6, 0) ])
+        return d
+
+    def test_writeClassifications_delete_insert(self):
+        # the path used by databases without an upsert statement
+        d = self.insertTestData([ self.change3, self.change4, self.scheduler24,
+                fakedb.Scheduler(schedulerid=25, name='other'),
+                fakedb.SchedulerChange(schedulerid=24, changeid=3, important=0),
+                fakedb.SchedulerChange(schedulerid=25, changeid=3, important=0),
+        ])
+        d.addCallback(lambda _ : self.db.pool.do(lambda conn :
+                self.db.schedulers._writeClassifications(conn,
+                    [ (24, 3, True), (24, 4, False), (25, 4, True) ],
+                    dialect='postgresql')))
+        d.addCallback(self.checkClassifications,
+                [ (24, 3, 1), (24, 4, 0), (25, 3, 0), (25, 4, 1) ])
+        return d
+
+    def test_writeClassifications_old_sqlite(self):
+        # SQLite before 3.7.11 cannot insert several rows in one statement
+        if self.db_engine.dialect.name != 'sqlite':
+            raise unittest.SkipTest("only applies to SQLite")
+        calls = []
+        real_write = self.db.schedulers._writeClassificationsSQLiteRowByRow
+        def _writeClassificationsSQLiteRowByRow(conn, rows):
+            calls.append(rows)
+            return real_write(conn, rows)
+        self.db.schedulers._writeClassificationsSQLiteRowByRow = \
+                _writeClassificationsSQLiteRowByRow
+        d = self.insertTestData([ self.change3, self.change4, self.scheduler24,
+                fakedb.SchedulerChange(schedulerid=24, changeid=3, important=0),
+        ])
+        d.addCallback(lambda _ : self.db.pool.do(lambda conn :
+                self.db.schedulers._writeClassifications(conn,
+                    [ (24, 3, True), (24, 4, False) ],
+                    sqlite_version=(3, 7, 10))))
+        d.addCallback(self.checkClassifications,
+                [ (24, 3, 1), (24, 4, 0) ])
+        d.addCallback(lambda _ : self.assertEqual(len(calls), 1))
+        return d
+
+    def test_queueChangeClassifications(self):
+        writes = []
+        real_write = self.db.schedulers._writeClassifications
+        def _writeClassifications(conn, rows):
+            writes.append(sorted(rows))
+            return real_write(conn, rows)
+        self.db.schedulers._writeClassifications = _writeClassifications
+
+        d = self.insertTestData([ self.change3, self.change4, self.scheduler24,
+                fakedb.Scheduler(schedulerid=25, name='other') ])
+        def queue(_):
+            return defer.gatherResults([
+                self.db.schedulers.queueChangeClassifications(24, { 3 : True }),
+                self.db.schedulers.queueChangeClassifications(25, { 3 : False }),
+                self.db.schedulers.queueChangeClassifications(24, { 4 : False }),
+            ])
+        d.addCallback(queue)
+        def check(_):
+            # all written in one go
+            self.assertEqual(writes,
+                    [ [ (24, 3, True), (24, 4, False), (25, 3, False) ] ])
+        d.addCallback(check)
+        d.addCallback(self.checkClassifications,
+                [ (24, 3, 1), (24, 4, 0), (25, 3, 0) ])
+        return d
+
+    def test_queueChangeClassifications_read_after_write(self):
+        d = self.insertTestData([ self.change3, self.change4, self.change5,
+                                  self.scheduler24 ])
+        def queue_and_read(_):
+            self.db.schedulers.queueChangeClassifications(24,
+                    { 3 : True, 4 : False })
+            return self.db.schedulers.getChangeClassifications(24)
+        d.addCallback(queue_and_read)
+        def check(cls):
+            self.assertEqual(cls, { 3 : True, 4 : False })
+        d.addCallback(check)
+        def queue_and_flush(_):
+            self.db.schedulers.queueChangeClassifications(24, { 5 : True })
+            return self.db.schedulers.flushChangeClassifications(24)
+        d.addCallback(queue_and_flush)
+        d.addCallback(self.checkClassifications, [])
+        d.addCallback(lambda _ :
+                self.db.schedulers.waitForQueuedClassifications())
+        return d
+
     def test_flushChangeClassifications(self):
         d = self.insertTestData([ self.change3, self.change4,
                                   self.change5, self.scheduler24 ])
@@ -0,0 +1,169 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.python import log
+from buildbot import locks
+from buildbot.process import metrics
+
+class BaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = locks.MasterLock('lock', maxCount=2)
+        self.counting = self.lockid.access('counting')
+        self.exclusive = self.lockid.access('exclusive')
+        self.lock = locks.BaseLock('lock', maxCount=2)
+        self.clock = self.lock._reactor = task.Clock()
+        self.woken = []
+
+    def wait(self, owner, access):
+        d = self.lock.waitUntilMaybeAvailable(owner, access)
+        d.addCallback(lambda _ : self.woken.append(owner))
+        return d
+
+    def wake(self):
+        self.woken = []
+        self.clock.advance(0)
+        return self.woken
+
+    def test_counting(self):
+        self.lock.claim('a', self.counting)
+        self.lock.claim('b', self.counting)
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable('c', self.exclusive))
+        self.assertTrue(self.lock.isOwner('a', self.counting))
+        self.lock.release('a', self.counting)
+        self.assertFalse(self.lock.isOwner('a', self.counting))
+        self.assertTrue(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable('c', self.exclusive))
+        self.lock.release('b', self.counting)
+        self.assertTrue(self.lock.isAvailable('c', self.exclusive))
+
+    def test_claim_twice(self):
+        self.lock.claim('a', self.counting)
+        self.lock.claim('a', self.counting)
+        self.lock.release('a', self.counting)
+        self.assertTrue(self.lock.isOwner('a', self.counting))
+        self.assertEqual(self.lock._getOwnersCount(), (0, 1))
+
+    def test_fifo(self):
+        self.lock.claim('a', self.counting)
+        self.lock.claim('b', self.counting)
+        self.wait('x', self.exclusive)
+        self.wait('c', self.counting)
+        self.lock.release('a', self.counting)
+        # the counting waiter, and newcomers, can't overtake the exclusive
+        # waiter
+        self.assertEqual(self.wake(), [])
+        self.assertFalse(self.lock.isAvailable('c', self.counting))
+        self.assertFalse(self.lock.isAvailable('d', self.counting))
+        self.lock.release('b', self.counting)
+        self.assertEqual(self.wake(), [ 'x' ])
+        # the lock is reserved for the woken waiter
+        self.assertFalse(self.lock.isAvailable('d', self.exclusive))
+        self.assertTrue(self.lock.isAvailable('x', self.exclusive))
+        self.lock.claim('x', self.exclusive)
+        self.assertEqual(self.lock.getWaitingCount(), 1)
+        self.lock.release('x', self.exclusive)
+        self.assertEqual(self.wake(), [ 'c' ])
+        # one slot is reserved for c, the other is free
+        self.assertTrue(self.lock.isAvailable('d', self.counting))
+        self.lock.claim('d', self.counting)
+        self.assertFalse(self.lock.isAvailable('e', self.counting))
+        self.lock.claim('c', self.counting)
+        self.assertEqual(self.lock.getWaitingCount(), 0)
+
+    def test_wake_several(self):
+        self.lock.claim('x', self.exclusive)
+        for owner in 'abc':
+            self.wait(owner, self.counting)
+        self.lock.release('x', self.exclusive)
+        self.assertEqual(self.wake(), [ 'a', 'b' ])
+        self.lock.claim('a', self.counting)
+        self.lock.release('a', self.counting)
+        self.assertEqual(self.wake(), [ 'c' ])
+
+    def test_stopWaiting_woken(self):
+        self.lock.claim('x', self.exclusive)
+        self.wait('a', self.exclusive)
+        self.wait('b', self.exclusive)
+        self.lock.release('x', self.exclusive)
+        # a is woken, but gives up its place before it can claim the lock
+        self.lock.stopWaitingUntilAvailable('a', self.exclusive)
+        self.assertEqual(self.wake(), [ 'a', 'b' ])
+        self.assertFalse(self.lock.isAvailable('a', self.exclusive))
+        self.assertTrue(self.lock.isAvailable('b', self.exclusive))
+
+    def test_stopWaiting_interrupted(self):
+        self.lock.claim('x', self.exclusive)
+        d = self.wait('a', self.exclusive)
+        self.lock.release('x', self.exclusive)
+        # as when a build is interrupted while its wakeup is pending
+        self.lock.stopWaitingUntilAvailable('a', self.exclusive, d)
+        d.callback(None)
+        self.assertEqual(self.wake(), [])
+        self.assertTrue(self.lock.isAvailable('b', self.exclusive))
+
+    def test_stopWaiting_head(self):
+        self.lock.claim('a', self.counting)
+        self.wait('x', self.exclusive)
+        self.wait('b', self.counting)
+        self.lock.stopWaitingUntilAvailable('x', self.exclusive)
+        self.assertEqual(self.wake(), [ 'b' ])
+        # not waiting is OK
+        self.lock.stopWaitingUntilAvailable('x', self.exclusive)
+
+    def test_compaction(self):
+        self.lock.claim('x', self.exclusive)
+        self.wait('first', self.counting)
+        for i in range(300):
+            self.wait(i, self.counting)
+            self.lock.stopWaitingUntilAvailable(i, self.counting)
+        self.assertTrue(len(self.lock.waiting) < 200)
+        self.lock.release('x', self.exclusive)
+        self.assertEqual(self.wake(), [ 'first' ])
+
+    def test_metrics(self):
+        events = []
+        def observer(eventDict):
+            metric = eventDict.get('metric')
+            if isinstance(metric, metrics.MetricCountEvent):
+                events.append((metric.counter, metric.count))
+            elif isinstance(metric, metrics.MetricHistogramEvent):
+                events.append((metric.histogram, metric.value))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        self.lock.claim('x', self.exclusive)
+        self.wait('a', self.exclusive)
+        self.clock.advance(5)
+        self.lock.release('x', self.exclusive)
+        self.lock.claim('a', self.exclusive)
+        self.assertEqual(events, [ ('Lock.lock.waiting', 1),
+                                   ('Lock.lock.waiting', 0),
+                                   ('Lock.lock.wait', 5) ])
+
+class RealLocks(unittest.TestCase):
+
+    def test_metricNames(self):
+        lock = locks.RealMasterLock(locks.MasterLock('mlock'))
+        self.assertEqual(lock.getLock(None).metricName, 'MasterLock.mlock')
+        class FakeSlaveBuilder:
+            class slave:
+                slavename = 'bot1'
+        lock = locks.RealSlaveLock(locks.SlaveLock('slock'))
+        self.assertEqual(lock.getLock(FakeSlaveBuilder).metricName,
+                         'SlaveLock.slock.bot1')
@@ -17,7 +17,9 @@ import os
 import mock
 from twisted.internet import defer
 from twisted.trial import unittest
+from twisted.python import log
 from buildbot import master
+from buildbot.process import metrics
 from buildbot.util import subscription
 from buildbot.test.util import dirs
 from buildbot.test.fake import fakedb
@@ -285,6 +287,51 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseChanges_pages(self):
+        self.master.CHANGE_POLL_PAGE_SIZE = 2
+        self.db.insertTestData([
+            fakedb.Object(id=53, name='master',
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+        ] + [ fakedb.Change(changeid=i) for i in range(10, 16) ])
+
+        # record each checkpoint
+        checkpoints = []
+        real_setState = self.master._setState
+        def _setState(name, value):
+            checkpoints.append(value)
+            return real_setState(name, value)
+        self.master._setState = _setState
+
+        d = self.master.pollDatabaseChanges()
+        def check(_):
+            self.assertEqual([ ch.number for ch in self.gotten_changes],
+                             [ 11, 12, 13, 14, 15 ])
+            self.assertEqual(checkpoints, [ 12, 14, 15 ])
+            self.db.state.assertState(53, last_processed_change=15)
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseChanges_gap(self):
+        # a missing changeid stops processing until the next poll
+        self.db.insertTestData([
+            fakedb.Object(id=53, name='master',
+                          class_name='buildbot.master.BuildMaster'),
+            fakedb.ObjectState(objectid=53, name='last_processed_change',
+                               value_json='10'),
+            fakedb.Change(changeid=10),
+            fakedb.Change(changeid=11),
+            fakedb.Change(changeid=13),
+        ])
+        d = self.master.pollDatabaseChanges()
+        def check(_):
+            self.assertEqual([ ch.number for ch in self.gotten_changes],
+                             [ 11 ])
+            self.db.state.assertState(53, last_processed_change=11)
+        d.addCallback(check)
+        return d
+
     def test_pollDatabaseChanges_nothing_new(self):
         self.db.insertTestData([
             fakedb.Object(id=53, name='master',
@@ -325,6 +372,8 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
         return d
 
     def test_pollDatabaseBuildRequests_incremental(self):
+        # sweep on every poll
+        self.master.UNCLAIMED_SWEEP_INTERVAL = 0
         d = defer.succeed(None)
         def insert1(_):
             self.db.insertTestData([
@@ -362,3 +411,158 @@ class Polling(dirs.DirsMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_pollDatabaseBuildRequests_high_water_mark(self):
+        self.master.UNCLAIMED_SWEEP_INTERVAL = 1000
+        queries = []
+        real_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            queries.append(kwargs.get('after_brid'))
+            return real_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        d = defer.succeed(None)
+        def insert1(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=11, buildsetid=9,
+                                        buildername='eleventy'),
+            ])
+        d.addCallback(insert1)
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        def insert2(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=20, buildsetid=9,
+                                        buildername='twenty'),
+                # committed out of order by another master
+                fakedb.BuildRequest(id=5, buildsetid=9,
+                                        buildername='five'),
+            ])
+            # 5 is below the high-water mark, so it is not seen until the
+            # next sweep
+        d.addCallback(insert2)
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        def force_sweep(_):
+            self.gotten_buildrequest_additions.append('MARK')
+            self.master._last_unclaimed_sweep -= 1000
+        d.addCallback(force_sweep)
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        def check(_):
+            self.assertEqual(self.gotten_buildrequest_additions, [
+                dict(bsid=9, brid=11, buildername='eleventy'),
+                'MARK',
+                dict(bsid=9, brid=20, buildername='twenty'),
+                'MARK',
+                dict(bsid=9, brid=5, buildername='five'),
+            ])
+            # full sweep, incremental read above brid 11, then a full sweep
+            self.assertEqual(queries, [ None, 11, None ])
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseBuildRequests_reclaimed_across_sweep(self):
+        self.master.UNCLAIMED_SWEEP_INTERVAL = 1000
+        def force_sweep(_):
+            self.master._last_unclaimed_sweep -= 1000
+        def mark(_):
+            self.gotten_buildrequest_additions.append('MARK')
+        def poll(_):
+            return self.master.pollDatabaseBuildRequests()
+
+        d = defer.succeed(None)
+        def insert1(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=11, buildsetid=9,
+                                        buildername='eleventy'),
+            ])
+        d.addCallback(insert1)
+        d.addCallback(poll)
+        def insert2(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=20, buildsetid=9,
+                                        buildername='twenty'),
+            ])
+        d.addCallback(insert2)
+        d.addCallback(poll) # incremental
+        d.addCallback(mark)
+        def claim(_):
+            self.db.buildrequests.fakeClaimBuildRequest(11)
+            self.db.buildrequests.fakeClaimBuildRequest(20)
+        d.addCallback(claim)
+        d.addCallback(force_sweep)
+        d.addCallback(poll) # sweep, sees both claimed
+        d.addCallback(mark)
+        def unclaim(_):
+            self.db.buildrequests.fakeUnclaimBuildRequest(11)
+            self.db.buildrequests.fakeUnclaimBuildRequest(20)
+        d.addCallback(unclaim)
+        d.addCallback(poll) # incremental, reads nothing below the mark
+        d.addCallback(mark)
+        d.addCallback(force_sweep)
+        d.addCallback(poll) # sweep, sees both unclaimed again
+        def check(_):
+            gotten = self.gotten_buildrequest_additions
+            self.assertEqual(gotten[:5], [
+                dict(bsid=9, brid=11, buildername='eleventy'),
+                dict(bsid=9, brid=20, buildername='twenty'),
+                'MARK',
+                'MARK',
+                'MARK',
+            ])
+            self.assertEqual(sorted(gotten[5:]), [
+                dict(bsid=9, brid=11, buildername='eleventy'),
+                dict(bsid=9, brid=20, buildername='twenty'),
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_pollDatabaseBuildRequests_mark_passes_claimed(self):
+        self.master.UNCLAIMED_SWEEP_INTERVAL = 1000
+        queries = []
+        real_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            queries.append(kwargs.get('after_brid'))
+            return real_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+        counts = {}
+        def observe(event):
+            ev = event.get('metric')
+            if not isinstance(ev, metrics.MetricCountEvent):
+                return
+            name = ev.counter
+            if name.endswith('rows_scanned'):
+                counts.setdefault(name.split('.')[-1], []).append(ev.count)
+        log.addObserver(observe)
+        self.addCleanup(log.removeObserver, observe)
+
+        d = defer.succeed(None)
+        def insert1(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=11, buildsetid=9, buildername='b',
+                                    complete=1),
+                fakedb.BuildRequest(id=12, buildsetid=9, buildername='b'),
+            ])
+            self.db.buildrequests.fakeClaimBuildRequest(12)
+        d.addCallback(insert1)
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        def insert2(_):
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=20, buildsetid=9, buildername='b'),
+                fakedb.BuildRequest(id=21, buildsetid=9, buildername='b'),
+            ])
+            self.db.buildrequests.fakeClaimBuildRequest(21)
+        d.addCallback(insert2)
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        d.addCallback(lambda _ : self.master.pollDatabaseBuildRequests())
+        def check(_):
+            self.assertEqual(self.gotten_buildrequest_additions, [
+                dict(bsid=9, brid=20, buildername='b'),
+            ])
+            # the mark moves past completed and claimed requests, so each
+            # row is read once
+            self.assertEqual(queries, [ None, 12, 21 ])
+            self.assertEqual(counts, {
+                'sweep_rows_scanned' : [ 1 ],
+                'incremental_rows_scanned' : [ 2, 0 ],
+            })
+        d.addCallback(check)
+        return d
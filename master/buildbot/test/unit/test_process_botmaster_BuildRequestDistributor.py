@@ -16,9 +16,9 @@
 import mock
 from twisted.trial import unittest
 from twisted.internet import defer, reactor
-from twisted.python import failure
+from twisted.python import failure, log
 from buildbot.test.util import compat
-from buildbot.process import botmaster
+from buildbot.process import botmaster, metrics
 from buildbot.util import epoch2datetime
 
 class Test(unittest.TestCase):
@@ -49,11 +49,16 @@ class Test(unittest.TestCase):
         self.maybeStartBuild_calls = []
         self.builders = {}
 
+        # used by addSlowBuilders
+        self.running_builders = set()
+        self.max_running = 0
+        self.finish = {}
+
     def tearDown(self):
         if self.brd.running:
             return self.brd.stopService()
 
-    def addBuilders(self, names):
+    def addBuilders(self, names, slavenames=None):
         for name in names:
             bldr = mock.Mock(name=name)
             self.botmaster.builders[name] = bldr
@@ -65,6 +70,8 @@ class Test(unittest.TestCase):
                 return d
             bldr.maybeStartBuild = maybeStartBuild
             bldr.name = name
+            # by default, each builder has its own slave
+            bldr.slavenames = slavenames or [ 'slave-%s' % name ]
 
     def removeBuilder(self, name):
         del self.builders[name]
@@ -123,7 +130,8 @@ class Test(unittest.TestCase):
         return self.quiet_deferred
 
     def test_maybeStartBuildsOn_collapsing(self):
-        self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        # builders sharing a slave are run one at a time
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3'], slavenames=['slv'])
         self.brd.maybeStartBuildsOn(['bldr3'])
         self.brd.maybeStartBuildsOn(['bldr2', 'bldr1'])
         self.brd.maybeStartBuildsOn(['bldr4']) # should be ignored
@@ -138,7 +146,7 @@ class Test(unittest.TestCase):
         return self.quiet_deferred
 
     def test_maybeStartBuildsOn_builders_missing(self):
-        self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3'], slavenames=['slv'])
         self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
         # bldr1 is already run, so surreptitiously remove the other
         # two - nothing should crash, but the builders should not run
@@ -149,6 +157,95 @@ class Test(unittest.TestCase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def addSlowBuilders(self, names, slavenames=None):
+        # add builders whose maybeStartBuild methods finish only when the
+        # test says so, recording the number running at once
+        self.addBuilders(names, slavenames)
+        for name in names:
+            def maybeStartBuild(n=name):
+                self.maybeStartBuild_calls.append(n)
+                self.running_builders.add(n)
+                self.max_running = max(self.max_running,
+                                       len(self.running_builders))
+                d = defer.Deferred()
+                def finished(_):
+                    self.running_builders.remove(n)
+                d.addCallback(finished)
+                self.finish[n] = d
+                return d
+            self.builders[name].maybeStartBuild = maybeStartBuild
+
+    def finishAll(self):
+        # finish the running builders one by one, on later reactor turns
+        def finishOne():
+            if self.running_builders:
+                n = sorted(self.running_builders)[0]
+                self.finish.pop(n).callback(None)
+                reactor.callLater(0, finishOne)
+        reactor.callLater(0, finishOne)
+
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.addSlowBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2', 'bldr3'])
+        # all three start before any finishes
+        self.assertEqual(self.maybeStartBuild_calls,
+                ['bldr1', 'bldr2', 'bldr3'])
+        self.assertEqual(self.max_running, 3)
+        self.finishAll()
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_concurrency_limit(self):
+        self.brd.MAX_CONCURRENT_BUILDERS = 2
+        builders = ['bldr%02d' % i for i in xrange(6) ]
+        self.addSlowBuilders(builders)
+        self.brd.maybeStartBuildsOn(builders)
+        self.assertEqual(self.maybeStartBuild_calls, builders[:2])
+        self.finishAll()
+        def check(_):
+            self.assertEqual(self.maybeStartBuild_calls, builders)
+            self.assertEqual(self.max_running, 2)
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_shared_slaves(self):
+        # A and C share a slave, so C must wait for A; B is unrelated, and D
+        # shares a slave with the waiting C, so it must not overtake it
+        self.addSlowBuilders(['A', 'C'], slavenames=['slv1'])
+        self.addSlowBuilders(['B'], slavenames=['slv2'])
+        self.addSlowBuilders(['D'], slavenames=['slv1', 'slv3'])
+        self.brd.maybeStartBuildsOn(['A', 'B', 'C', 'D'])
+        self.assertEqual(self.maybeStartBuild_calls, ['A', 'B'])
+
+        self.finish.pop('A').callback(None)
+        self.assertEqual(self.maybeStartBuild_calls, ['A', 'B', 'C'])
+        self.finish.pop('C').callback(None)
+        self.assertEqual(self.maybeStartBuild_calls, ['A', 'B', 'C', 'D'])
+        self.finishAll()
+        return self.quiet_deferred
+
+    def test_maybeStartBuildsOn_metrics(self):
+        metric_events = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                metric_events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        self.addBuilders(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        def check(_):
+            timers = [ ev.timer for ev in metric_events
+                       if isinstance(ev, metrics.MetricTimeEvent) ]
+            self.assertIn('BuildRequestDistributor.dispatch_latency.bldr1',
+                          timers)
+            depths = [ ev.count for ev in metric_events
+                       if isinstance(ev, metrics.MetricCountEvent) and
+                       ev.counter == 'BuildRequestDistributor.pending_builders' ]
+            self.assertEqual(depths[0], 1)
+            self.assertEqual(depths[-1], 0)
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
     def do_test_sortBuilders(self, prioritizeBuilders, oldestRequestTimes,
             expected, returnDeferred=False):
         self.addBuilders(oldestRequestTimes.keys())
@@ -205,6 +302,26 @@ class Test(unittest.TestCase):
                 dict(bldr1=1, bldr2=1, bldr3=1),
                 ['bldr1', 'bldr2', 'bldr3'])
 
+    def test_sortBuilders_timer(self):
+        metric_events = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                metric_events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        d = self.do_test_sortBuilders(None,
+                dict(bldr1=777, bldr2=999),
+                ['bldr1', 'bldr2'])
+        def check(_):
+            timers = [ ev.timer for ev in metric_events
+                       if isinstance(ev, metrics.MetricTimeEvent) ]
+            self.assertEqual(sorted(timers), [
+                'BuildRequestDistributor._defaultSorter()',
+                'BuildRequestDistributor._sortBuilders()' ])
+        d.addCallback(check)
+        return d
+
     @compat.usesFlushLoggedErrors
     def test_sortBuilders_custom_exception(self):
         self.addBuilders(['x', 'y'])
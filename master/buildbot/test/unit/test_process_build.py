@@ -14,12 +14,12 @@
 # Copyright Buildbot Team Members
 
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
 from buildbot.process.build import Build
 from buildbot.process.properties import Properties
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, RETRY, EXCEPTION
-from buildbot.locks import SlaveLock
+from buildbot.locks import SlaveLock, MasterLock, BaseLock
 from buildbot.process.buildstep import LoggingBuildStep
 
 from mock import Mock
@@ -301,6 +301,103 @@ class TestBuild(unittest.TestCase):
         self.assert_(('stepStarted', (), {}) in step.step_status.method_calls)
         self.assertEqual(b.result, EXCEPTION)
 
+    def testBuildWaitingForLocksKeepsEarlierReservations(self):
+        b = Build([FakeRequest()])
+        b.setBuilder(Mock())
+        b.stopped = False
+
+        lockid = MasterLock('lock')
+        access = lockid.access('exclusive')
+        clock = task.Clock()
+        lock1 = BaseLock('lock1')
+        lock2 = BaseLock('lock2')
+        lock1._reactor = lock2._reactor = clock
+        b.locks = [ (lock2, access), (lock1, access) ]
+
+        lock1.claim('x', access)
+        lock2.claim('y', access)
+        b.acquireLocks()
+        # locks are taken in order, so the build waits for lock1 first, and
+        # does not queue for lock2 yet
+        self.assertEqual(b._acquiringLock[0], lock1)
+        self.assertEqual(lock2.getWaitingCount(), 0)
+
+        # lock1 is reserved for the build once it is released, and stays
+        # reserved while the build waits for lock2
+        lock1.release('x', access)
+        clock.advance(0)
+        self.assertEqual(b._acquiringLock[0], lock2)
+        self.assertFalse(lock1.isAvailable('z', access))
+
+        lock2.release('y', access)
+        clock.advance(0)
+        self.assertTrue(lock1.isOwner(b, access))
+        self.assertTrue(lock2.isOwner(b, access))
+
+    def testBuildWaitingForTwoContendedLocks(self):
+        b = Build([FakeRequest()])
+        b.setBuilder(Mock())
+        b.stopped = False
+
+        lockid = MasterLock('lock')
+        access = lockid.access('exclusive')
+        clock = task.Clock()
+        lockA = BaseLock('lockA')
+        lockB = BaseLock('lockB')
+        lockA._reactor = lockB._reactor = clock
+        b.locks = [ (lockA, access), (lockB, access) ]
+
+        # A is free, so the build waits for B
+        lockB.claim('y1', access)
+        b.acquireLocks()
+        self.assertEqual(b._acquiringLock[0], lockB)
+
+        # the build is woken for B, but A has been taken in the meantime, so
+        # it gives up B and waits for A
+        lockB.release('y1', access)
+        lockA.claim('x1', access)
+        clock.advance(0)
+        self.assertEqual(b._acquiringLock[0], lockA)
+
+        # others keep taking whichever lock the build is not waiting for,
+        # but once it is woken for A, it keeps A while waiting for B
+        lockB.claim('y2', access)
+        lockA.release('x1', access)
+        clock.advance(0)
+        self.assertEqual(b._acquiringLock[0], lockB)
+        self.assertFalse(lockA.isAvailable('x2', access))
+
+        # so it gets both locks as soon as B is released
+        lockB.release('y2', access)
+        clock.advance(0)
+        self.assertTrue(lockA.isOwner(b, access))
+        self.assertTrue(lockB.isOwner(b, access))
+
+    def testStopBuildWaitingForLocksDropsReservations(self):
+        b = Build([FakeRequest()])
+        b.setBuilder(Mock())
+        b.stopped = False
+        b.build_status = Mock()
+
+        lockid = MasterLock('lock')
+        access = lockid.access('exclusive')
+        clock = task.Clock()
+        lock1 = BaseLock('lock1')
+        lock2 = BaseLock('lock2')
+        lock1._reactor = lock2._reactor = clock
+        b.locks = [ (lock1, access), (lock2, access) ]
+
+        lock1.claim('x', access)
+        lock2.claim('y', access)
+        b.acquireLocks()
+        lock1.release('x', access)
+        clock.advance(0)
+        self.assertEqual(b._acquiringLock[0], lock2)
+
+        b.stopBuild('stop it')
+        self.assertTrue(lock1.isAvailable('z', access))
+        self.assertEqual(lock2.getWaitingCount(), 0)
+
     def testStepDone(self):
         r = FakeRequest()
         b = Build([r])
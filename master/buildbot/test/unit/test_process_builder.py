@@ -285,6 +285,50 @@ class TestBuilderBuildCreation(unittest.TestCase):
         return self.do_test_maybeStartBuild(rows=rows,
                 exp_claims=[11], exp_builds=[('test-slave2', [11])])
 
+    @defer.deferredGenerator
+    def test_maybeStartBuild_incremental(self):
+        self.makeBuilder(mergeRequests=False)
+        self.setSlaveBuilders({'test-slave1':1})
+        full_reads = []
+        real_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            full_reads.append(kwargs)
+            return real_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        wfd = defer.waitForDeferred(
+            self.db.insertTestData(self.base_rows + [
+                fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                    submitted_at=130000),
+            ]))
+        yield wfd
+        wfd.getResult()
+
+        wfd = defer.waitForDeferred(self.bldr.maybeStartBuild())
+        yield wfd
+        wfd.getResult()
+
+        # a new request is announced and started without re-reading the
+        # whole table
+        wfd = defer.waitForDeferred(
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                    submitted_at=135000),
+            ]))
+        yield wfd
+        wfd.getResult()
+        self.bldr.buildRequestAdded(11)
+
+        wfd = defer.waitForDeferred(self.bldr.maybeStartBuild())
+        yield wfd
+        wfd.getResult()
+
+        self.db.buildrequests.assertMyClaims([10, 11])
+        self.assertBuildsStarted([('test-slave1', [10]),
+                                  ('test-slave1', [11])])
+        self.assertEqual(len(full_reads), 1)
+        self.assertEqual(len(self.bldr.pending_requests), 0)
+
     def test_maybeStartBuild_builder_stopped(self):
         self.makeBuilder()
 
@@ -505,6 +549,52 @@ class TestBuilderBuildCreation(unittest.TestCase):
         yield wfd
         self.assertEqual(wfd.getResult(), [ brdicts[1] ])
 
+    @defer.deferredGenerator
+    def test_mergeRequests_default(self):
+        self.makeBuilder()
+        wfd = defer.waitForDeferred(
+            self.db.insertTestData([
+                fakedb.SourceStamp(id=234, revision='aaa'),
+                fakedb.SourceStamp(id=235, revision='bbb'),
+                fakedb.Patch(id=9),
+                fakedb.SourceStamp(id=236, revision='aaa', patchid=9),
+                fakedb.Buildset(id=30, sourcestampid=234, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.Buildset(id=31, sourcestampid=235, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.Buildset(id=32, sourcestampid=236, reason='foo',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=19, buildsetid=30, buildername='bldr',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=20, buildsetid=31, buildername='bldr',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=21, buildsetid=30, buildername='bldr',
+                    submitted_at=1300305712, results=-1),
+                fakedb.BuildRequest(id=22, buildsetid=32, buildername='bldr',
+                    submitted_at=1300305712, results=-1),
+            ]))
+        yield wfd
+        wfd.getResult()
+
+        wfd = defer.waitForDeferred(
+            defer.gatherResults([
+                self.db.buildrequests.getBuildRequest(id)
+                for id in (19, 20, 21, 22)
+            ]))
+        yield wfd
+        brdicts = wfd.getResult()
+
+        # the keyed path must agree with the pairwise path
+        def pairwise_fn(builder, breq, other):
+            return breq.canBeMergedWith(other)
+        for breq, exp in [ (0, [0, 2]), (1, [1]), (2, [2, 0]), (3, [3]) ]:
+            for fn in (buildrequest.BuildRequest.canBeMergedWith, pairwise_fn):
+                wfd = defer.waitForDeferred(
+                    self.bldr._mergeRequests(brdicts[breq], brdicts, fn))
+                yield wfd
+                self.assertEqual(wfd.getResult(),
+                        [ brdicts[i] for i in exp ])
+
     def test_mergeRequests_no_merging(self):
         self.makeBuilder()
         breq = dict(dummy=1)
@@ -615,3 +705,38 @@ class TestGetOldestRequestTime(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.deferredGenerator
+    def test_gort_maintained_without_db(self):
+        self.makeBuilder(name='bldr1')
+        wfd = defer.waitForDeferred(
+            self.db.insertTestData(self.base_rows))
+        yield wfd
+        wfd.getResult()
+
+        wfd = defer.waitForDeferred(self.bldr.getOldestRequestTime())
+        yield wfd
+        self.assertEqual(wfd.getResult(), epoch2datetime(1000))
+
+        # subsequent calls do not read the whole table
+        def fail(**kwargs):
+            self.fail("should not query all requests")
+        self.db.buildrequests.getBuildRequests = fail
+
+        # a newly-announced, older request is seen
+        wfd = defer.waitForDeferred(
+            self.db.insertTestData([
+                fakedb.BuildRequest(id=555, submitted_at=500,
+                            buildername='bldr1', buildsetid=11),
+            ]))
+        yield wfd
+        wfd.getResult()
+        self.bldr.buildRequestAdded(555)
+        wfd = defer.waitForDeferred(self.bldr.getOldestRequestTime())
+        yield wfd
+        self.assertEqual(wfd.getResult(), epoch2datetime(500))
+
+        # and a request claimed here is no longer considered
+        self.bldr.pending_requests.remove(555)
+        wfd = defer.waitForDeferred(self.bldr.getOldestRequestTime())
+        yield wfd
+        self.assertEqual(wfd.getResult(), epoch2datetime(1000))
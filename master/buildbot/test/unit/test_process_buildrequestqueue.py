@@ -0,0 +1,178 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import mock
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from buildbot.test.fake import fakedb, fakemaster
+from buildbot.process import buildrequestqueue
+from buildbot.util import epoch2datetime
+
+class TestBuildRequestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.master = fakemaster.make_master()
+        self.master.db = self.db = db = fakedb.FakeDBConnector(self)
+        self.master.master_name = db.buildrequests.MASTER_NAME
+        self.master.master_incarnation = db.buildrequests.MASTER_INCARNATION
+
+        self.builder = mock.Mock()
+        self.builder.name = 'bldr'
+        self.builder.master = self.master
+
+        self.clock = task.Clock()
+        self.queue = buildrequestqueue.BuildRequestQueue(self.builder)
+        self.queue._reactor = self.clock
+
+        # count full reads of the table
+        self.full_reads = []
+        real_getBuildRequests = self.db.buildrequests.getBuildRequests
+        def getBuildRequests(**kwargs):
+            self.full_reads.append(kwargs)
+            return real_getBuildRequests(**kwargs)
+        self.db.buildrequests.getBuildRequests = getBuildRequests
+
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=10, buildsetid=11, buildername="bldr",
+                submitted_at=1300),
+            fakedb.BuildRequest(id=11, buildsetid=11, buildername="bldr",
+                submitted_at=1100),
+            fakedb.BuildRequest(id=12, buildsetid=11, buildername="other",
+                submitted_at=1000),
+        ])
+
+    def getBrids(self):
+        d = self.queue.getRequests()
+        d.addCallback(lambda brdicts : [ brd['brid'] for brd in brdicts ])
+        return d
+
+    @defer.deferredGenerator
+    def test_getRequests_reconciles_first(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        self.assertEqual(wfd.getResult(), [ 11, 10 ])
+        self.assertEqual(self.full_reads,
+                [ dict(buildername='bldr', claimed=False) ])
+
+    @defer.deferredGenerator
+    def test_addBrid(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+
+        self.db.insertTestData([
+            fakedb.BuildRequest(id=13, buildsetid=11, buildername="bldr",
+                submitted_at=1200),
+        ])
+        self.queue.addBrid(13)
+
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        self.assertEqual(wfd.getResult(), [ 11, 13, 10 ])
+        # no second full read
+        self.assertEqual(len(self.full_reads), 1)
+
+    @defer.deferredGenerator
+    def test_remove(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+
+        self.queue.remove(11)
+
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        self.assertEqual(wfd.getResult(), [ 10 ])
+        self.assertEqual(self.queue.getOldest()['brid'], 10)
+
+    @defer.deferredGenerator
+    def test_refresh(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+
+        # 11 is claimed by another master
+        self.db.buildrequests.fakeClaimBuildRequest(11, 1400,
+                master_name="interloper", master_incarnation="interloper")
+        wfd = defer.waitForDeferred(self.queue.refresh([ 10, 11 ]))
+        yield wfd
+        wfd.getResult()
+
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        self.assertEqual(wfd.getResult(), [ 10 ])
+        self.assertEqual(len(self.full_reads), 1)
+
+    @defer.deferredGenerator
+    def test_reconcile_interval(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+
+        # claimed elsewhere, without notification
+        self.db.buildrequests.fakeClaimBuildRequest(11, 1400,
+                master_name="interloper", master_incarnation="interloper")
+
+        self.clock.advance(self.queue.RECONCILE_INTERVAL)
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        self.assertEqual(wfd.getResult(), [ 10 ])
+        self.assertEqual(len(self.full_reads), 2)
+
+    @defer.deferredGenerator
+    def test_invalidate(self):
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+
+        self.queue.invalidate()
+        wfd = defer.waitForDeferred(self.getBrids())
+        yield wfd
+        wfd.getResult()
+        self.assertEqual(len(self.full_reads), 2)
+
+    @defer.deferredGenerator
+    def test_getOldestRequestTime(self):
+        wfd = defer.waitForDeferred(self.queue.getOldestRequestTime())
+        yield wfd
+        self.assertEqual(wfd.getResult(), epoch2datetime(1100))
+
+        self.queue.remove(11)
+        self.queue.remove(10)
+        wfd = defer.waitForDeferred(self.queue.getOldestRequestTime())
+        yield wfd
+        self.assertEqual(wfd.getResult(), None)
+        self.assertEqual(len(self.full_reads), 1)
+
+    def test_getOldest_empty(self):
+        self.assertEqual(self.queue.getOldest(), None)
+
+    def test_add_getOldest(self):
+        self.queue.add(dict(brid=1, submitted_at=epoch2datetime(200)))
+        self.queue.add(dict(brid=2, submitted_at=epoch2datetime(100)))
+        self.assertEqual(self.queue.getOldest()['brid'], 2)
+        self.queue.remove(2)
+        self.assertEqual(self.queue.getOldest()['brid'], 1)
+        self.assertEqual(len(self.queue), 1)
+
+    def test_remove_breaks_refloop(self):
+        class FakeBuildRequest(object):
+            pass
+        brobj = FakeBuildRequest()
+        brdict = dict(brid=1, submitted_at=None, brobj=brobj)
+        brobj.brdict = brdict
+        self.queue.add(brdict)
+        self.queue.remove(1)
+        self.failIf(hasattr(brobj, 'brdict'))
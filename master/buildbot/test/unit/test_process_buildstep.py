@@ -14,10 +14,13 @@
 # Copyright Buildbot Team Members
 
 import re
+from cStringIO import StringIO
 
 from twisted.trial import unittest
 
 from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator
+from buildbot.process.buildstep import LogLineObserver, LoggedRemoteCommand
+from buildbot.test.fake.remotecommand import FakeLogFile as FakeStatusLog
 from buildbot.status.results import FAILURE, SUCCESS, WARNINGS, EXCEPTION
 
 class FakeLogFile:
@@ -27,6 +30,9 @@ class FakeLogFile:
     def getText(self):
         return self.text
 
+    def iterLines(self):
+        return iter(StringIO(self.text).readlines())
+
 class FakeCmd:
     def __init__(self, stdout, stderr, rc=0):
         self.logs = {'stdout': FakeLogFile(stdout),
@@ -67,6 +73,36 @@ class TestRegexLogEvaluator(unittest.TestCase):
         self.assertEqual(new_status, WARNINGS, "regex_log_evaluator returned %d, should've returned %d" % (new_status, WARNINGS))
 
 
+    def test_anchors_match_each_line(self):
+        # non-spanning patterns are matched a line at a time
+        cmd = FakeCmd("compiling\nerror: oops\n", "")
+        step_status = FakeStepStatus()
+        r = [(re.compile("^error:"), FAILURE)]
+        new_status = regex_log_evaluator(cmd, step_status, r)
+        self.assertEqual(new_status, FAILURE)
+
+    def test_pattern_does_not_span_lines(self):
+        cmd = FakeCmd("compiling\nerror: oops\n", "")
+        step_status = FakeStepStatus()
+        r = [(re.compile("compiling.error"), FAILURE)]
+        new_status = regex_log_evaluator(cmd, step_status, r)
+        self.assertEqual(new_status, SUCCESS)
+
+    def test_dotall_spans_lines(self):
+        cmd = FakeCmd("compiling\nerror: oops\n", "")
+        step_status = FakeStepStatus()
+        r = [(re.compile("compiling.error", re.DOTALL), FAILURE)]
+        new_status = regex_log_evaluator(cmd, step_status, r)
+        self.assertEqual(new_status, FAILURE)
+
+    def test_newline_spans_lines(self):
+        cmd = FakeCmd("compiling\nerror: oops\n", "")
+        step_status = FakeStepStatus()
+        r = [(r"compiling\nerror", FAILURE)]
+        new_status = regex_log_evaluator(cmd, step_status, r)
+        self.assertEqual(new_status, FAILURE)
+
+
 class TestLoggingBuildStep(unittest.TestCase):
     def test_evaluateCommand_success(self):
         cmd = FakeCmd("Log text", "Log text")
@@ -87,3 +123,73 @@ class TestLoggingBuildStep(unittest.TestCase):
         lbs = LoggingBuildStep(log_eval_func=eval)
         status = lbs.evaluateCommand(cmd)
         self.assertEqual(status, WARNINGS, "evaluateCommand didn't call log_eval_func or overrode its results")
+
+
+class TestLogLineObserver(unittest.TestCase):
+    def test_flushLines(self):
+        lines = []
+        obs = LogLineObserver()
+        obs.outLineReceived = lambda line : lines.append(('o', line))
+        obs.errLineReceived = lambda line : lines.append(('e', line))
+        # the parsers captured the original methods
+        obs.stdoutParser.lineReceived = obs.outLineReceived
+        obs.stderrParser.lineReceived = obs.errLineReceived
+        obs.outReceived("one\ntw")
+        obs.errReceived("err")
+        obs.outReceived("o")
+        self.assertEqual(lines, [ ('o', 'one') ])
+        obs.flushLines()
+        self.assertEqual(lines, [ ('o', 'one'), ('o', 'two'), ('e', 'err') ])
+        # flushing again does nothing
+        obs.flushLines()
+        self.assertEqual(len(lines), 3)
+
+    def test_flushLines_terminated(self):
+        lines = []
+        obs = LogLineObserver()
+        obs.stdoutParser.lineReceived = lambda line : lines.append(line)
+        obs.outReceived("one\n")
+        obs.outReceived("")
+        obs.flushLines()
+        # no empty line is delivered for the terminated output
+        self.assertEqual(lines, [ 'one' ])
+
+
+class TestLoggedRemoteCommand(unittest.TestCase):
+    def setUp(self):
+        self.cmd = LoggedRemoteCommand('shell', {})
+        self.stdio = FakeStatusLog('stdio')
+        self.other = FakeStatusLog('other')
+        self.cmd.logs['stdio'] = self.stdio
+        self.cmd.logs['other'] = self.other
+
+    def test_log_data_not_retained(self):
+        self.cmd.remoteUpdate({'stdout' : 'out', 'stderr' : 'err'})
+        self.cmd.remoteUpdate({'log' : ('other', 'x' * 1000)})
+        self.cmd.remoteUpdate({'log' : ('other', 'y')})
+        self.assertEqual(self.stdio.stdout, 'out')
+        self.assertEqual(self.stdio.stderr, 'err')
+        self.assertEqual(self.other.stdout, 'x' * 1000 + 'y')
+        self.assertEqual(self.cmd.updates, {})
+        self.assertEqual(self.cmd.getRetainedUpdateSize(), 0)
+
+    def test_keep_last(self):
+        self.cmd.remoteUpdate({'got_revision' : 'abc'})
+        self.cmd.remoteUpdate({'got_revision' : 'defg'})
+        self.assertEqual(self.cmd.updates, {'got_revision' : [ 'defg' ]})
+        self.assertEqual(self.cmd.getRetainedUpdateSize(), 4)
+
+    def test_aggregate_by_default(self):
+        self.cmd.remoteUpdate({'custom' : 'abc'})
+        self.cmd.remoteUpdate({'custom' : ('de', 'f')})
+        self.assertEqual(self.cmd.updates, {'custom' : [ 'abc', ('de', 'f') ]})
+        self.assertEqual(self.cmd.getRetainedUpdateSize(), 6)
+
+    def test_setUpdateRetention(self):
+        self.cmd.setUpdateRetention('custom', LoggedRemoteCommand.UPDATE_DISCARD)
+        self.cmd.setUpdateRetention('log', LoggedRemoteCommand.UPDATE_AGGREGATE)
+        self.cmd.remoteUpdate({'custom' : 'abc', 'log' : ('other', 'x')})
+        self.assertEqual(self.cmd.updates, {'log' : [ ('other', 'x') ]})
+        # the class-wide policy is unchanged
+        self.assertEqual(LoggedRemoteCommand.updateRetention['log'],
+                         LoggedRemoteCommand.UPDATE_DISCARD)
@@ -122,6 +122,34 @@ class TestMetricTimeEvent(TestMetricBase):
         report = self.observer.asDict()
         self.assertEquals(report['timers']['foo_time'], sum(data)/float(len(data)))
 
+class TestMetricHistogramEvent(TestMetricBase):
+    def testManualEvent(self):
+        for v in (0.0005, 0.003, 0.003, 0.1):
+            metrics.MetricHistogramEvent.log('foo_hist', v)
+        report = self.observer.asDict()['histograms']['foo_hist']
+        self.assertEquals(report['count'], 4)
+        self.assertEquals(report['max'], 0.1)
+        self.assertAlmostEqual(report['mean'], 0.026625)
+        self.assertEquals(report['p50'], 0.004)
+        self.assertEquals(report['p99'], 0.1)
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        h = metrics.Histogram()
+        self.assertEquals((h.count, h.mean(), h.percentile(50)), (0, 0, 0))
+
+    def test_buckets(self):
+        h = metrics.Histogram()
+        h.add(0.001) # upper bound is inclusive
+        h.add(0.0011)
+        h.add(1000) # off the end
+        self.assertEquals(h.buckets[0], 1)
+        self.assertEquals(h.buckets[1], 1)
+        self.assertEquals(h.buckets[-1], 1)
+        self.assertEquals(h.percentile(30), 0.001)
+        self.assertEquals(h.percentile(60), 0.002)
+        self.assertEquals(h.percentile(100), 1000)
+
 class TestPeriodicChecks(TestMetricBase):
     def testPeriodicCheck(self):
         # fake out that there's no garbage (since we can't rely on Python
@@ -206,6 +234,16 @@ class TestReports(unittest.TestCase):
         self.assertEquals("Timer time_foo: 1", handler.report())
         self.assertEquals({"timers": {"time_foo": 1}}, handler.asDict())
 
+    def testMetricHistogramReport(self):
+        handler = metrics.MetricHistogramHandler(None)
+        handler.handle({}, metrics.MetricHistogramEvent('hist_foo', 0.5))
+
+        self.assertEquals("Histogram hist_foo: count=1 mean=0.5 p50=0.5 "
+                "p90=0.5 p99=0.5 max=0.5", handler.report())
+        d = handler.asDict()['histograms']['hist_foo']
+        self.assertEquals(d['count'], 1)
+        self.assertEquals(sum(n for _, n in d['buckets']), 1)
+
     def testMetricAlarmReport(self):
         handler = metrics.MetricAlarmHandler(None)
         handler.handle({}, metrics.MetricAlarmEvent('alarm_foo', msg='Uh oh', level=metrics.ALARM_WARN))
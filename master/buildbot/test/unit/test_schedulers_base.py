@@ -207,6 +207,15 @@ class BaseScheduler(scheduler.SchedulerMixin, unittest.TestCase):
                 self.makeFakeChange(),
                 None)
 
+    def test_change_consumption_routes_by_filter(self):
+        sched = self.makeScheduler()
+        cf = mock.Mock()
+        d = sched.startConsumingChanges(change_filter=cf)
+        def check(_):
+            self.assertIdentical(self.master.changes_subscr_filter, cf)
+        d.addCallback(check)
+        return d
+
     def test_change_consumption_fileIsImportant_False_onlyImportant(self):
         return self.do_test_change_consumption(
                 dict(fileIsImportant=lambda c : False, onlyImportant=True),
@@ -132,6 +132,24 @@ class BaseBasicScheduler(CommonStuffMixin,
         d.addCallback(lambda _ : sched.stopService())
         return d
 
+    def test_startService_treeStableTimer_unimportant(self):
+        sched = self.makeScheduler(self.Subclass, treeStableTimer=10)
+
+        self.db.schedulers.fakeClassifications(self.SCHEDULERID, { 20 : False })
+        self.master.db.insertTestData([
+            fakedb.Change(changeid=20),
+        ])
+
+        d = sched.startService(_returnDeferred=True)
+
+        # an unimportant change alone does not start the timer
+        def check(_):
+            self.db.schedulers.assertClassifications(self.SCHEDULERID, { 20 : False })
+            self.assertEqual(self.clock.getDelayedCalls(), [])
+        d.addCallback(check)
+        d.addCallback(lambda _ : sched.stopService())
+        return d
+
     def test_gotChange_no_treeStableTimer_unimportant(self):
         sched = self.makeScheduler(self.Subclass, treeStableTimer=None, branch='master')
 
@@ -338,3 +356,28 @@ class AnyBranchScheduler(CommonStuffMixin,
         d.addCallback(check)
 
         d.addCallback(lambda _ : sched.stopService())
+
+    def test_startService_treeStableTimer_multiple_branches(self):
+        sched = self.makeScheduler(basic.AnyBranchScheduler,
+                            treeStableTimer=10, branches=['master', 'devel', 'boring'])
+
+        self.db.schedulers.fakeClassifications(self.SCHEDULERID,
+                { 13 : True, 14 : False, 15 : False, 16 : True })
+        self.master.db.insertTestData([
+            fakedb.Change(changeid=13, branch='master'),
+            fakedb.Change(changeid=14, branch='master'),
+            fakedb.Change(changeid=15, branch='boring'),
+            fakedb.Change(changeid=16, branch='devel'),
+        ])
+        # the existing classifications are not written again
+        self.db.schedulers.queueChangeClassifications = None
+        self.db.schedulers.classifyChanges = None
+
+        d = sched.startService(_returnDeferred=True)
+        d.addCallback(lambda _ : self.clock.advance(10))
+        def check(_):
+            self.assertEqual(sorted(self.events), [ 'B[13,14]@10', 'B[16]@10' ])
+        d.addCallback(check)
+
+        d.addCallback(lambda _ : sched.stopService())
+        return d
@@ -13,7 +13,9 @@
 #
 # Copyright Buildbot Team Members
 
+import os
 import time
+import random
 import mock
 from twisted.trial import unittest
 from twisted.internet import defer, task
@@ -22,6 +24,45 @@ from buildbot.schedulers import timed
 from buildbot.test.util import scheduler
 from buildbot.changes import filter
 
+def bruteForceNextBuildTime(sched, lastActuated):
+    # the original implementation of Nightly.getNextBuildTime, which tries
+    # every minute; returns None instead of failing if no time matches within
+    # two years
+    def addTime(timetuple, secs):
+        return time.localtime(time.mktime(timetuple)+secs)
+
+    def check(ourvalue, value):
+        if ourvalue == '*': return True
+        if isinstance(ourvalue, int): return value == ourvalue
+        return (value in ourvalue)
+
+    dateTime = time.localtime(lastActuated)
+    dateTime = addTime(dateTime, 60-dateTime[5])
+    yearLimit = dateTime[0]+2
+    def isRunTime(timetuple):
+        if not check(sched.minute, timetuple[4]):
+            return False
+        if not check(sched.hour, timetuple[3]):
+            return False
+        if not check(sched.month, timetuple[1]):
+            return False
+        if sched.dayOfMonth != '*' and sched.dayOfWeek != '*':
+            if not (check(sched.dayOfMonth, timetuple[2]) or
+                    check(sched.dayOfWeek, timetuple[6])):
+                return False
+        else:
+            if not check(sched.dayOfMonth, timetuple[2]):
+                return False
+            if not check(sched.dayOfWeek, timetuple[6]):
+                return False
+        return True
+
+    while not isRunTime(dateTime):
+        dateTime = addTime(dateTime, 60)
+        if dateTime[0] >= yearLimit:
+            return None
+    return time.mktime(dateTime)
+
 class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
 
     SCHEDULERID = 132
@@ -245,6 +286,105 @@ class Nightly(scheduler.SchedulerMixin, unittest.TestCase):
             ((2011,  1,  5, 22, 19), (2011,  1,  7,  1,  0)), # Thurs
         )
 
+    def test_getNextBuildTime_feb29(self):
+        # more than two years away, which the minute-by-minute search that
+        # Nightly used to do could not find
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                month=2, dayOfMonth=29, hour=3)
+        return self.do_getNextBuildTime_test(sched,
+            ((2012,  2, 29,  3,  0), (2016,  2, 29,  3,  0)),
+            ((2097,  1,  1,  0,  0), (2104,  2, 29,  3,  0)),
+        )
+
+    def test_getNextBuildTime_never(self):
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                month=2, dayOfMonth=30)
+        self.assertRaises(AssertionError, sched.getNextBuildTime, 0)
+
+    ## DST transitions and equivalence with the minute-by-minute search
+
+    def setTimezone(self, tz):
+        old_tz = os.environ.get('TZ')
+        def restore():
+            if old_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old_tz
+            time.tzset()
+        self.addCleanup(restore)
+        os.environ['TZ'] = tz
+        time.tzset()
+
+    def test_getNextBuildTime_dst_skipped(self):
+        self.setTimezone('America/New_York')
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                hour=2, minute=30)
+        # 2:30 does not exist on 2011-03-13
+        return self.do_getNextBuildTime_test(sched,
+            ((2011,  3, 12,  3,  0), (2011,  3, 14,  2, 30)),
+        )
+
+    def test_getNextBuildTime_dst_repeated(self):
+        self.setTimezone('America/New_York')
+        sched = self.makeScheduler(name='test', builderNames=['test'], branch=None,
+                hour=1, minute=30)
+        # 1:30 occurs twice on 2011-11-06, in EDT and then in EST
+        first = time.mktime((2011, 11, 6, 1, 30, 0, 0, 0, 1))
+        second = sched._nextRunTime(first - 60)
+        self.assertEqual(second, first)
+        self.assertEqual(sched._nextRunTime(first + 1), first + 3600)
+        self.assertEqual(sched._nextRunTime(first + 3601),
+                         time.mktime((2011, 11, 7, 1, 30, 0, 0, 0, -1)))
+
+    def randomField(self, rnd, low, high):
+        r = rnd.random()
+        if r < 0.4:
+            return '*'
+        if r < 0.6:
+            return rnd.randint(low, high)
+        return rnd.sample(range(low, high + 1), rnd.randint(2, 5))
+
+    def checkEquivalence(self, tz, transitions):
+        # compare with the minute-by-minute search for random schedules,
+        # starting at random times near DST transitions; the schedules are
+        # dense enough that the search does not take too long
+        self.setTimezone(tz)
+        rnd = random.Random(tz)
+        for i in range(40):
+            kwargs = dict(minute=self.randomField(rnd, 0, 59),
+                          hour=self.randomField(rnd, 0, 23))
+            field = rnd.choice([ None, 'dayOfMonth', 'dayOfWeek', 'both' ])
+            if field in ('dayOfMonth', 'both'):
+                kwargs['dayOfMonth'] = rnd.sample(range(1, 32), 8)
+            if field in ('dayOfWeek', 'both'):
+                kwargs['dayOfWeek'] = rnd.sample(range(7), 3)
+            sched = timed.Nightly(name='test', builderNames=['test'],
+                                  branch=None, **kwargs)
+            transition = time.mktime(rnd.choice(transitions)
+                                     + (0, 0, 0, 0, -1))
+            start = transition + rnd.randint(-4 * 3600, 4 * 3600)
+            d = sched.getNextBuildTime(start)
+            got = []
+            d.addCallback(got.append)
+            self.assertEqual(got, [ bruteForceNextBuildTime(sched, start) ],
+                             "%r from %s" % (kwargs, time.ctime(start)))
+
+    def test_equivalence_new_york(self):
+        self.checkEquivalence('America/New_York',
+                              [ (2011, 3, 13, 2), (2011, 11, 6, 1) ])
+
+    def test_equivalence_london(self):
+        self.checkEquivalence('Europe/London',
+                              [ (2011, 3, 27, 1), (2011, 10, 30, 1) ])
+
+    def test_equivalence_lord_howe(self):
+        # DST transitions of 30 minutes
+        self.checkEquivalence('Australia/Lord_Howe',
+                              [ (2011, 4, 3, 2), (2011, 10, 2, 2) ])
+
+    def test_equivalence_utc(self):
+        self.checkEquivalence('UTC', [ (2011, 1, 1, 0), (2012, 2, 28, 23) ])
+
     ## end-to-end tests: let's see the scheduler in action
 
     def test_iterations_simple(self):
@@ -358,3 +358,53 @@ class TestCheckConfig(unittest.TestCase):
         d.addCallback(check)
         return d
 
+
+class TestMigrateBuildsOptions(unittest.TestCase):
+
+    def setUp(self):
+        self.options_file = {}
+        self.patch(runner, 'loadOptionsFile', lambda : self.options_file)
+
+    def parse(self, *args):
+        self.opts = runner.MigrateBuildsOptions()
+        self.opts.parseOptions(args)
+        return self.opts
+
+    def test_synopsis(self):
+        opts = runner.MigrateBuildsOptions()
+        self.assertIn('buildbot migrate-builds', opts.getSynopsis())
+
+    def test_defaults(self):
+        opts = self.parse()
+        self.assertEqual(opts['layout'], 'sharded')
+        self.assertEqual(opts['basedir'], os.getcwd())
+
+    def test_layout(self):
+        opts = self.parse('--layout=flat', 'bdir')
+        self.assertEqual(opts['layout'], 'flat')
+        self.assertEqual(opts['basedir'], os.path.abspath('bdir'))
+
+    def test_bad_layout(self):
+        self.assertRaises(runner.usage.UsageError,
+                          lambda : self.parse('--layout=deep'))
+
+class TestMigrateBuilds(unittest.TestCase):
+
+    def test_migrateBuilds(self):
+        basedir = os.path.abspath(self.mktemp())
+        for dirname in ('bldr', 'public_html'):
+            os.makedirs(os.path.join(basedir, dirname))
+        for filename in ('bldr/builder', 'bldr/1', 'bldr/1-log-a',
+                         'public_html/1'):
+            open(os.path.join(basedir, filename), "w").close()
+        rc = runner.migrateBuilds(dict(basedir=basedir, layout='sharded',
+                                       quiet=True))
+        self.assertEqual(rc, 0)
+        self.assertEqual(sorted(os.listdir(os.path.join(basedir, 'bldr'))),
+                         [ '00000', 'builder' ])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(basedir, 'bldr', '00000'))),
+            [ '1', '1-log-a' ])
+        # not a builder directory, so left alone
+        self.assertEqual(os.listdir(os.path.join(basedir, 'public_html')),
+                         [ '1' ])
@@ -144,3 +144,35 @@ class TestBuilderBuildCreation(unittest.TestCase):
         self.assertEqual(abs_ss.revision, 'abcdef')
         self.assertEqual(abs_ss.project, 'p')
         self.assertEqual(abs_ss.repository, 'r')
+
+    def test_getMergeKey_agrees_with_canBeMergedWith(self):
+        def change(branch):
+            c = mock.Mock()
+            c.branch = branch
+            c.revision = 'xyz'
+            c.project = 'p'
+            c.repository = 'r'
+            return c
+        stamps = []
+        for branch in ('dev', 'trunk'):
+            for revision in (None, 'abc', 'def'):
+                stamps.append(sourcestamp.SourceStamp(branch=branch,
+                    revision=revision, project='p', repository='r'))
+                stamps.append(sourcestamp.SourceStamp(branch=branch,
+                    revision=revision, project='p', repository='r',
+                    patch=(1, 'diff')))
+            stamps.append(sourcestamp.SourceStamp(branch=branch,
+                project='p', repository='r', changes=[change(branch)]))
+        stamps.append(sourcestamp.SourceStamp(branch='dev', revision='abc',
+            project='q', repository='r'))
+        stamps.append(sourcestamp.SourceStamp(branch='dev', revision='abc',
+            project='p', repository='s'))
+
+        for i, ss in enumerate(stamps):
+            for j, other in enumerate(stamps):
+                if i == j:
+                    continue
+                key = ss.getMergeKey()
+                keyed = key is not None and key == other.getMergeKey()
+                self.assertEqual(keyed, ss.canBeMergedWith(other),
+                        "stamps %d and %d" % (i, j))
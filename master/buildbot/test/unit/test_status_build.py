@@ -0,0 +1,119 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+from cPickle import dump, load
+from twisted.trial import unittest
+from buildbot.status import builder, build
+from buildbot.status.results import SUCCESS
+
+class TestBuildPickleFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+
+    def makeBuilder(self, format='full'):
+        b = builder.BuilderStatus(buildername='bldr')
+        b.basedir = self.basedir
+        b.setBuildPickleFormat(format)
+        b.determineNextBuildNumber()
+        return b
+
+    def saveBuild(self, format):
+        b = self.makeBuilder(format)
+        bs = b.newBuild()
+        bs.started = 100
+        bs.setProperty('prop', 'value', 'test')
+        for stepname in ('compile', 'test'):
+            step = bs.addStepWithName(stepname)
+            step.stepStarted()
+            loog = step.addLog('stdio')
+            loog.addStdout('%s output\n' % stepname)
+            loog.finish()
+            step.setText2([ stepname ])
+            step.stepFinished(SUCCESS)
+        bs.setText(['build', 'successful'])
+        bs.setResults(SUCCESS)
+        bs.finished = 200
+        bs.saveYourself()
+        return bs.number
+
+    def loadBuild(self, format='full', number=0):
+        # use a fresh builder, so that the build is not cached
+        return self.makeBuilder(format).getBuildByNumber(number)
+
+    def checkBuild(self, bs):
+        self.assertEqual(bs.getTimes(), (100, 200))
+        self.assertEqual(bs.getText(),
+                         ['build', 'successful', 'compile', 'test'])
+        self.assertEqual(bs.getResults(), SUCCESS)
+        self.assertEqual(bs.getProperty('prop'), 'value')
+        self.assertEqual([ s.getName() for s in bs.getSteps() ],
+                         [ 'compile', 'test' ])
+        self.assertEqual([ l.getText() for l in bs.getLogs() ],
+                         [ 'compile output\n', 'test output\n' ])
+        for step in bs.getSteps():
+            self.assertIdentical(step.getBuild(), bs)
+
+    def test_full(self):
+        self.saveBuild('full')
+        bs = self.loadBuild()
+        self.assertTrue(isinstance(load(open(os.path.join(self.basedir, '0'),
+                                             'rb')), build.BuildStatus))
+        self.assertTrue(bs.stepsLoaded())
+        self.checkBuild(bs)
+
+    def test_compact_loads_steps_lazily(self):
+        self.saveBuild('compact')
+        bs = self.loadBuild()
+        self.assertFalse(bs.stepsLoaded())
+        self.assertEqual(bs.getResults(), SUCCESS)
+        self.assertEqual(bs.getText(),
+                         ['build', 'successful', 'compile', 'test'])
+        self.assertFalse(bs.stepsLoaded())
+        self.checkBuild(bs)
+        self.assertTrue(bs.stepsLoaded())
+
+    def test_compact_resave_unloaded(self):
+        self.saveBuild('compact')
+        bs = self.loadBuild('compact')
+        bs.setText(['rewritten'])
+        bs.saveYourself()
+        self.assertFalse(bs.stepsLoaded())
+        bs = self.loadBuild()
+        self.assertEqual(bs.getText(), ['rewritten', 'compile', 'test'])
+        self.assertEqual(len(bs.getSteps()), 2)
+
+    def test_switch_formats(self):
+        self.saveBuild('compact')
+        bs = self.loadBuild('full')
+        bs.saveYourself()
+        self.checkBuild(self.loadBuild('compact'))
+
+    def test_pruneSteps(self):
+        self.saveBuild('compact')
+        bs = self.loadBuild()
+        bs.pruneSteps()
+        self.assertEqual(bs.getSteps(), [])
+        self.assertTrue(bs.stepsLoaded())
+
+    def test_unknown_version(self):
+        self.saveBuild('compact')
+        filename = os.path.join(self.basedir, '0')
+        record = load(open(filename, 'rb'))
+        dump((record[0], build.COMPACT_VERSION + 1) + record[2:],
+             open(filename, 'wb'))
+        self.assertRaises(IndexError, self.loadBuild)
@@ -0,0 +1,277 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.python import log
+from buildbot.status import builder, master
+
+class TestBuildIndexUse(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+
+    def touch(self, *filenames):
+        for filename in filenames:
+            path = os.path.join(self.basedir, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+
+    def exists(self, filename):
+        return os.path.exists(os.path.join(self.basedir, filename))
+
+    def makeBuilder(self, layout='flat'):
+        b = builder.BuilderStatus(buildername='bldr')
+        b.basedir = self.basedir
+        b.setBuildDirectoryLayout(layout)
+        b.determineNextBuildNumber()
+        return b
+
+    def countListdir(self):
+        calls = []
+        real_listdir = os.listdir
+        def listdir(path):
+            calls.append(path)
+            return real_listdir(path)
+        self.patch(os, 'listdir', listdir)
+        return calls
+
+    def test_determineNextBuildNumber_uses_index(self):
+        self.touch("1", "2")
+        self.makeBuilder()
+        calls = self.countListdir()
+        b = self.makeBuilder()
+        self.assertEqual(b.nextBuildNumber, 3)
+        self.assertEqual(calls, [])
+
+    def test_determineNextBuildNumber_stale_index(self):
+        self.touch("1")
+        self.makeBuilder()
+        # a build saved without updating the index
+        self.touch("2")
+        b = self.makeBuilder()
+        self.assertEqual(b.nextBuildNumber, 3)
+
+    def test_determineNextBuildNumber_sharded(self):
+        self.touch("1", os.path.join("00002", "2000"))
+        b = self.makeBuilder('sharded')
+        self.assertEqual(b.nextBuildNumber, 2001)
+        # a sharded build saved without updating the index
+        self.touch(os.path.join("00002", "2001"))
+        b = self.makeBuilder('flat')
+        self.assertEqual(b.nextBuildNumber, 2002)
+
+    def test_makeBuildFilename(self):
+        b = self.makeBuilder('sharded')
+        self.assertEqual(b.makeBuildFilename(2001),
+                         os.path.join(self.basedir, "00002", "2001"))
+        self.touch("2001")
+        self.assertEqual(b.findBuildFilename(2001),
+                         os.path.join(self.basedir, "2001"))
+        self.assertEqual(b.findBuildFilename(2002), None)
+
+    def test_newBuild_reserves_number(self):
+        b = self.makeBuilder()
+        b.newBuild()
+        b = self.makeBuilder()
+        self.assertEqual(b.nextBuildNumber, 1)
+
+    def test_prune_uses_index(self):
+        b = self.makeBuilder()
+        b.buildHorizon = 4
+        b.logHorizon = 2
+        for num in range(6):
+            b.buildIndex.record(num, pickle=True, end=10.0,
+                                logs=[ '%d-log-a' % num ])
+            self.touch('%d' % num, '%d-log-a' % num)
+        self.touch('1-log-a.bz2')
+        b.nextBuildNumber = 6
+
+        calls = self.countListdir()
+        b.prune()
+        self.assertEqual(calls, [])
+        self.assertEqual([ f for f in range(6) if self.exists('%d' % f) ],
+                         [ 2, 3, 4, 5 ])
+        self.assertEqual([ f for f in range(6)
+                           if self.exists('%d-log-a' % f) ], [ 4, 5 ])
+        self.failIf(self.exists('1-log-a.bz2'))
+        self.assertEqual(b.buildIndex.getNumbers(), [ 2, 3, 4, 5 ])
+        self.assertEqual(b.buildIndex.get(3)['logs'], [])
+
+    def test_prune_sharded(self):
+        b = self.makeBuilder('sharded')
+        b.buildHorizon = 2
+        b.logHorizon = 1
+        for num in range(1000, 1004):
+            logname = os.path.join('00001', '%d-log-a' % num)
+            b.buildIndex.record(num, pickle=True, end=10.0, logs=[ logname ])
+            self.touch(os.path.join('00001', '%d' % num), logname + '.gz')
+        # build 999 was indexed before the builder directory was migrated
+        b.buildIndex.record(999, pickle=True, end=10.0, logs=[ '999-log-a' ])
+        self.touch(os.path.join('00000', '999'),
+                   os.path.join('00000', '999-log-a'))
+        b.nextBuildNumber = 1004
+
+        b.prune()
+        self.assertEqual(b.buildIndex.getNumbers(), [ 1002, 1003 ])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.basedir, '00001'))),
+            [ '1002', '1003', '1003-log-a.gz' ])
+        # the emptied bucket is removed
+        self.failIf(self.exists('00000'))
+
+    def test_prune_unindexed_logs(self):
+        b = self.makeBuilder()
+        b.buildHorizon = 2
+        b.logHorizon = 2
+        # build 0 was interrupted by a crash
+        b.newBuild()
+        self.touch('0-log-a', '0-log-b')
+        for num in range(1, 3):
+            b.buildIndex.record(num, pickle=True, logs=[])
+        b.nextBuildNumber = 3
+
+        b.prune()
+        self.failIf(self.exists('0-log-a'))
+        self.failIf(self.exists('0-log-b'))
+        self.assertEqual(b.buildIndex.getNumbers(), [ 1, 2 ])
+
+    def test_generateFinishedBuilds_filters_with_index(self):
+        b = self.makeBuilder()
+        for num, branch, end in [ (0, 'a', 10), (1, 'b', 20), (2, 'a', 30),
+                                  (3, 'b', 40) ]:
+            b.buildIndex.record(num, pickle=True, start=end-5, end=end,
+                                branch=branch)
+        b.nextBuildNumber = 4
+
+        loaded = []
+        def getBuildByNumber(number):
+            loaded.append(number)
+            build = mock.Mock()
+            build.getNumber.return_value = number
+            entry = b.buildIndex.get(number)
+            build.getTimes.return_value = (entry['start'], entry['end'])
+            build.getSourceStamp.return_value.branch = entry['branch']
+            return build
+        b.getBuildByNumber = getBuildByNumber
+
+        builds = list(b.generateFinishedBuilds(branches=['a'],
+                                               finished_before=30))
+        self.assertEqual([ bld.getNumber() for bld in builds ], [ 0 ])
+        self.assertEqual(loaded, [ 0 ])
+
+    def test_getstate_omits_index(self):
+        b = self.makeBuilder()
+        b.status = None
+        b.currentBigState = 'idle'
+        self.failIf('buildIndex' in b.__getstate__())
+
+class FakeBuild(object):
+
+    def __init__(self, number):
+        self.number = number
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+        self.builds = {}
+
+    def makeBuilder(self, name='bldr', size=None, nbytes=None, budget=None):
+        b = builder.BuilderStatus(buildername=name)
+        b.basedir = self.basedir
+        b.buildCacheBudget = budget
+        buildmaster = mock.Mock()
+        buildmaster.buildCacheSize = size
+        buildmaster.buildCacheBytes = nbytes
+        b.reconfigFromBuildmaster(buildmaster)
+        return b
+
+    def touch(self, b, number, size=100):
+        # keep a strong reference, as a status display would
+        build = self.builds[(b.name, number)] = FakeBuild(number)
+        return b.touchBuildCache(build, size)
+
+    def test_count_limit(self):
+        b = self.makeBuilder(size=3)
+        for num in range(5):
+            self.touch(b, num)
+        self.assertEqual(sorted(b.buildLRU.keys()), [2, 3, 4])
+
+    def test_retouch_keeps_build(self):
+        b = self.makeBuilder(size=2)
+        self.touch(b, 0)
+        self.touch(b, 1)
+        b.touchBuildCache(self.builds[('bldr', 0)])
+        self.touch(b, 2)
+        self.assertEqual(sorted(b.buildLRU.keys()), [0, 2])
+
+    def test_byte_limit(self):
+        b = self.makeBuilder(size=100, nbytes=250)
+        for num in range(5):
+            self.touch(b, num)
+        self.assertEqual(sorted(b.buildLRU.keys()), [3, 4])
+
+    def test_weak_cache_survives_eviction(self):
+        b = self.makeBuilder(size=1)
+        self.touch(b, 0)
+        self.touch(b, 1)
+        # build 0 is still referenced, so it can be found without a load
+        self.assertEqual(b.getBuildByNumber(0), self.builds[('bldr', 0)])
+
+    def test_size_estimate(self):
+        b = self.makeBuilder()
+        open(os.path.join(self.basedir, "7"), "w").write("x" * 123)
+        self.assertEqual(b.estimateBuildSize(7), 123)
+        self.assertEqual(b.estimateBuildSize(8), b.ESTIMATED_BUILD_SIZE)
+
+    def test_master_budget(self):
+        status = master.Status(mock.Mock())
+        status.setBuildCacheTotalBytes(350)
+        b1 = self.makeBuilder('b1', budget=status.buildCacheBudget)
+        b2 = self.makeBuilder('b2', budget=status.buildCacheBudget)
+        self.touch(b1, 0)
+        self.touch(b2, 0)
+        self.touch(b1, 1)
+        self.touch(b2, 1)
+        # the oldest build, from b1, was evicted from both caches
+        self.assertEqual(sorted(b1.buildLRU.keys()), [1])
+        self.assertEqual(sorted(b2.buildLRU.keys()), [0, 1])
+        self.assertEqual(len(status.buildCacheBudget), 3)
+        # evicting from a builder's cache removes the build from the budget
+        b2.buildLRU.set_limits(1)
+        self.assertEqual(len(status.buildCacheBudget), 2)
+        # with no limit, the budget is not used
+        status.setBuildCacheTotalBytes(None)
+        self.touch(b1, 2)
+        self.assertEqual(len(status.buildCacheBudget), 0)
+
+    def test_hit_miss_metrics(self):
+        b = self.makeBuilder()
+        self.touch(b, 0)
+        events = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                events.append(eventDict['metric'].counter)
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        b.getBuildByNumber(0)
+        self.assertRaises(IndexError, b.getBuildByNumber, 5)
+        self.assertEqual(events, [ 'buildCache.hits', 'buildCache.hits.bldr',
+                    'buildCache.misses', 'buildCache.misses.bldr' ])
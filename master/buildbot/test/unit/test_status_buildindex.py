@@ -0,0 +1,118 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+from twisted.trial import unittest
+from buildbot.status import buildindex
+
+class TestBuildIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+
+    def touch(self, *filenames):
+        for filename in filenames:
+            open(os.path.join(self.basedir, filename), "w").close()
+
+    def makeIndex(self):
+        index = buildindex.BuildIndex(self.basedir)
+        index.load()
+        return index
+
+    def test_rebuild_from_directory(self):
+        self.touch("3", "3-log-compile-stdio", "5", "5-log-test-stdio.bz2",
+                   "7-log-orphan", "builder", "events")
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [ 3, 5, 7 ])
+        self.assertEqual(index.getMaxNumber(), 7)
+        self.assertEqual(index.get(5)['pickle'], True)
+        self.assertEqual(index.get(5)['logs'], [ '5-log-test-stdio' ])
+        self.assertEqual(index.get(7)['pickle'], False)
+        self.assertEqual(index.get(3)['end'], None)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.basedir, index.FILENAME)))
+
+    def test_rebuild_sharded(self):
+        os.makedirs(os.path.join(self.basedir, "00002"))
+        self.touch("3", os.path.join("00002", "2001"),
+                   os.path.join("00002", "2001-log-test-stdio.gz"))
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [ 3, 2001 ])
+        self.assertEqual(index.get(2001)['pickle'], True)
+        self.assertEqual(index.get(2001)['logs'],
+                         [ os.path.join("00002", "2001-log-test-stdio") ])
+        # the bucket directory is not mistaken for a build
+        self.assertEqual(index.get(2), None)
+
+    def test_empty(self):
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [])
+        self.assertEqual(index.getMaxNumber(), None)
+
+    def test_record_persists(self):
+        index = self.makeIndex()
+        index.record(1)
+        index.record(1, pickle=True, start=10.0, end=20.0, results=0,
+                     branch='trunk', logs=[ '1-log-a' ])
+        index.record(2, start=30.0)
+
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [ 1, 2 ])
+        self.assertEqual(index.get(1), dict(number=1, pickle=True,
+            start=10.0, end=20.0, results=0, branch='trunk',
+            logs=[ '1-log-a' ]))
+        self.assertEqual(index.get(2)['start'], 30.0)
+        self.assertEqual(index.get(2)['pickle'], False)
+
+    def test_record_merges(self):
+        index = self.makeIndex()
+        index.record(1, pickle=True, logs=[ '1-log-a' ])
+        index.record(1, logs=[])
+        index = self.makeIndex()
+        self.assertEqual(index.get(1)['pickle'], True)
+        self.assertEqual(index.get(1)['logs'], [])
+
+    def test_remove_persists(self):
+        index = self.makeIndex()
+        index.record(1)
+        index.record(2)
+        index.remove([ 1, 3 ])
+        self.assertEqual(index.getNumbers(), [ 2 ])
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [ 2 ])
+
+    def test_compaction(self):
+        index = self.makeIndex()
+        index.COMPACT_SLACK = 3
+        for i in range(10):
+            index.record(1, results=i)
+        f = open(index.filename)
+        lines = f.readlines()
+        f.close()
+        self.assertTrue(len(lines) <= 4)
+        index = self.makeIndex()
+        self.assertEqual(index.get(1)['results'], 9)
+
+    def test_corrupt_index_rebuilt(self):
+        self.touch("4")
+        index = self.makeIndex()
+        index.record(4, pickle=True, end=10.0)
+        f = open(index.filename, "a")
+        f.write("{not json\n")
+        f.close()
+        index = self.makeIndex()
+        self.assertEqual(index.getNumbers(), [ 4 ])
+        self.assertEqual(index.get(4)['end'], None)
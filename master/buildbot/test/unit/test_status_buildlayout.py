@@ -0,0 +1,103 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+from twisted.trial import unittest
+from buildbot.status import buildlayout
+
+class TestBuildLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath(self.mktemp())
+        os.makedirs(self.basedir)
+
+    def touch(self, *filenames):
+        for filename in filenames:
+            path = os.path.join(self.basedir, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+
+    def listFiles(self):
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.basedir):
+            reldir = dirpath[len(self.basedir)+1:]
+            found.extend([ os.path.join(reldir, f) for f in filenames ])
+        return sorted(found)
+
+    def test_buildFilename(self):
+        self.assertEqual(buildlayout.buildFilename(12345, 'flat'), '12345')
+        self.assertEqual(buildlayout.buildFilename(12345, 'sharded'),
+                         os.path.join('00012', '12345'))
+        self.assertEqual(buildlayout.buildFilename(999, 'sharded'),
+                         os.path.join('00000', '999'))
+
+    def test_alternateFilename(self):
+        alt = buildlayout.alternateFilename
+        self.assertEqual(alt('12345'), os.path.join('00012', '12345'))
+        self.assertEqual(alt('1234-log-compile-stdio'),
+                         os.path.join('00001', '1234-log-compile-stdio'))
+        self.assertEqual(alt(os.path.join('00001', '1234-log-a')),
+                         '1234-log-a')
+        self.assertEqual(alt('builder'), None)
+        self.assertEqual(alt(os.path.join('subdir', '1234-log-a')), None)
+
+    def test_listBuildFiles(self):
+        self.touch('1', '1-log-a', '1-log-a.bz2.tmp', 'builder',
+                   os.path.join('00002', '2001'),
+                   os.path.join('00002', '2001-log-b.gz'),
+                   os.path.join('00003', '3001-log-c'))
+        self.assertEqual(sorted(buildlayout.listBuildFiles(self.basedir)), [
+            (1, '1', True), (1, '1-log-a', False),
+            (2001, os.path.join('00002', '2001'), True),
+            (2001, os.path.join('00002', '2001-log-b.gz'), False),
+            (3001, os.path.join('00003', '3001-log-c'), False) ])
+        # only the relevant buckets are listed
+        self.assertEqual(sorted(buildlayout.listBuildFiles(self.basedir,
+                                                           [ 3002 ])), [
+            (1, '1', True), (1, '1-log-a', False),
+            (3001, os.path.join('00003', '3001-log-c'), False) ])
+
+    def test_migrate_sharded(self):
+        self.touch('builder', '1', '1-log-a', '1-log-a.idx', '2000',
+                   '2000-log-b.bz2',
+                   # build 2001 is still running
+                   '2001-log-c',
+                   # and build 2000's log is being compressed
+                   '2000-log-d.bz2.tmp')
+        self.assertEqual(buildlayout.migrate(self.basedir, 'sharded'), 5)
+        self.assertEqual(self.listFiles(), sorted([
+            os.path.join('00000', '1'), os.path.join('00000', '1-log-a'),
+            os.path.join('00000', '1-log-a.idx'), os.path.join('00002', '2000'),
+            os.path.join('00002', '2000-log-b.bz2'), '2000-log-d.bz2.tmp',
+            '2001-log-c', 'builder' ]))
+        # a second run has nothing to do
+        self.assertEqual(buildlayout.migrate(self.basedir, 'sharded'), 0)
+
+    def test_migrate_flat(self):
+        self.touch('builder', os.path.join('00000', '1'),
+                   os.path.join('00000', '1-log-a'),
+                   os.path.join('00002', '2000'))
+        self.assertEqual(buildlayout.migrate(self.basedir, 'flat'), 3)
+        self.assertEqual(self.listFiles(), [ '1', '1-log-a', '2000',
+                                             'builder' ])
+        # the empty buckets are removed
+        self.assertEqual(buildlayout.listBucketDirs(self.basedir), [])
+
+    def test_findFile(self):
+        self.touch(os.path.join('00000', '1'))
+        self.assertEqual(buildlayout.findFile(self.basedir, '1'),
+                         os.path.join('00000', '1'))
+        self.assertEqual(buildlayout.findFile(self.basedir, '2'), None)
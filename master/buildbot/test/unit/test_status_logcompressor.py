@@ -0,0 +1,98 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import threading
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.python import log
+from buildbot.status import logcompressor
+from buildbot.process import metrics
+
+def double(x):
+    return 2 * x
+
+class TestLogCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.compressor = logcompressor.LogCompressor()
+        self.addCleanup(self.compressor.stop)
+
+        self.events = []
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                self.events.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+    def test_submit(self):
+        d = self.compressor.submit(10, double, 21)
+        d.addCallback(self.assertEqual, 42)
+        return d
+
+    def test_submit_failure(self):
+        d = self.compressor.submit(10, double)
+        return self.assertFailure(d, TypeError)
+
+    @defer.deferredGenerator
+    def test_bounded(self):
+        self.compressor.configure(maxWorkers=2)
+        release = threading.Event()
+        started = []
+        def job(i):
+            started.append(i)
+            release.wait()
+            return i
+        dl = [ self.compressor.submit(10, job, i) for i in range(5) ]
+        self.assertEqual(self.compressor.active, 2)
+        self.assertEqual(len(self.compressor.queue), 3)
+        release.set()
+
+        wfd = defer.waitForDeferred(defer.gatherResults(dl))
+        yield wfd
+        self.assertEqual(wfd.getResult(), range(5))
+        # jobs start in the order they were submitted
+        self.assertEqual(started, range(5))
+        self.assertEqual(self.compressor.active, 0)
+
+        depths = [ ev.count for ev in self.events
+                   if isinstance(ev, metrics.MetricCountEvent)
+                   and ev.counter == 'LogCompressor.queue_depth' ]
+        self.assertEqual(max(depths), 5)
+        self.assertEqual(depths[-1], 0)
+        histograms = set([ ev.histogram for ev in self.events
+                   if isinstance(ev, metrics.MetricHistogramEvent) ])
+        self.assertEqual(histograms, set([ 'LogCompressor.queue_wait',
+                                           'LogCompressor.bytes_per_sec' ]))
+
+    @defer.deferredGenerator
+    def test_configure_starts_queued_jobs(self):
+        self.compressor.configure(maxWorkers=1)
+        release = threading.Event()
+        dl = [ self.compressor.submit(10, release.wait) for i in range(3) ]
+        self.assertEqual(self.compressor.active, 1)
+        self.compressor.configure(maxWorkers=3)
+        self.assertEqual(self.compressor.active, 3)
+        release.set()
+        wfd = defer.waitForDeferred(defer.gatherResults(dl))
+        yield wfd
+        wfd.getResult()
+
+    def test_processes(self):
+        if not logcompressor.multiprocessing:
+            raise unittest.SkipTest("multiprocessing is not available")
+        self.compressor.configure(maxWorkers=1, useProcesses=True)
+        d = self.compressor.submit(10, double, 21)
+        d.addCallback(self.assertEqual, 42)
+        return d
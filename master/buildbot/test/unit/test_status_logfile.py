@@ -13,11 +13,13 @@
 #
 # Copyright Buildbot Team Members
 
+import os
+import gzip
 import mock
 import cStringIO
 from twisted.trial import unittest
 from twisted.internet import defer
-from buildbot.status import logfile
+from buildbot.status import logfile, logcompressor
 
 class TestLogFileProducer(unittest.TestCase):
     def make_static_logfile(self, contents):
@@ -42,3 +44,177 @@ class TestLogFileProducer(unittest.TestCase):
 
     # Remainder of LogFileProduer has a wacky interface that's not
     # well-defined, so it's not tested yet
+
+class TestLogFile(unittest.TestCase):
+
+    def setUp(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.makedirs(basedir)
+        self.step = mock.Mock()
+        self.step.build.builder.basedir = basedir
+        compressor = logcompressor.LogCompressor()
+        self.patch(logcompressor, 'compressor', compressor)
+        self.addCleanup(compressor.stop)
+
+    def make_logfile(self, entries):
+        lf = logfile.LogFile(self.step, 'log', '1-log-test')
+        lf.chunkSize = 7
+        for channel, text in entries:
+            lf.addEntry(channel, text)
+        return lf
+
+    def make_entries(self, nlines, final_newline=True):
+        entries = []
+        for i in range(nlines):
+            if i % 5 == 0:
+                entries.append((logfile.HEADER, 'header %d\n' % i))
+            channel = [ logfile.STDOUT, logfile.STDERR ][i % 3 == 0]
+            entries.append((channel, 'line %d\n' % i))
+        if not final_newline:
+            entries.append((logfile.STDOUT, 'partial'))
+        entries.append((logfile.HEADER, 'done\n'))
+        return entries
+
+    def expected_tail(self, lf, lines):
+        text = lf.getText()
+        if lines == 0:
+            return ''
+        return ''.join(text.splitlines(True)[-lines:])
+
+    def tail_text(self, lf, lines):
+        return ''.join([ text for channel, text in lf.getTail(lines)
+                         if channel in logfile.TEXT_CHANNELS ])
+
+    def check_reads(self, lf):
+        text = lf.getText()
+        for lines in [ 0, 1, 2, 7, 19, 20, 21, 100 ]:
+            self.assertEqual(self.tail_text(lf, lines),
+                             self.expected_tail(lf, lines))
+        self.assertEqual(lf.getTextLength(), len(text))
+        for start, end in [ (0, None), (3, 10), (17, 18), (50, None),
+                            (len(text) - 2, len(text) + 5),
+                            (len(text), None) ]:
+            self.assertEqual(''.join(lf.getTextRange(start, end)),
+                             text[start:end])
+
+    def test_index_records(self):
+        lf = self.make_logfile([ (logfile.HEADER, 'hdr\n'),
+                                 (logfile.STDOUT, 'a\nb\n'),
+                                 (logfile.STDERR, 'c\n') ])
+        lf.finish()
+        index = lf.getChunkIndex()
+        self.assertEqual([ index.getRecord(i) for i in range(len(index)) ], [
+            (0, 0, logfile.HEADER, 0, 0),
+            (0, 8, logfile.STDOUT, 0, 0),
+            (0, 16, logfile.STDERR, 4, 2),
+        ])
+
+    def test_reads_live(self):
+        lf = self.make_logfile(self.make_entries(20))
+        self.check_reads(lf)
+
+    def test_reads_finished(self):
+        lf = self.make_logfile(self.make_entries(20, final_newline=False))
+        lf.finish()
+        self.check_reads(lf)
+
+    def test_tail_chunks(self):
+        lf = self.make_logfile(self.make_entries(20))
+        lf.finish()
+        # (line 19 is split into two chunks)
+        chunks = list(lf.getTail(1))
+        self.assertEqual(chunks, [ (logfile.STDOUT, 'line 19'),
+                                   (logfile.STDOUT, '\n'),
+                                   (logfile.HEADER, 'done\n') ])
+        self.assertEqual(list(lf.getTail(1, channels=[logfile.HEADER])),
+                         [ (logfile.HEADER, 'done\n') ])
+
+    def test_reads_without_index(self):
+        lf = self.make_logfile(self.make_entries(20))
+        lf.finish()
+        os.unlink(lf.getIndexFilename())
+        self.assertEqual(lf.getChunkIndex(), None)
+        self.check_reads(lf)
+
+    def do_test_compressed(self, method):
+        lf = self.make_logfile(self.make_entries(200, final_newline=False))
+        lf.finish()
+        text = lf.getText()
+        lf.compressMethod = method
+        lf.frameSize = 100
+        d = lf.compressLog()
+        def check(_):
+            self.failIf(os.path.exists(lf.getFilename()))
+            self.assertEqual(lf.getText(), text)
+            index = lf.getChunkIndex()
+            frames = set([ index.getRecord(i)[index.FRAME]
+                           for i in range(len(index)) ])
+            self.failUnless(len(frames) > 1)
+            self.check_reads(lf)
+        d.addCallback(check)
+        return d
+
+    def test_compressed_bz2(self):
+        return self.do_test_compressed("bz2")
+
+    def test_compressed_gz(self):
+        return self.do_test_compressed("gz")
+
+    def test_compressed_gz_fast(self):
+        return self.do_test_compressed("gz-fast")
+
+    def test_compressed_xz(self):
+        if not logfile.lzma:
+            raise unittest.SkipTest("lzma is not available")
+        return self.do_test_compressed("xz")
+
+    def test_compressed_in_process(self):
+        if not logcompressor.multiprocessing:
+            raise unittest.SkipTest("multiprocessing is not available")
+        logcompressor.compressor.configure(maxWorkers=1, useProcesses=True)
+        return self.do_test_compressed("gz")
+
+    def test_compressed_gz_readable_by_gzip(self):
+        lf = self.make_logfile(self.make_entries(200))
+        lf.finish()
+        lf.compressMethod = "gz"
+        lf.frameSize = 100
+        d = lf.compressLog()
+        def check(_):
+            f = gzip.GzipFile(lf.getFilename() + ".gz")
+            self.assertEqual(f.read(), lf.getFile().read())
+        d.addCallback(check)
+        return d
+
+    def test_reads_after_migration(self):
+        lf = self.make_logfile(self.make_entries(20))
+        lf.finish()
+        text = lf.getText()
+        basedir = self.step.build.builder.basedir
+        os.makedirs(os.path.join(basedir, '00000'))
+        for suffix in ('', '.idx'):
+            os.rename(os.path.join(basedir, '1-log-test' + suffix),
+                      os.path.join(basedir, '00000', '1-log-test' + suffix))
+        self.assertTrue(lf.hasContents())
+        self.assertEqual(lf.getText(), text)
+        self.assertEqual(lf.filename, os.path.join('00000', '1-log-test'))
+        self.check_reads(lf)
+
+    def test_iterLines(self):
+        lf = self.make_logfile([ (logfile.STDOUT, 'a long line that spans'),
+                                 (logfile.STDOUT, ' several chunks\nb\n'),
+                                 (logfile.HEADER, 'header\n'),
+                                 (logfile.STDERR, 'c\n\nd') ])
+        lf.finish()
+        self.assertEqual(list(lf.iterLines()), [
+            'a long line that spans several chunks\n', 'b\n', 'c\n', '\n',
+            'd' ])
+        self.assertEqual(list(lf.iterLines([logfile.HEADER])),
+                         [ 'header\n' ])
+        self.assertEqual(list(lf.readlines()), [
+            'a long line that spans several chunks\n', 'b\n' ])
+
+    def test_iterLines_matches_getText(self):
+        lf = self.make_logfile(self.make_entries(50, final_newline=False))
+        self.assertEqual(list(lf.iterLines()),
+                         cStringIO.StringIO(lf.getText()).readlines())
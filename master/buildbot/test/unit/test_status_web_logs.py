@@ -0,0 +1,87 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+import os
+import mock
+from twisted.trial import unittest
+from twisted.web import server
+from buildbot.status import logfile
+from buildbot.status.web import logs
+
+class TestParseByteRange(unittest.TestCase):
+
+    def test_ranges(self):
+        for header, expected in [
+                ("bytes=0-9", (0, 10)),
+                ("bytes=5-", (5, 100)),
+                ("bytes=-10", (90, 100)),
+                ("bytes=-200", (0, 100)),
+                ("bytes=90-200", (90, 100)),
+                ("bytes=100-", (None, None)),
+                ("bytes=9-5", None),
+                ("bytes=0-1,5-6", None),
+                ("lines=0-1", None),
+                ("bytes=x-1", None),
+                ("garbage", None) ]:
+            self.assertEqual(logs.parseByteRange(header, 100), expected,
+                             header)
+
+class TestTextLog(unittest.TestCase):
+
+    def setUp(self):
+        basedir = os.path.abspath(self.mktemp())
+        os.makedirs(basedir)
+        step = mock.Mock()
+        step.build.builder.basedir = basedir
+        self.log = logfile.LogFile(step, 'log', '1-log-test')
+        self.log.addHeader('starting\n')
+        for i in range(100):
+            self.log.addStdout('line %d\n' % i)
+        self.log.finish()
+        self.text = self.log.getText()
+
+    def makeRequest(self, args={}, range_header=None):
+        req = mock.Mock()
+        req.args = args
+        req.getHeader = lambda name : range_header
+        return req
+
+    def render(self, args={}, range_header=None):
+        req = self.makeRequest(args, range_header)
+        resource = logs.TextLog(self.log)
+        resource.asText = True
+        self.assertEqual(resource.render_GET(req), server.NOT_DONE_YET)
+        self.failUnless(req.finish.called)
+        written = ''.join([ call[0][0] for call in req.write.call_args_list ])
+        headers = dict([ call[0] for call in req.setHeader.call_args_list ])
+        return req, written, headers
+
+    def test_tail(self):
+        req, written, headers = self.render(args={'tail' : ['2']})
+        self.assertEqual(written, 'line 98\nline 99\n')
+
+    def test_range(self):
+        req, written, headers = self.render(range_header='bytes=7-13')
+        self.assertEqual(written, self.text[7:14])
+        req.setResponseCode.assert_called_with(206)
+        self.assertEqual(headers['content-range'],
+                         'bytes 7-13/%d' % len(self.text))
+
+    def test_range_unsatisfiable(self):
+        req = self.makeRequest(range_header='bytes=100000-')
+        resource = logs.TextLog(self.log)
+        resource.asText = True
+        self.assertEqual(resource.render_GET(req), '')
+        req.setResponseCode.assert_called_with(416)
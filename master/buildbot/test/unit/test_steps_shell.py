@@ -19,6 +19,7 @@ from twisted.trial import unittest
 from buildbot.steps import shell
 from buildbot.status.results import SKIPPED, SUCCESS, WARNINGS, FAILURE
 from buildbot.status.results import EXCEPTION
+from buildbot.status import progress
 from buildbot.test.util import steps, compat
 from buildbot.test.fake.remotecommand import ExpectShell, Expect
 from buildbot.test.fake.remotecommand import ExpectRemoteRef
@@ -127,6 +128,19 @@ class TestShellCommandExeceution(steps.BuildStepMixin, unittest.TestCase):
         self.expectOutcome(result=SUCCESS, status_text=["'echo", "hello'"])
         return self.runStep()
 
+    def test_run_buffering(self):
+        self.setupStep(
+                shell.ShellCommand(workdir='build', command="echo hello",
+                                   bufferTimeout=1, maxBufferSize=4096))
+        self.expectCommands(
+            ExpectShell(workdir='build', command='echo hello',
+                         usePTY="slave-config", bufferTimeout=1,
+                         maxBufferSize=4096)
+            + 0
+        )
+        self.expectOutcome(result=SUCCESS, status_text=["'echo", "hello'"])
+        return self.runStep()
+
     def test_run_env(self):
         self.setupStep(
                 shell.ShellCommand(workdir='build', command="echo hello"),
@@ -605,6 +619,86 @@ class WarningCountingShellCommand(steps.BuildStepMixin, unittest.TestCase):
         return self.do_test_suppressions(step, '', stdout, 2,
                                          exp_warning_log)
 
+    def test_incremental_unterminated_line(self):
+        self.setupStep(shell.WarningCountingShellCommand(command=['make'],
+                            incrementalWarnings=True))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='warning: I might')
+            + ExpectShell.log('stdio', stdout=' fail')
+            + 3
+        )
+        self.expectOutcome(result=FAILURE, status_text=["'make'", "failed"])
+        self.expectProperty("warnings-count", 1)
+        self.expectLogfile("warnings (1)", "warning: I might fail\n")
+        return self.runStep()
+
+    def test_incremental_live_count(self):
+        self.setupStep(shell.WarningCountingShellCommand(command=['make'],
+                            incrementalWarnings=True))
+        def check_live(command):
+            # the count is visible before the command finishes
+            self.assertEqual(self.step_statistics['warnings'], 2)
+            self.assertEqual(self.step_status.status_text,
+                             ["'make'", '2 warnings'])
+            # and the log hasn't been read back
+            self.step.step_status.getLogs()[0].iterLines = None
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='normal: foo\nwarning: one\n',
+                              stderr='warning: two\nmore')
+            + Expect.behavior(check_live)
+            + 0
+        )
+        self.step.WARNING_TEXT_INTERVAL = 0
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 2)
+        self.expectLogfile("warnings (2)", "warning: one\nwarning: two\n")
+        return self.runStep()
+
+    def test_incremental_with_progress(self):
+        # a real StepProgress only expects the step's progressMetrics
+        self.setupStep(shell.WarningCountingShellCommand(command=['make'],
+                            incrementalWarnings=True))
+        sp = progress.StepProgress('compile', self.step.progressMetrics)
+        progress.BuildProgress([sp])
+        sp.setExpectedTime(10)
+        self.step.progress = sp
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', usePTY='slave-config',
+                        command=["make"])
+            + ExpectShell.log('stdio', stdout='warning: one\n')
+            + 0
+        )
+        self.expectOutcome(result=WARNINGS, status_text=["'make'", "warnings"])
+        self.expectProperty("warnings-count", 1)
+        self.expectLogfile("warnings (1)", "warning: one\n")
+        return self.runStep()
+
+    def test_incremental_suppressions_directories(self):
+        def warningExtractor(step, line, match):
+            return line.split(':', 2)
+        step = shell.WarningCountingShellCommand(command=['make'],
+                                suppressionFile='supps',
+                                warningExtractor=warningExtractor,
+                                incrementalWarnings=True)
+        supps_file = "amar-src/amar.c : XXX"
+        stdout = textwrap.dedent(u"""\
+            make: Entering directory \u2019amar-src\u2019
+            amar.c:164: warning: XXX
+            amar.c:165: warning: YYY
+            make: Leaving directory 'amar-src'
+            amar.c:166: warning: XXX
+            """)
+        exp_warning_log = textwrap.dedent("""\
+            amar.c:165: warning: YYY
+            amar.c:166: warning: XXX
+        """)
+        return self.do_test_suppressions(step, supps_file, stdout, 2,
+                                         exp_warning_log)
+
     def test_warnExtractFromRegexpGroups(self):
         step = shell.WarningCountingShellCommand(command=['make'])
         we = shell.WarningCountingShellCommand.warnExtractFromRegexpGroups
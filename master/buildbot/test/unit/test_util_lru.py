@@ -403,3 +403,115 @@ class LRUCache(unittest.TestCase):
                 self.lru.get('p'))
         yield wfd
         self.check_result(wfd.getResult(), set(['P2P2']))
+
+    def test_peek_missing(self):
+        self.assertEqual(self.lru.peek('a'), None)
+        self.assertEqual((self.lru.hits, self.lru.misses), (0, 0))
+
+    @defer.deferredGenerator
+    def test_peek(self):
+        wfd = defer.waitForDeferred(
+                self.lru.get('a'))
+        yield wfd
+        wfd.getResult()
+
+        self.assertEqual(self.lru.peek('a'), short('a'))
+        self.assertEqual((self.lru.hits, self.lru.misses), (1, 1))
+
+    @defer.deferredGenerator
+    def test_add(self):
+        self.lru.add('a', set(['A2A2']))
+        self.assertEqual(self.lru.misses, 1)
+
+        # the added value is used instead of calling the miss_fn
+        wfd = defer.waitForDeferred(
+                self.lru.get('a'))
+        yield wfd
+        self.check_result(wfd.getResult(), set(['A2A2']), 1, 1)
+
+    def test_add_none(self):
+        self.lru.add('a', None)
+        self.assertEqual(self.lru.peek('a'), None)
+
+    def test_add_lru_expulsion(self):
+        for k in 'abcd':
+            self.lru.add(k, short(k))
+        self.assertEqual(sorted(self.lru.cache.keys()), ['b', 'c', 'd'])
+        self.lru.inv()
+
+class SyncLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.evicted = []
+        self.lru = lru.LRUCache(3, evict_fn=
+                lambda k, v : self.evicted.append((k, v)))
+
+    def test_get_put(self):
+        self.assertEqual(self.lru.get('a'), None)
+        self.lru.put('a', short('a'))
+        self.assertEqual(self.lru.get('a'), short('a'))
+        self.assertEqual((self.lru.hits, self.lru.misses), (1, 1))
+
+    def test_count_expulsion(self):
+        for k in 'abc':
+            self.lru.put(k, short(k))
+        self.lru.get('a')
+        self.lru.put('d', short('d'))
+        self.assertEqual(sorted(self.lru.keys()), ['a', 'c', 'd'])
+        self.assertEqual(self.evicted, [('b', short('b'))])
+
+    def test_weight_expulsion(self):
+        self.lru.set_limits(None, 10)
+        self.lru.put('a', 1, weight=4)
+        self.lru.put('b', 2, weight=4)
+        self.lru.put('c', 3, weight=4)
+        self.assertEqual(sorted(self.lru.keys()), ['b', 'c'])
+        self.assertEqual(self.lru.weight, 8)
+        # replacing a value replaces its weight
+        self.lru.put('c', 4, weight=1)
+        self.assertEqual(self.lru.weight, 5)
+
+    def test_keeps_heavy_new_entry(self):
+        self.lru.set_limits(None, 10)
+        self.lru.put('a', 1, weight=4)
+        self.lru.put('b', 2, weight=20)
+        self.assertEqual(self.lru.keys(), ['b'])
+        self.assertEqual(self.evicted, [('a', 1)])
+
+    def test_keeps_heavy_old_entry(self):
+        self.lru.set_limits(None, 10)
+        self.lru.put('a', 1, weight=4)
+        self.lru.put('b', 2, weight=4)
+        # 'a' becomes the heaviest, but most recent, entry
+        self.lru.put('a', 3, weight=8)
+        self.assertEqual(self.lru.keys(), ['a'])
+        self.assertEqual(self.evicted, [('b', 2)])
+
+    def test_remove(self):
+        for k in 'abc':
+            self.lru.put(k, short(k))
+        self.lru.remove('a')
+        self.lru.remove('z')
+        self.lru.put('d', short('d'))
+        self.lru.put('e', short('e'))
+        self.assertEqual(sorted(self.lru.keys()), ['c', 'd', 'e'])
+        self.assertEqual(self.evicted, [('b', short('b'))])
+
+    def test_clear(self):
+        self.lru.put('a', 1, weight=5)
+        self.lru.clear()
+        self.assertEqual((len(self.lru), self.lru.weight), (0, 0))
+        self.assertEqual(self.evicted, [])
+
+    def test_set_limits(self):
+        for k in 'abc':
+            self.lru.put(k, short(k))
+        self.lru.set_limits(1)
+        self.assertEqual(self.lru.keys(), ['c'])
+
+    def test_queue_compaction(self):
+        for i in xrange(1000):
+            self.lru.put(i % 4, i)
+            self.lru.get(3)
+        self.assertEqual(sorted(self.lru.keys()), [1, 2, 3])
+        self.assertTrue(len(self.lru.queue) <= self.lru.MIN_QUEUE_SIZE + 1)
@@ -23,6 +23,7 @@ class FakeMaster(object):
         self.basedir = basedir
         self.db = db
         self.changes_subscr_cb = None
+        self.changes_subscr_filter = None
         self.bset_subscr_cb = None
         self.bset_completion_subscr_cb = None
         self.caches = mock.Mock(name="caches")
@@ -41,9 +42,10 @@ class FakeMaster(object):
         sub.unsubscribe = unsub
         return sub
 
-    def subscribeToChanges(self, callback):
+    def subscribeToChanges(self, callback, change_filter=None):
         assert not self.changes_subscr_cb
         self.changes_subscr_cb = callback
+        self.changes_subscr_filter = change_filter
         return self._makeSubscription('changes_subscr_cb')
 
     def subscribeToBuildsets(self, callback):
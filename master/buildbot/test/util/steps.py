@@ -121,6 +121,7 @@ class BuildStepMixin(object):
         def addLog(name):
             l = remotecommand.FakeLogFile(name)
             ss.logs[name] = l
+            step._connectPendingLogObservers()
             return l
         step.addLog = addLog
 
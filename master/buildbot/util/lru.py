@@ -93,27 +93,11 @@ class AsyncLRUCache(object):
         """
         cache = self.cache
         weakrefs = self.weakrefs
-        refcount = self.refcount
         concurrent = self.concurrent
-        queue = self.queue
 
         # utility function to record recent use of this key
         def ref_key():
-            queue.append(key)
-            refcount[key] = refcount[key] + 1
-
-            # periodically compact the queue by eliminating duplicate keys
-            # while preserving order of most recent access.  Note that this
-            # is only required when the cache does not exceed its maximum
-            # size
-            if len(queue) > self.max_queue:
-                refcount.clear()
-                queue_appendleft = queue.appendleft
-                queue_appendleft(self.sentinel)
-                for k in ifilterfalse(refcount.__contains__,
-                                        iter(queue.pop, self.sentinel)):
-                    queue_appendleft(k)
-                    refcount[k] = 1
+            self._ref_key(key)
 
         try:
             result = cache[key]
@@ -232,6 +216,68 @@ class AsyncLRUCache(object):
         elif key in self.weakrefs:
             self.weakrefs[key] = value
 
+    def peek(self, key):
+        """
+        Get a value from the cache, without invoking the C{miss_fn}.  This is
+        intended for callers that fetch values in bulk, and want to skip those
+        keys which are already available.  A value found here counts as a hit,
+        just as for L{get}.
+
+        @param key: cache key
+        @returns: value, or None if the key is not available
+        """
+        try:
+            result = self.cache[key]
+            self.hits += 1
+        except KeyError:
+            try:
+                result = self.weakrefs[key]
+                self.refhits += 1
+                self.cache[key] = result
+            except KeyError:
+                return None
+        self._ref_key(key)
+        return result
+
+    def add(self, key, value):
+        """
+        Add a value to the cache as if it had been returned by the
+        C{miss_fn}.  This is intended for callers that fetch values in bulk,
+        and counts as a miss.  As with the C{miss_fn}, a value of None is not
+        cached.
+
+        @param key: cache key
+        @param value: value for the key
+        @returns: nothing
+        """
+        self.misses += 1
+        if value is None:
+            return
+        self.cache[key] = value
+        self.weakrefs[key] = value
+        self._ref_key(key)
+        self._purge()
+
+    def _ref_key(self, key):
+        # record recent use of this key
+        queue = self.queue
+        refcount = self.refcount
+        queue.append(key)
+        refcount[key] = refcount[key] + 1
+
+        # periodically compact the queue by eliminating duplicate keys
+        # while preserving order of most recent access.  Note that this
+        # is only required when the cache does not exceed its maximum
+        # size
+        if len(queue) > self.max_queue:
+            refcount.clear()
+            queue_appendleft = queue.appendleft
+            queue_appendleft(self.sentinel)
+            for k in ifilterfalse(refcount.__contains__,
+                                    iter(queue.pop, self.sentinel)):
+                queue_appendleft(k)
+                refcount[k] = 1
+
     def set_max_size(self, max_size):
         if self.max_size == max_size:
             return
@@ -239,3 +285,185 @@ class AsyncLRUCache(object):
         self.max_size = max_size
         self.max_queue = max_size * self.QUEUE_SIZE_FACTOR
         self._purge()
+
+class LRUCache(object):
+    """
+
+    A synchronous least-recently-used cache, limited both by the number of
+    entries and, optionally, by their total weight (for example, an estimate
+    of their size in bytes).  Values are added explicitly with L{put}, rather
+    than fetched by a miss function.
+
+    Like L{AsyncLRUCache}, this keeps a queue of recently-used keys with a
+    reference count for each key, so that L{get} and L{put} take amortized
+    constant time, regardless of the size of the cache.
+
+    When entries are evicted to satisfy the limits, C{evict_fn} is called with
+    the key and value of each.  The entry most recently added with L{put} is
+    never evicted, even if its weight alone exceeds the limit.
+
+    @ivar hits: lookups that found their key, so far
+    @ivar misses: lookups that did not, so far
+    @ivar weight: total weight of the cached values
+    @ivar max_size: maximum number of entries, or None for no limit
+    @ivar max_weight: maximum total weight, or None for no limit
+    """
+
+    __slots__ = ('max_size max_weight evict_fn cache weights weight '
+                 'queue refcount hits misses'.split())
+    sentinel = object()
+    QUEUE_SIZE_FACTOR = 10
+    MIN_QUEUE_SIZE = 100
+
+    def __init__(self, max_size=50, max_weight=None, evict_fn=None):
+        """
+        Constructor.
+
+        @param max_size: maximum number of entries, or None for no limit
+        @param max_weight: maximum total weight, or None for no limit
+        @param evict_fn: function to call, with key and value, for each
+        evicted entry
+        """
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.evict_fn = evict_fn
+        self.cache = {}
+        self.weights = {}
+        self.weight = 0
+        self.queue = deque()
+        self.refcount = defaultdict(lambda : 0)
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def keys(self):
+        return self.cache.keys()
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache, recording a use of its key.
+
+        @param key: cache key
+        @param default: value to return if the key is not cached
+        @returns: value, or C{default}
+        """
+        try:
+            result = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._ref_key(key)
+        return result
+
+    def put(self, key, value, weight=1):
+        """
+        Add or replace a value in the cache, recording a use of its key, and
+        evict entries as necessary to stay within the limits.
+
+        @param key: cache key
+        @param value: value for the key
+        @param weight: weight of the value
+        """
+        if key in self.cache:
+            self.weight -= self.weights[key]
+        self.cache[key] = value
+        self.weights[key] = weight
+        self.weight += weight
+        self._ref_key(key)
+        self._purge(key)
+
+    def remove(self, key):
+        """
+        Remove a key from the cache, if present, without calling the
+        C{evict_fn}.
+
+        @param key: cache key
+        """
+        if key in self.cache:
+            del self.cache[key]
+            self.weight -= self.weights.pop(key)
+        # any occurrences of the key in the queue are skipped when they
+        # reach its head
+
+    def clear(self):
+        """
+        Remove all entries from the cache, without calling the C{evict_fn}.
+        """
+        self.cache.clear()
+        self.weights.clear()
+        self.weight = 0
+        self.queue.clear()
+        self.refcount.clear()
+
+    def set_limits(self, max_size, max_weight=None):
+        """
+        Change the limits of the cache, evicting entries as necessary.
+
+        @param max_size: maximum number of entries, or None for no limit
+        @param max_weight: maximum total weight, or None for no limit
+        """
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self._purge()
+
+    def _over_limits(self):
+        return ((self.max_size is not None
+                 and len(self.cache) > self.max_size)
+            or (self.max_weight is not None
+                and self.weight > self.max_weight))
+
+    def _purge(self, keep=sentinel):
+        cache = self.cache
+        refcount = self.refcount
+        queue = self.queue
+
+        # purge least recently used entries, using refcount to count entries
+        # that appear multiple times in the queue, and skipping keys that have
+        # been removed
+        while self._over_limits():
+            if len(cache) == 1 and keep in cache:
+                break
+            refc = 1
+            while refc:
+                k = queue.popleft()
+                refc = refcount[k] = refcount[k] - 1
+            del refcount[k]
+            if k not in cache:
+                continue
+            if k == keep:
+                # no other entry is older, but this one must stay; requeue
+                # it (this only happens once, since every other entry is
+                # evicted before it comes around again)
+                queue.append(k)
+                refcount[k] = 1
+                continue
+            value = cache.pop(k)
+            self.weight -= self.weights.pop(k)
+            if self.evict_fn:
+                self.evict_fn(k, value)
+
+    def _ref_key(self, key):
+        # record recent use of this key
+        queue = self.queue
+        refcount = self.refcount
+        queue.append(key)
+        refcount[key] = refcount[key] + 1
+
+        # periodically compact the queue by eliminating duplicate and removed
+        # keys while preserving order of most recent access.
+        if len(queue) > max(len(self.cache) * self.QUEUE_SIZE_FACTOR,
+                            self.MIN_QUEUE_SIZE):
+            cache = self.cache
+            refcount.clear()
+            queue_appendleft = queue.appendleft
+            queue_appendleft(self.sentinel)
+            for k in iter(queue.pop, self.sentinel):
+                if k in refcount or k not in cache:
+                    continue
+                queue_appendleft(k)
+                refcount[k] = 1
@@ -46,7 +46,10 @@ class SubscriptionPoint(object):
         Deliver the given args and keyword args to all of the current
         subscribers.
         """
-        for sub in list(self.subscriptions):
+        self._deliverTo(list(self.subscriptions), args, kwargs)
+
+    def _deliverTo(self, subscriptions, args, kwargs):
+        for sub in subscriptions:
             try:
                 sub.callback(*args, **kwargs)
             except:
@@ -0,0 +1,100 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Measure the cost of BuilderStatus.touchBuildCache with a large build cache,
+comparing the list-based LRU that it used to maintain with the current
+LRUCache, for a workload that repeatedly walks over the most recent builds (as
+status displays do).  The estimated size of the cached builds is then reported
+with and without a buildCacheBytes limit, for builds of varying size.
+
+Usage: python build_cache.py [cacheSize [touches]]
+"""
+
+import sys
+import time
+import random
+
+from buildbot.status import builder
+
+class FakeBuild(object):
+
+    def __init__(self, number):
+        self.number = number
+
+class ListCache(object):
+    # the previous implementation of touchBuildCache
+    def __init__(self, size):
+        self.buildCacheSize = size
+        self.buildCache_LRU = []
+
+    def touchBuildCache(self, build):
+        if build in self.buildCache_LRU:
+            self.buildCache_LRU.remove(build)
+        self.buildCache_LRU = (self.buildCache_LRU[-(self.buildCacheSize-1):]
+                               + [ build ])
+        return build
+
+def make_builder(size, nbytes=None):
+    b = builder.BuilderStatus("bench")
+    b.buildCacheSize = size
+    b.buildCacheBytes = nbytes
+    b.buildLRU.set_limits(size, nbytes)
+    return b
+
+def workload(cache_size, touches):
+    # walk over the most recent builds, a little beyond the cache size
+    window = cache_size + cache_size // 10
+    return [ (i % window) for i in xrange(touches) ]
+
+def measure_touch(cache_size, touches):
+    numbers = workload(cache_size, touches)
+    builds = [ FakeBuild(n) for n in xrange(max(numbers) + 1) ]
+    for name, cache in [ ('list', ListCache(cache_size)),
+                         ('LRUCache', make_builder(cache_size)) ]:
+        start = time.time()
+        if name == 'list':
+            for n in numbers:
+                cache.touchBuildCache(builds[n])
+        else:
+            for n in numbers:
+                cache.touchBuildCache(builds[n], 1000)
+        elapsed = time.time() - start
+        print "%-8s %d touches, cache of %d: %7.3fs (%5.1f us/touch)" % (
+                name, touches, cache_size, elapsed, elapsed / touches * 1e6)
+
+def measure_bytes(cache_size):
+    rnd = random.Random(0)
+    # mostly small builds, with the occasional huge one
+    sizes = [ rnd.choice([ 20, 20, 20, 50, 2000 ]) * 1024
+              for n in xrange(cache_size * 4) ]
+    for nbytes in [ None, 10 * 1024 * 1024 ]:
+        b = make_builder(cache_size, nbytes)
+        builds = []
+        for n, size in enumerate(sizes):
+            builds.append(b.touchBuildCache(FakeBuild(n), size))
+        print "buildCacheBytes=%-9s %4d builds cached, %7.1f MB estimated" % (
+                nbytes, len(b.buildLRU), b.buildLRU.weight / 1024.0 / 1024)
+
+def main():
+    cache_size = int((sys.argv[1:2] or [ 1000 ])[0])
+    touches = int((sys.argv[2:3] or [ 200000 ])[0])
+    measure_touch(cache_size, touches)
+    measure_bytes(cache_size)
+
+if __name__ == '__main__':
+    main()
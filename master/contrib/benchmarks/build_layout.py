@@ -0,0 +1,69 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the wall time needed to find the files of a few old builds (as
+BuilderStatus.prune does for builds whose logs are not indexed) in a builder
+directory with many builds, in the flat layout and, after migrating the
+directory with buildlayout.migrate, in the sharded layout.  The time taken by
+the migration itself is reported, too.
+
+Usage: python build_layout.py [builds]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from buildbot.status import buildlayout
+
+LOGS = [ 'compile-stdio', 'test-stdio', 'test-stdio.idx' ]
+
+def make_builds(basedir, count):
+    open(os.path.join(basedir, "builder"), "w").close()
+    for num in xrange(count):
+        for filename in [ "%d" % num ] + [ "%d-log-%s" % (num, log)
+                                           for log in LOGS ]:
+            open(os.path.join(basedir, filename), "w").close()
+
+def find_old_builds(basedir):
+    numbers = [ 0, 1, 2 ]
+    start = time.time()
+    files = [ f for f in buildlayout.listBuildFiles(basedir, numbers)
+              if f[0] in numbers ]
+    assert len(files) == len(numbers) * (len(LOGS) + 1)
+    return time.time() - start
+
+def main():
+    count = int((sys.argv[1:2] or [ 50000 ])[0])
+    basedir = tempfile.mkdtemp()
+    try:
+        make_builds(basedir, count)
+        flat = find_old_builds(basedir)
+        start = time.time()
+        moved = buildlayout.migrate(basedir, buildlayout.SHARDED)
+        migration = time.time() - start
+        sharded = find_old_builds(basedir)
+        print ("%d builds (%d files): flat %7.4fs; sharded %7.4fs; "
+               "migration %6.2fs" % (count, moved, flat, sharded, migration))
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the 'full' and 'compact' build pickle formats on a corpus of
+generated builds: the size of the pickles, the wall time to load every build
+with a cold build cache and read its summary (as the console and grid views
+do), and the additional time to load the steps of every build (as the
+waterfall does).
+
+Usage: python build_pickle.py [builds [steps]]
+"""
+
+import gc
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from buildbot.status import builder
+from buildbot.status.results import SUCCESS, WARNINGS
+
+def make_builder(basedir, format):
+    b = builder.BuilderStatus('bench')
+    b.basedir = basedir
+    b.setBuildPickleFormat(format)
+    b.determineNextBuildNumber()
+    return b
+
+def make_builds(basedir, format, builds, steps):
+    b = make_builder(basedir, format)
+    for i in xrange(builds):
+        bs = b.newBuild()
+        bs.started = 1000000 + i * 100
+        bs.setSlavename('slave%d' % (i % 5))
+        for p in range(15):
+            bs.setProperty('property%d' % p, 'value of property %d' % p,
+                           'Build')
+        for s in range(steps):
+            step = bs.addStepWithName('step%d' % s)
+            step.stepStarted()
+            for logname in ('stdio', 'warnings'):
+                step.addLog(logname).finish()
+            step.setText(['step%d' % s, 'done'])
+            step.setStatistic('warnings', s)
+            step.stepFinished([ SUCCESS, WARNINGS ][s % 7 == 0])
+        bs.setText(['build', 'successful'])
+        bs.setResults(SUCCESS)
+        bs.finished = bs.started + 50
+        bs.saveYourself()
+
+def pickle_bytes(basedir, builds):
+    return sum([ os.path.getsize(os.path.join(basedir, str(n)))
+                 for n in xrange(builds) ])
+
+def measure(basedir, format, builds, steps):
+    make_builds(basedir, format, builds, steps)
+    size = pickle_bytes(basedir, builds)
+    gc.collect()
+
+    b = make_builder(basedir, format)
+    b.buildCacheSize = builds
+    b.buildLRU.set_limits(builds)
+    start = time.time()
+    loaded = [ b.getBuildByNumber(n) for n in xrange(builds) ]
+    for bs in loaded:
+        bs.getResults(), bs.getText(), bs.getTimes()
+    summary = time.time() - start
+
+    start = time.time()
+    for bs in loaded:
+        bs.getSteps()
+    details = time.time() - start
+
+    print ("%-7s %d builds: %6.1f KB/build; load summary %6.3fs; "
+           "load steps %6.3fs" % (format, builds, size / 1024.0 / builds,
+                                  summary, details))
+
+def main():
+    builds = int((sys.argv[1:2] or [ 500 ])[0])
+    steps = int((sys.argv[2:3] or [ 20 ])[0])
+    for format in [ 'full', 'compact' ]:
+        basedir = tempfile.mkdtemp()
+        try:
+            measure(basedir, format, builds, steps)
+        finally:
+            shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    # getBuildByNumber logs every load, so keep the log quiet
+    from twisted.python import log
+    log.msg = lambda *args, **kwargs : None
+    main()
@@ -0,0 +1,69 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the number of scheduler callbacks, and the wall time, needed to
+deliver changes to many schedulers that each watch one branch, when every
+change is delivered to every scheduler (as a plain SubscriptionPoint does)
+and when changes are routed by branch with a ChangeRouter.  Each callback
+applies its scheduler's ChangeFilter, as BaseScheduler does.
+
+Usage: python change_routing.py [schedulers [changes]]
+"""
+
+import sys
+import time
+
+from buildbot.changes import filter, routing
+from buildbot.util import subscription
+
+class Change(object):
+    project = repository = category = ''
+    def __init__(self, branch):
+        self.branch = branch
+
+def run(point, schedulers, changes, use_filter):
+    counts = dict(callbacks=0, accepted=0)
+    for num in range(schedulers):
+        change_filter = filter.ChangeFilter(branch='branch%d' % num)
+        def callback(change, change_filter=change_filter):
+            counts['callbacks'] += 1
+            if change_filter.filter_change(change):
+                counts['accepted'] += 1
+        if use_filter:
+            point.subscribe(callback, change_filter)
+        else:
+            point.subscribe(callback)
+    start = time.time()
+    for num in range(changes):
+        point.deliver(Change('branch%d' % (num % (schedulers * 2))))
+    return counts, time.time() - start
+
+def main():
+    schedulers = int((sys.argv[1:2] or [ 400 ])[0])
+    changes = int((sys.argv[2:3] or [ 2000 ])[0])
+    for name, point, use_filter in [
+            ('broadcast', subscription.SubscriptionPoint('changes'), False),
+            ('routed', routing.ChangeRouter('changes'), True) ]:
+        counts, elapsed = run(point, schedulers, changes, use_filter)
+        print ("%-9s %d schedulers, %d changes: %7d callbacks, %5d accepted, "
+               "%8.1f us/change" % (name, schedulers, changes,
+               counts['callbacks'], counts['accepted'],
+               elapsed / changes * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Simulate several masters contending to claim the same build requests in one
+database, and compare claim latency with the literal IN-list claim path and
+with the temporary-table path (which is what every claim used to use).
+
+Each simulated master repeatedly reads the unclaimed requests and tries to
+claim a random pair of them, until none are left.
+
+Usage: python claim_contention.py [db_url [masters [requests]]]
+
+The default db_url is a SQLite database in a temporary directory; any URL
+accepted by the buildmaster (e.g., postgres://...) can be given instead, but
+its buildrequests table will be overwritten.
+"""
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import mock
+from twisted.internet import defer, reactor
+from buildbot.db import connector, buildrequests
+from buildbot.process import cache
+
+def make_db(db_url, basedir, master_name):
+    master = mock.Mock()
+    master.caches = cache.CacheManager()
+    master.master_name = master_name
+    master.master_incarnation = 'pid%d' % random.randint(0, 100000)
+    return connector.DBConnector(master, db_url, basedir)
+
+@defer.deferredGenerator
+def setup_db(db, count):
+    wfd = defer.waitForDeferred(
+        db.pool.do_with_engine(db.model.metadata.create_all))
+    yield wfd
+    wfd.getResult()
+
+    def thd(conn):
+        conn.execute(db.model.buildrequests.delete())
+        conn.execute(db.model.buildsets.delete())
+        conn.execute(db.model.sourcestamps.delete())
+        conn.execute(db.model.sourcestamps.insert(), id=1, revision='abcd')
+        conn.execute(db.model.buildsets.insert(), id=1, sourcestampid=1,
+                reason='benchmark', submitted_at=1300000000, complete=0,
+                results=-1)
+        conn.execute(db.model.buildrequests.insert(), [
+            dict(id=i, buildsetid=1, buildername='bldr', priority=0,
+                 claimed_at=0, complete=0, results=-1,
+                 submitted_at=1300000000 + i)
+            for i in xrange(1, count + 1) ])
+    wfd = defer.waitForDeferred(db.pool.do(thd))
+    yield wfd
+    wfd.getResult()
+
+@defer.deferredGenerator
+def run_master(db, stats):
+    while 1:
+        wfd = defer.waitForDeferred(
+            db.buildrequests.getBuildRequests(buildername='bldr',
+                claimed=False))
+        yield wfd
+        brdicts = wfd.getResult()
+        if not brdicts:
+            break
+
+        brids = [ brd['brid'] for brd in random.sample(brdicts,
+                                                min(2, len(brdicts))) ]
+        start = time.time()
+        wfd = defer.waitForDeferred(
+            db.buildrequests.claimBuildRequests(brids))
+        yield wfd
+        try:
+            wfd.getResult()
+            stats['claimed'] += len(brids)
+        except buildrequests.AlreadyClaimedError:
+            stats['conflicts'] += 1
+        stats['claims'] += 1
+        stats['latency'] += time.time() - start
+
+@defer.deferredGenerator
+def run(db_url, masters, count):
+    basedir = tempfile.mkdtemp()
+    try:
+        for name, max_in_list in [ ('temp table', 0),
+                ('IN list', buildrequests.BuildRequestsConnectorComponent.MAX_IN_LIST) ]:
+            dbs = [ make_db(db_url, basedir, 'master%d' % i)
+                    for i in range(masters) ]
+            for db in dbs:
+                db.buildrequests.MAX_IN_LIST = max_in_list
+            wfd = defer.waitForDeferred(setup_db(dbs[0], count))
+            yield wfd
+            wfd.getResult()
+
+            stats = dict(claimed=0, claims=0, conflicts=0, latency=0.0)
+            start = time.time()
+            wfd = defer.waitForDeferred(
+                defer.gatherResults([ run_master(db, stats) for db in dbs ]))
+            yield wfd
+            wfd.getResult()
+            elapsed = time.time() - start
+            assert stats['claimed'] == count
+
+            print ("%-10s %2d masters, %5d requests: %5d claims, "
+                   "%4d conflicts, %6.2fms mean claim latency, %7.3fs total"
+                    % (name, masters, count, stats['claims'],
+                       stats['conflicts'],
+                       1000 * stats['latency'] / stats['claims'], elapsed))
+            for db in dbs:
+                db.pool.shutdown()
+    finally:
+        shutil.rmtree(basedir)
+
+def main():
+    db_url = len(sys.argv) > 1 and sys.argv[1] or 'sqlite:///state.sqlite'
+    masters = len(sys.argv) > 2 and int(sys.argv[2]) or 4
+    count = len(sys.argv) > 3 and int(sys.argv[3]) or 1000
+    d = run(db_url, masters, count)
+    d.addErrback(lambda f : f.printTraceback())
+    d.addBoth(lambda _ : reactor.stop())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Measure how many changes per second SingleBranchSchedulers with a
+treeStableTimer can take in, when each change's classification is written
+before the next change is handled, one INSERT (or INSERT and UPDATE) at a
+time, as gotChange used to do, and when classifications are queued and
+written in batches.  Every change is delivered to every scheduler, and each
+scheduler handles its changes one at a time, as BaseScheduler does.  The
+classifications are all in the database when the time is taken.
+
+Usage: python classify_changes.py [db_url [changes [schedulers]]]
+
+The default db_url is a SQLite database in a temporary directory; any URL
+accepted by the buildmaster (e.g., postgres://...) can be given instead, but
+its scheduler_changes table will be overwritten.
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+import mock
+from twisted.internet import defer, reactor
+from buildbot.db import connector
+from buildbot.process import cache
+from buildbot.schedulers import basic
+
+class Change(object):
+    branch = None
+    def __init__(self, number):
+        self.number = number
+
+class UnbatchedScheduler(basic.SingleBranchScheduler):
+    # gotChange as it was before classifications were batched
+    def gotChange(self, change, important):
+        db = self.master.db
+        d = db.pool.do(lambda conn :
+                db.schedulers._writeClassificationsOneByOne(conn,
+                    [ (self.schedulerid, change.number, important) ]))
+        def fix_timer(_):
+            if not important and not self._stable_timers['only']:
+                return
+            if self._stable_timers['only']:
+                self._stable_timers['only'].cancel()
+            self._stable_timers['only'] = self._reactor.callLater(
+                    self.treeStableTimer, self.stableTimerFired, 'only')
+        d.addCallback(fix_timer)
+        return d
+
+@defer.deferredGenerator
+def setup_db(db, count):
+    wfd = defer.waitForDeferred(
+        db.pool.do_with_engine(db.model.metadata.create_all))
+    yield wfd
+    wfd.getResult()
+
+    def thd(conn):
+        conn.execute(db.model.scheduler_changes.delete())
+        conn.execute(db.model.changes.delete())
+        conn.execute(db.model.changes.insert(), [
+            dict(changeid=i, author='me', comments='', is_dir=0,
+                 branch=None, revision='rev%d' % i, revlink='',
+                 when_timestamp=1300000000 + i, category='', repository='',
+                 project='')
+            for i in xrange(1, count + 1) ])
+    wfd = defer.waitForDeferred(db.pool.do(thd))
+    yield wfd
+    wfd.getResult()
+
+@defer.deferredGenerator
+def feed(sched, count):
+    for i in xrange(1, count + 1):
+        wfd = defer.waitForDeferred(sched.gotChange(Change(i), i % 3 != 0))
+        yield wfd
+        wfd.getResult()
+
+@defer.deferredGenerator
+def run(db_url, count, nscheds):
+    basedir = tempfile.mkdtemp()
+    try:
+        for name, klass in [ ('unbatched', UnbatchedScheduler),
+                             ('batched', basic.SingleBranchScheduler) ]:
+            master = mock.Mock()
+            master.caches = cache.CacheManager()
+            db = master.db = connector.DBConnector(master, db_url, basedir)
+            wfd = defer.waitForDeferred(setup_db(db, count))
+            yield wfd
+            wfd.getResult()
+
+            scheds = []
+            for i in range(nscheds):
+                sched = klass(name='sched%d' % i, branch=None,
+                              treeStableTimer=3600, builderNames=['b'])
+                sched.master = master
+                wfd = defer.waitForDeferred(
+                    db.schedulers.getSchedulerId(sched.name,
+                                                 klass.__name__))
+                yield wfd
+                sched.schedulerid = wfd.getResult()
+                scheds.append(sched)
+
+            start = time.time()
+            wfd = defer.waitForDeferred(
+                defer.gatherResults([ feed(s, count) for s in scheds ]))
+            yield wfd
+            wfd.getResult()
+            wfd = defer.waitForDeferred(
+                db.schedulers.waitForQueuedClassifications())
+            yield wfd
+            wfd.getResult()
+            elapsed = time.time() - start
+
+            def thd(conn):
+                tbl = db.model.scheduler_changes
+                return len(conn.execute(tbl.select()).fetchall())
+            wfd = defer.waitForDeferred(db.pool.do(thd))
+            yield wfd
+            assert wfd.getResult() == count * nscheds
+
+            for sched in scheds:
+                for timer in sched._stable_timers.values():
+                    if timer:
+                        timer.cancel()
+            print ("%-9s %3d schedulers, %5d changes: %8.1f changes/sec"
+                   % (name, nscheds, count, count / elapsed))
+            db.pool.shutdown()
+    finally:
+        shutil.rmtree(basedir)
+
+def main():
+    db_url = len(sys.argv) > 1 and sys.argv[1] or 'sqlite:///state.sqlite'
+    count = len(sys.argv) > 2 and int(sys.argv[2]) or 2000
+    nscheds = len(sys.argv) > 3 and int(sys.argv[3]) or 1
+    d = run(db_url, count, nscheds)
+    d.addErrback(lambda f : f.printTraceback())
+    d.addBoth(lambda _ : reactor.stop())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
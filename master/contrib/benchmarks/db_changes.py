@@ -0,0 +1,129 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the number of database round trips and the wall time needed to
+hydrate the most recent changes, one change at a time (as getRecentChanges
+used to do) and in bulk with ChangesConnectorComponent.getChanges.
+
+Usage: python db_changes.py [count ...]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+import mock
+from twisted.internet import defer, reactor
+from buildbot.db import connector
+from buildbot.process import cache
+from buildbot.util import epoch2datetime
+
+def make_db(basedir):
+    master = mock.Mock()
+    master.caches = cache.CacheManager()
+    db = connector.DBConnector(master, 'sqlite:///state.sqlite', basedir)
+    d = db.pool.do_with_engine(db.model.metadata.create_all)
+    d.addCallback(lambda _ : db)
+    return d
+
+@defer.deferredGenerator
+def add_changes(db, count):
+    for i in xrange(count):
+        wfd = defer.waitForDeferred(
+            db.changes.addChange(author=u'dustin', comments=u'change %d' % i,
+                files=[ u'master/file%d.py' % j for j in range(3) ],
+                links=[ u'http://buildbot.net/%d' % i ],
+                revision=u'%040x' % i, branch=u'master',
+                when_timestamp=epoch2datetime(1300000000 + i),
+                properties={ u'n' : (i, 'Change') },
+                repository=u'git://buildbot', project=u'buildbot'))
+        yield wfd
+        wfd.getResult()
+
+def count_round_trips(db):
+    # wrap the pool's do method to count calls
+    calls = []
+    real_do = db.pool.do
+    def do(*args, **kwargs):
+        calls.append(1)
+        return real_do(*args, **kwargs)
+    db.pool.do = do
+    return calls
+
+def reset_caches(db):
+    # use a fresh, suitably-sized cache so each run starts cold
+    db.master.caches = cache.CacheManager()
+    db.master.caches.load_config(dict(chdicts=10000))
+    db.changes = db.changes.__class__(db)
+
+@defer.deferredGenerator
+def run(counts):
+    for count in counts:
+        basedir = tempfile.mkdtemp()
+        try:
+            wfd = defer.waitForDeferred(make_db(basedir))
+            yield wfd
+            db = wfd.getResult()
+            wfd = defer.waitForDeferred(add_changes(db, count))
+            yield wfd
+            wfd.getResult()
+
+            # one at a time
+            reset_caches(db)
+            calls = count_round_trips(db)
+            start = time.time()
+            wfd = defer.waitForDeferred(
+                db.changes.getLatestChangeid())
+            yield wfd
+            latest = wfd.getResult()
+            wfd = defer.waitForDeferred(
+                defer.gatherResults([ db.changes.getChange(changeid)
+                    for changeid in range(latest - count + 1, latest + 1) ]))
+            yield wfd
+            wfd.getResult()
+            single_time = time.time() - start
+            single_calls = len(calls)
+
+            # in bulk
+            reset_caches(db)
+            calls = count_round_trips(db)
+            start = time.time()
+            wfd = defer.waitForDeferred(
+                db.changes.getRecentChanges(count))
+            yield wfd
+            assert len(wfd.getResult()) == count
+            bulk_time = time.time() - start
+            bulk_calls = len(calls)
+
+            print ("%6d changes: one-at-a-time %6d round trips %8.3fs; "
+                   "bulk %4d round trips %8.3fs" % (count,
+                    single_calls, single_time, bulk_calls, bulk_time))
+            db.pool.shutdown()
+        finally:
+            shutil.rmtree(basedir)
+
+def main():
+    counts = [ int(a) for a in sys.argv[1:] ] or [ 25, 500, 5000 ]
+    d = run(counts)
+    d.addErrback(lambda f : f.printTraceback())
+    d.addBoth(lambda _ : reactor.stop())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Simulate many steps contending for a counting lock, some of which need it
+exclusively, with the lock implementation that BaseLock used to have and
+with the current one.  Time is simulated; the CPU time spent, and the mean
+and longest simulated waits for the lock, are reported.
+
+Each step repeatedly acquires the lock as BuildStep.acquireLocks does,
+holds it for a random time, and releases it.
+
+Usage: python lock_churn.py [steps [maxCount [rounds]]]
+"""
+
+import sys
+import time
+import random
+
+from twisted.internet import defer, task
+from buildbot import locks
+
+class OldLock:
+    # BaseLock as it was before FIFO ordering and owner counters
+    def __init__(self, name, maxCount=1):
+        self.name = name
+        self.waiting = []
+        self.owners = []
+        self.maxCount = maxCount
+
+    def _getOwnersCount(self):
+        num_excl, num_counting = 0, 0
+        for owner in self.owners:
+            if owner[1].mode == 'exclusive':
+                num_excl = num_excl + 1
+            else:
+                num_counting = num_counting + 1
+        return num_excl, num_counting
+
+    def isAvailable(self, requester, access):
+        locks.debuglog("%s isAvailable(%s): self.owners=%r"
+                                            % (self, access, self.owners))
+        num_excl, num_counting = self._getOwnersCount()
+        if access.mode == 'counting':
+            return num_excl == 0 and num_counting < self.maxCount
+        else:
+            return num_excl == 0 and num_counting == 0
+
+    def claim(self, owner, access):
+        assert self.isAvailable(owner, access)
+        self.owners.append((owner, access))
+
+    def release(self, owner, access):
+        entry = (owner, access)
+        assert entry in self.owners
+        self.owners.remove(entry)
+        num_excl, num_counting = self._getOwnersCount()
+        while len(self.waiting) > 0:
+            access, d = self.waiting[0]
+            if access.mode == 'counting':
+                if num_excl > 0 or num_counting == self.maxCount:
+                    break
+                else:
+                    num_counting = num_counting + 1
+            else:
+                if num_excl > 0 or num_counting > 0:
+                    break
+                else:
+                    num_excl = num_excl + 1
+            del self.waiting[0]
+            self._reactor.callLater(0, d.callback, self)
+
+    def waitUntilMaybeAvailable(self, owner, access):
+        if self.isAvailable(owner, access):
+            return defer.succeed(self)
+        d = defer.Deferred()
+        self.waiting.append((access, d))
+        return d
+
+class Step(object):
+    def __init__(self, lock, access, clock, rounds, waits):
+        self.lock = lock
+        self.access = access
+        self.clock = clock
+        self.rounds = rounds
+        self.waits = waits
+
+    def start(self):
+        self.clock.callLater(random.random(), self.acquire)
+
+    def acquire(self, _=None, since=None):
+        if since is None:
+            since = self.clock.seconds()
+        if not self.lock.isAvailable(self, self.access):
+            d = self.lock.waitUntilMaybeAvailable(self, self.access)
+            d.addCallback(self.acquire, since)
+            return
+        self.lock.claim(self, self.access)
+        self.waits.append(self.clock.seconds() - since)
+        self.clock.callLater(random.random(), self.release)
+
+    def release(self):
+        self.lock.release(self, self.access)
+        self.rounds -= 1
+        if self.rounds:
+            self.clock.callLater(random.random() * 0.1, self.acquire)
+
+def run(lockclass, nsteps, maxCount, rounds):
+    random.seed(1)
+    clock = task.Clock()
+    lock = lockclass('lock', maxCount)
+    lock._reactor = clock
+    lockid = locks.MasterLock('lock', maxCount)
+    waits = []
+    steps = []
+    for i in range(nsteps):
+        mode = i % 20 == 0 and 'exclusive' or 'counting'
+        steps.append(Step(lock, lockid.access(mode), clock, rounds, waits))
+    for step in steps:
+        step.start()
+    start = time.clock()
+    while clock.getDelayedCalls():
+        clock.advance(min([ c.getTime() for c in clock.getDelayedCalls() ])
+                      - clock.seconds())
+    elapsed = time.clock() - start
+    assert len(waits) == nsteps * rounds
+    return elapsed, sum(waits) / len(waits), max(waits)
+
+def main():
+    nsteps = int((sys.argv[1:2] or [ 500 ])[0])
+    maxCount = int((sys.argv[2:3] or [ 50 ])[0])
+    rounds = int((sys.argv[3:4] or [ 10 ])[0])
+    for name, lockclass in [ ('old', OldLock), ('fifo', locks.BaseLock) ]:
+        elapsed, mean, longest = run(lockclass, nsteps, maxCount, rounds)
+        print ("%-5s %d steps, maxCount %d: %6.2fs CPU, simulated wait "
+               "mean %6.2fs, max %7.2fs" % (name, nsteps, maxCount, elapsed,
+                                           mean, longest))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Measure the throughput and compression ratio of each log compression method,
+and then compress a wave of logs at once, as happens when many builds finish
+together.  During the wave, a trivial function is run every 10ms in the
+reactor's thread pool, and the longest it waited is reported, both when each
+log is compressed with deferToThread (as LogFile.compressLog used to do) and
+when the logs are queued on a LogCompressor.
+
+Usage: python log_compression.py [megabytes [logs]]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from twisted.internet import defer, reactor, threads, task
+from buildbot.status import logfile, logcompressor
+
+def make_log(filename, megabytes):
+    line = "compiling some/source/file.c with -O2 -Wall and friends: ok\n"
+    warning = "some/source/file.c:10: warning: unused variable 'x'\n"
+    block = (line * 9 + warning) * 100
+    f = open(filename, "w")
+    for i in xrange(megabytes * 1024 * 1024 / len(block)):
+        f.write("%d:0%s," % (len(block), block))
+    f.close()
+
+def measure_methods(basedir, megabytes):
+    filename = os.path.join(basedir, "1-log-compile")
+    make_log(filename, megabytes)
+    size = os.path.getsize(filename)
+    for method in sorted(logfile.COMPRESSION_METHODS):
+        compressed = filename + ".tmp"
+        start = time.time()
+        logfile.compressLogFile(filename, compressed, method,
+                                logfile.LogFile.frameSize)
+        elapsed = time.time() - start
+        print "%-8s %7.1f MB/s; %5.1f%% of original size" % (method,
+                size / elapsed / 1024 / 1024,
+                100.0 * os.path.getsize(compressed) / size)
+        os.unlink(compressed)
+
+@defer.deferredGenerator
+def measure_wave(basedir, megabytes, logs, queued):
+    filenames = []
+    for i in range(logs):
+        filename = os.path.join(basedir, "%d-log-compile" % i)
+        make_log(filename, megabytes)
+        filenames.append(filename)
+
+    # probe the reactor's thread pool while the logs are compressed
+    waits = []
+    def probe():
+        queued_at = time.time()
+        d = threads.deferToThread(time.time)
+        d.addCallback(lambda started_at : waits.append(started_at - queued_at))
+    loop = task.LoopingCall(probe)
+    loop.start(0.01)
+
+    start = time.time()
+    dl = []
+    for filename in filenames:
+        args = (filename, filename + ".bz2.tmp", "bz2",
+                logfile.LogFile.frameSize)
+        if queued:
+            d = logcompressor.compressor.submit(os.path.getsize(filename),
+                    logfile.compressLogFile, *args)
+        else:
+            d = threads.deferToThread(logfile.compressLogFile, *args)
+        dl.append(d)
+    wfd = defer.waitForDeferred(defer.gatherResults(dl))
+    yield wfd
+    wfd.getResult()
+    elapsed = time.time() - start
+    loop.stop()
+
+    for filename in filenames:
+        os.unlink(filename)
+        os.unlink(filename + ".bz2.tmp")
+    mode = queued and "LogCompressor" or "deferToThread"
+    print "%-13s %d logs in %6.2fs; longest thread pool wait %6.3fs" % (
+            mode, logs, elapsed, max(waits))
+
+@defer.deferredGenerator
+def run(basedir, megabytes, logs):
+    measure_methods(basedir, megabytes)
+    for queued in [ False, True ]:
+        wfd = defer.waitForDeferred(
+                measure_wave(basedir, megabytes, logs, queued))
+        yield wfd
+        wfd.getResult()
+
+def main():
+    megabytes = int((sys.argv[1:2] or [ 10 ])[0])
+    logs = int((sys.argv[2:3] or [ 24 ])[0])
+    basedir = tempfile.mkdtemp()
+    d = run(basedir, megabytes, logs)
+    d.addErrback(lambda f : f.printTraceback())
+    d.addBoth(lambda _ : shutil.rmtree(basedir))
+    d.addBoth(lambda _ : reactor.stop())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the peak memory use and wall time of scanning every line of a large
+logfile for warnings by splitting the result of getText (as
+WarningCountingShellCommand.createSummary used to do) and with
+LogFile.iterLines.  Each method runs in a fresh child process, and the peak
+RSS reported is the growth over the child's RSS after loading buildbot.
+
+Usage: python log_lines.py [megabytes]
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+import cPickle
+
+import mock
+from buildbot.status import logfile
+
+warning_re = re.compile(".*warning[: ].*")
+
+def maxrss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def make_log(basedir, megabytes):
+    step = mock.Mock()
+    step.build.builder.basedir = basedir
+    lf = logfile.LogFile(step, 'log', '1-log-compile')
+    line = "compiling some/source/file.c with -O2 -Wall and friends: ok\n"
+    warning = "some/source/file.c:10: warning: unused variable 'x'\n"
+    count = megabytes * 1024 * 1024 / len(line)
+    for i in xrange(count / 10):
+        lf.addStdout(line * 9 + warning)
+    lf.finish()
+    return lf
+
+def load_log(basedir, picklefile):
+    lf = cPickle.load(open(picklefile, "rb"))
+    lf.step = mock.Mock()
+    lf.step.build.builder.basedir = basedir
+    return lf
+
+def scan_getText(lf):
+    warnings = 0
+    for line in lf.getText().split("\n"):
+        if warning_re.match(line):
+            warnings += 1
+    return warnings
+
+def scan_iterLines(lf):
+    warnings = 0
+    for line in lf.iterLines():
+        if warning_re.match(line):
+            warnings += 1
+    return warnings
+
+def child(method, basedir, picklefile):
+    lf = load_log(basedir, picklefile)
+    base = maxrss()
+    start = time.time()
+    warnings = globals()['scan_' + method](lf)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    print "%-9s %6d warnings; peak RSS growth %7.1f MB; %6.2fs" % (
+            method, warnings, (maxrss() - base) / 1024.0, elapsed)
+
+def main():
+    if sys.argv[1:2] == [ "--child" ]:
+        return child(*sys.argv[2:5])
+
+    megabytes = int((sys.argv[1:2] or [ 200 ])[0])
+    basedir = tempfile.mkdtemp()
+    try:
+        lf = make_log(basedir, megabytes)
+        print "%d MB log" % (os.path.getsize(lf.getFilename()) >> 20)
+        picklefile = os.path.join(basedir, "log.pickle")
+        cPickle.dump(lf, open(picklefile, "wb"))
+        for method in [ "getText", "iterLines" ]:
+            subprocess.call([ sys.executable, __file__, "--child", method,
+                              basedir, picklefile ])
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
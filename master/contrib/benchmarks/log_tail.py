@@ -0,0 +1,99 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the wall time needed to read the last 100 lines, and a 4KB range of
+text from the middle, of a large logfile by scanning the whole log (as the web
+status used to do) and by using the log's chunk index, both before and after
+the log is compressed.
+
+Usage: python log_tail.py [megabytes [method]]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import mock
+from buildbot.status import logfile
+
+def make_log(basedir, megabytes):
+    step = mock.Mock()
+    step.build.builder.basedir = basedir
+    lf = logfile.LogFile(step, 'log', '1-log-compile')
+    line = "compiling some/source/file.c with -O2 -Wall and friends: ok\n"
+    count = megabytes * 1024 * 1024 / len(line)
+    for i in xrange(count / 10):
+        lf.addStdout(line * 10)
+        if i % 1000 == 0:
+            lf.addHeader("checkpoint %d\n" % i)
+    lf.finish()
+    return lf
+
+def scan_tail(lf, lines):
+    return "".join(lf.getText().splitlines(True)[-lines:])
+
+def indexed_tail(lf, lines):
+    return "".join([ text for channel, text in lf.getTail(lines)
+                     if channel in logfile.TEXT_CHANNELS ])
+
+def scan_range(lf, start, end):
+    return lf.getText()[start:end]
+
+def indexed_range(lf, start, end):
+    return "".join(lf.getTextRange(start, end))
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+def measure(lf, label):
+    length = lf.getTextLength()
+    start = length / 2
+    a, scan_t = timed(scan_tail, lf, 100)
+    b, idx_t = timed(indexed_tail, lf, 100)
+    assert a == b
+    print "%-12s tail: scan %8.3fs; indexed %8.4fs" % (label, scan_t, idx_t)
+    a, scan_t = timed(scan_range, lf, start, start + 4096)
+    b, idx_t = timed(indexed_range, lf, start, start + 4096)
+    assert a == b
+    print "%-12s range: scan %7.3fs; indexed %8.4fs" % (label, scan_t, idx_t)
+
+def main():
+    megabytes = int((sys.argv[1:2] or [ 50 ])[0])
+    method = (sys.argv[2:3] or [ "bz2" ])[0]
+    basedir = tempfile.mkdtemp()
+    try:
+        lf = make_log(basedir, megabytes)
+        print "%d MB log" % (os.path.getsize(lf.getFilename()) >> 20)
+        measure(lf, "uncompressed")
+        # run the compression synchronously
+        lf.compressMethod = method
+        compressed = (lf.getFilename() +
+                      logfile.COMPRESSION_METHODS[method][0] + ".tmp")
+        logfile.compressLogFile(lf.getFilename(), compressed, method,
+                                lf.frameSize)
+        lf._renameCompressedLog(None, compressed)
+        measure(lf, method)
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the wall time needed by Builder._mergeRequests to hand out a queue of
+pending build requests to a number of slaves, using the default merge function
+(which groups requests by merge key) and an equivalent user-supplied function
+(which is called pairwise).
+
+Usage: python merge_requests.py [requests [slaves [revisions]]]
+"""
+
+import sys
+import time
+
+import mock
+from twisted.internet import defer
+from buildbot.process import builder, buildrequest
+from buildbot.sourcestamp import SourceStamp
+
+def make_builder():
+    config = dict(name="bldr", slavename="slv", builddir="bdir",
+                 slavebuilddir="sbdir", factory=mock.Mock())
+    return builder.Builder(config, mock.Mock())
+
+def make_brdicts(count, revisions):
+    brdicts = []
+    for i in xrange(count):
+        brobj = buildrequest.BuildRequest()
+        brobj.id = i
+        brobj.source = SourceStamp(branch='master', project='p',
+                repository='r', revision='%040x' % (i % revisions))
+        brdict = dict(brid=i, brobj=brobj)
+        brobj.brdict = brdict
+        brdicts.append(brdict)
+    return brdicts
+
+def hand_out(bldr, brdicts, slaves, mergeRequests_fn):
+    # emulate the loop in maybeStartBuild, one merge per slave
+    unclaimed = list(brdicts)
+    merged = 0
+    for _ in xrange(slaves):
+        if not unclaimed:
+            break
+        results = []
+        d = bldr._mergeRequests(unclaimed[0], unclaimed, mergeRequests_fn)
+        d.addCallback(results.append)
+        assert results, "fake data should never block"
+        for brdict in results[0]:
+            unclaimed.remove(brdict)
+            merged += 1
+    return merged
+
+def pairwise(bldr, breq, other):
+    return breq.canBeMergedWith(other)
+
+def main():
+    args = [ int(a) for a in sys.argv[1:] ]
+    count, slaves, revisions = (args + [ 1000, 50, 200 ][len(args):])[:3]
+    bldr = make_builder()
+
+    for name, fn in [ ('pairwise', pairwise),
+                      ('keyed', buildrequest.BuildRequest.canBeMergedWith) ]:
+        brdicts = make_brdicts(count, revisions)
+        start = time.time()
+        merged = hand_out(bldr, brdicts, slaves, fn)
+        print ("%-8s %6d requests, %4d slaves: %6d merged in %8.3fs"
+                % (name, count, slaves, merged, time.time() - start))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the wall time for Nightly.getNextBuildTime to find the next build time
+of a few schedules, with the minute-by-minute search that it used to do and
+with the current implementation.  Each schedule is computed from the start of
+every day of 2011, as happens when a scheduler is reconfigured or actuated.
+
+Usage: python nightly.py [days]
+"""
+
+import sys
+import time
+
+from buildbot.schedulers import timed
+
+SCHEDULES = [
+    ('every hour', dict(minute=0)),
+    ('daily 03:00', dict(hour=3, minute=0)),
+    ('weekly Sun 03:00', dict(dayOfWeek=6, hour=3, minute=0)),
+    ('1st and 15th', dict(dayOfMonth=[1, 15], hour=3, minute=0)),
+    ('Feb 29 03:00', dict(month=2, dayOfMonth=29, hour=3, minute=0)),
+]
+
+def brute_force(sched, lastActuated):
+    # the previous implementation of Nightly.getNextBuildTime
+    def addTime(timetuple, secs):
+        return time.localtime(time.mktime(timetuple)+secs)
+    def check(ourvalue, value):
+        if ourvalue == '*': return True
+        if isinstance(ourvalue, int): return value == ourvalue
+        return (value in ourvalue)
+    dateTime = time.localtime(lastActuated)
+    dateTime = addTime(dateTime, 60-dateTime[5])
+    def isRunTime(timetuple):
+        if not check(sched.minute, timetuple[4]): return False
+        if not check(sched.hour, timetuple[3]): return False
+        if not check(sched.month, timetuple[1]): return False
+        if sched.dayOfMonth != '*' and sched.dayOfWeek != '*':
+            if not (check(sched.dayOfMonth, timetuple[2]) or
+                    check(sched.dayOfWeek, timetuple[6])):
+                return False
+        else:
+            if not check(sched.dayOfMonth, timetuple[2]): return False
+            if not check(sched.dayOfWeek, timetuple[6]): return False
+        return True
+    while not isRunTime(dateTime):
+        dateTime = addTime(dateTime, 60)
+    return time.mktime(dateTime)
+
+def current(sched, lastActuated):
+    result = []
+    sched.getNextBuildTime(lastActuated).addCallback(result.append)
+    return result[0]
+
+def main():
+    days = int((sys.argv[1:2] or [ 365 ])[0])
+    starts = [ time.mktime((2011, 1, 1 + d, 12, 34, 56, 0, 0, -1))
+               for d in range(days) ]
+    for label, kwargs in SCHEDULES:
+        sched = timed.Nightly(name='bench', builderNames=['b'], branch=None,
+                              **kwargs)
+        results = {}
+        for name, fn in [ ('brute force', brute_force),
+                          ('current', current) ]:
+            start = time.time()
+            results[name] = [ fn(sched, t) for t in starts ]
+            elapsed = time.time() - start
+            print "%-17s %-12s %8.2f ms/call" % (label, name,
+                                                 elapsed / days * 1000)
+        assert results['brute force'] == results['current']
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Measure how long AnyBranchSchedulers with a treeStableTimer take to restore
+their stable timers at startup, when each has many classified but unbuilt
+changes: fetching each change and calling gotChange for it (which writes
+the classification again), as scanExistingClassifiedChanges used to do, and
+fetching the changes in bulk and starting the timers directly.
+
+Usage: python scheduler_restart.py [db_url [changes [schedulers]]]
+
+The default db_url is a SQLite database in a temporary directory; any URL
+accepted by the buildmaster (e.g., postgres://...) can be given instead, but
+its changes and scheduler_changes tables will be overwritten.
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+import mock
+from twisted.internet import defer, reactor
+from buildbot.db import connector
+from buildbot.process import cache
+from buildbot.changes import changes
+from buildbot.schedulers import basic
+
+BRANCHES = 10
+
+class OneByOneScheduler(basic.AnyBranchScheduler):
+    # scanExistingClassifiedChanges and gotChange as they were before the
+    # bulk restore
+    @defer.deferredGenerator
+    def scanExistingClassifiedChanges(self):
+        wfd = defer.waitForDeferred(
+            self.master.db.schedulers.getChangeClassifications(
+                                                        self.schedulerid))
+        yield wfd
+        classifications = wfd.getResult()
+        for changeid, important in classifications.iteritems():
+            wfd = defer.waitForDeferred(
+                self.master.db.changes.getChange(changeid))
+            yield wfd
+            chdict = wfd.getResult()
+            if not chdict:
+                continue
+            wfd = defer.waitForDeferred(
+                changes.Change.fromChdict(self.master, chdict))
+            yield wfd
+            change = wfd.getResult()
+            wfd = defer.waitForDeferred(self.gotChange(change, important))
+            yield wfd
+            wfd.getResult()
+
+    def gotChange(self, change, important):
+        db = self.master.db
+        timer_name = self.getTimerNameForChange(change)
+        d = db.pool.do(lambda conn :
+                db.schedulers._writeClassificationsOneByOne(conn,
+                    [ (self.schedulerid, change.number, important) ]))
+        def fix_timer(_):
+            if not important and not self._stable_timers[timer_name]:
+                return
+            self._startStableTimer(timer_name)
+        d.addCallback(fix_timer)
+        return d
+
+def make_db(db_url, basedir):
+    master = mock.Mock()
+    master.caches = cache.CacheManager()
+    master.db = connector.DBConnector(master, db_url, basedir)
+    return master
+
+@defer.deferredGenerator
+def setup_db(db, count, schedulerids):
+    def thd(conn):
+        conn.execute(db.model.scheduler_changes.delete())
+        conn.execute(db.model.changes.delete())
+        conn.execute(db.model.changes.insert(), [
+            dict(changeid=i, author='me', comments='', is_dir=0,
+                 branch='branch%d' % (i % BRANCHES), revision='rev%d' % i,
+                 revlink='', when_timestamp=1300000000 + i, category='',
+                 repository='', project='')
+            for i in xrange(1, count + 1) ])
+        conn.execute(db.model.scheduler_changes.insert(), [
+            dict(schedulerid=schedulerid, changeid=i, important=i % 3 != 0)
+            for schedulerid in schedulerids
+            for i in xrange(1, count + 1) ])
+    wfd = defer.waitForDeferred(db.pool.do(thd))
+    yield wfd
+    wfd.getResult()
+
+@defer.deferredGenerator
+def run(db_url, count, nscheds):
+    basedir = tempfile.mkdtemp()
+    try:
+        for name, klass in [ ('one by one', OneByOneScheduler),
+                             ('bulk', basic.AnyBranchScheduler) ]:
+            master = make_db(db_url, basedir)
+            db = master.db
+            wfd = defer.waitForDeferred(
+                db.pool.do_with_engine(db.model.metadata.create_all))
+            yield wfd
+            wfd.getResult()
+
+            scheds = []
+            for i in range(nscheds):
+                sched = klass(name='sched%d' % i, treeStableTimer=3600,
+                              builderNames=['b'])
+                sched.master = master
+                wfd = defer.waitForDeferred(
+                    db.schedulers.getSchedulerId(sched.name, 'bench'))
+                yield wfd
+                sched.schedulerid = wfd.getResult()
+                scheds.append(sched)
+            wfd = defer.waitForDeferred(
+                setup_db(db, count, [ s.schedulerid for s in scheds ]))
+            yield wfd
+            wfd.getResult()
+
+            start = time.time()
+            wfd = defer.waitForDeferred(defer.gatherResults([
+                s.scanExistingClassifiedChanges() for s in scheds ]))
+            yield wfd
+            wfd.getResult()
+            elapsed = time.time() - start
+
+            timers = 0
+            for sched in scheds:
+                for timer in sched._stable_timers.values():
+                    if timer:
+                        timers += 1
+                        timer.cancel()
+            assert timers == nscheds * min(count, BRANCHES)
+            print ("%-10s %3d schedulers, %5d changes each: %7.2fs"
+                   % (name, nscheds, count, elapsed))
+            db.pool.shutdown()
+    finally:
+        shutil.rmtree(basedir)
+
+def main():
+    db_url = len(sys.argv) > 1 and sys.argv[1] or 'sqlite:///state.sqlite'
+    count = len(sys.argv) > 2 and int(sys.argv[2]) or 2000
+    nscheds = len(sys.argv) > 3 and int(sys.argv[3]) or 10
+    d = run(db_url, count, nscheds)
+    d.addErrback(lambda f : f.printTraceback())
+    d.addBoth(lambda _ : reactor.stop())
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
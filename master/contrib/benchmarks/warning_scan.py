@@ -0,0 +1,108 @@
+#! /usr/bin/python
+
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+"""
+Compare the longest time the reactor is kept busy by
+WarningCountingShellCommand when scanning a large compile log for warnings
+after the command finishes (the default) and as the output arrives
+(incrementalWarnings=True).  Output is fed to a real LogFile in chunks the
+size of a slave update, and the longest single call -- either one chunk, or
+createSummary -- is reported.
+
+Usage: python warning_scan.py [megabytes]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+
+import mock
+from buildbot.status import logfile
+from buildbot.steps import shell
+
+CHUNK_SIZE = 10 * 1024
+
+def make_chunks(megabytes):
+    line = "compiling some/source/file.c with -O2 -Wall and friends: ok\n"
+    warning = "some/source/file.c:10: warning: unused variable 'x'\n"
+    block = line * 9 + warning
+    per_chunk = CHUNK_SIZE / len(block) + 1
+    chunk = block * per_chunk
+    return [ chunk ] * (megabytes * 1024 * 1024 / len(chunk))
+
+class StepStatus(object):
+    # a plain object, since a mock would record every call
+    def __init__(self):
+        self.statistics = {}
+        self.logs = []
+    def getStatistic(self, name, default=None):
+        return self.statistics.get(name, default)
+    def setStatistic(self, name, value):
+        self.statistics[name] = value
+    def setText(self, text):
+        pass
+    def getLogs(self):
+        return self.logs
+
+def make_step(basedir, incremental):
+    step = shell.WarningCountingShellCommand(command=['make'],
+                    incrementalWarnings=incremental)
+    step.build = mock.Mock()
+    step.build.builder.basedir = basedir
+    step.build.getProperty.side_effect = KeyError
+    step.progress = None
+    step.step_status = StepStatus()
+    step.addCompleteLog = lambda name, text : None
+    return step
+
+def run(basedir, chunks, incremental):
+    step = make_step(basedir, incremental)
+    lf = logfile.LogFile(step, 'stdio', '1-log-stdio-%d' % incremental)
+    step.step_status.logs.append(lf)
+    step._connectPendingLogObservers()
+    if incremental:
+        step.startWarningScan()
+
+    longest_chunk = 0
+    for chunk in chunks:
+        start = time.time()
+        lf.addStdout(chunk)
+        longest_chunk = max(longest_chunk, time.time() - start)
+    lf.finish()
+
+    start = time.time()
+    step.createSummary(lf)
+    summary = time.time() - start
+
+    mode = incremental and "incremental" or "post-hoc"
+    print ("%-11s %6d warnings; longest chunk %7.4fs; createSummary %7.4fs; "
+           "longest stall %7.4fs" % (mode, step.warnCount, longest_chunk,
+                                     summary, max(longest_chunk, summary)))
+
+def main():
+    megabytes = int((sys.argv[1:2] or [ 100 ])[0])
+    chunks = make_chunks(megabytes)
+    basedir = tempfile.mkdtemp()
+    try:
+        for incremental in [ False, True ]:
+            run(basedir, chunks, incremental)
+    finally:
+        shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    main()
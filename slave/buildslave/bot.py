@@ -20,7 +20,7 @@ import signal
 
 from twisted.spread import pb
 from twisted.python import log
-from twisted.internet import error, reactor, task
+from twisted.internet import error, reactor, task, defer
 from twisted.application import service, internet
 from twisted.cred import credentials
 
@@ -32,6 +32,190 @@ from buildslave import monkeypatches
 class UnknownCommand(pb.Error):
     pass
 
+class UpdateBatcher(object):
+    """
+    I send status updates to a master-side step, packing several updates into
+    each C{update} call.  Updates are held for at most L{MAX_DELAY} seconds,
+    or until L{MAX_BATCH_SIZE} bytes are pending, and at most
+    L{MAX_OUTSTANDING} calls are unacknowledged at any time; further updates
+    wait, and are sent together, once the master catches up.
+
+    If more than L{PAUSE_SIZE} bytes are waiting, I pause the registered
+    producer (see L{registerProducer}), and resume it once acknowledgements
+    have brought the backlog below L{RESUME_SIZE}.
+    """
+
+    MAX_BATCH_SIZE = 128*1024
+    """approximate maximum size, in bytes, of the updates sent in one call"""
+
+    MAX_DELAY = 0.2
+    """maximum time, in seconds, to hold an update before sending it, unless
+    the master has too many unacknowledged calls"""
+
+    MAX_OUTSTANDING = 2
+    """maximum number of unacknowledged calls to the master"""
+
+    PAUSE_SIZE = 4*MAX_BATCH_SIZE
+    """approximate number of waiting bytes above which the producer is
+    paused"""
+
+    RESUME_SIZE = MAX_BATCH_SIZE
+    """approximate number of waiting bytes below which a paused producer is
+    resumed"""
+
+    # for testing
+    _reactor = reactor
+
+    def __init__(self, remoteStep, ackUpdate):
+        """
+        @param remoteStep: reference to the master-side step
+        @param ackUpdate: callable to invoke with the result of each
+                          acknowledged call
+        """
+        self.remoteStep = remoteStep
+        self.ackUpdate = ackUpdate
+        self.pending = []
+        self.pendingSize = 0
+        self.outstanding = 0
+        self.due = False
+        self.timer = None
+        self.flushWaiters = []
+        self.producer = None
+        self.producerPaused = False
+
+    def registerProducer(self, producer):
+        """
+        Register the source of the updates, which will be paused while the
+        master falls behind.
+
+        @param producer: object with C{pauseProducing} and C{resumeProducing}
+                         methods
+        """
+        self.unregisterProducer()
+        self.producer = producer
+        self._checkPause()
+
+    def unregisterProducer(self):
+        """Forget the registered producer, resuming it if it is paused."""
+        producer, self.producer = self.producer, None
+        if producer and self.producerPaused:
+            self.producerPaused = False
+            producer.resumeProducing()
+        self.producerPaused = False
+
+    def add(self, data):
+        """Queue an update for sending."""
+        # the update[1]=0 comes from the leftover 'updateNum', which the
+        # master still expects to receive. Provide it to avoid significant
+        # interoperability issues between new slaves and old masters.
+        self.pending.append([data, 0])
+        self.pendingSize += _updateSize(data)
+        if self.due or self.pendingSize >= self.MAX_BATCH_SIZE:
+            self._send()
+        elif not self.timer:
+            self.timer = self._reactor.callLater(self.MAX_DELAY,
+                                                 self._timeout)
+        self._checkPause()
+
+    def flush(self):
+        """
+        Send all pending updates immediately.
+
+        @returns: Deferred that fires when all updates have been acknowledged
+        """
+        d = defer.Deferred()
+        self.flushWaiters.append(d)
+        self.due = True
+        self._send()
+        self._checkFlushed()
+        return d
+
+    def stop(self):
+        """Discard any pending updates, e.g., because the master-side step is
+        gone."""
+        self.pending = []
+        self.pendingSize = 0
+        self.remoteStep = None
+        self._cancelTimer()
+        self.outstanding = 0
+        self.unregisterProducer()
+        self._checkFlushed()
+
+    def _timeout(self):
+        self.timer = None
+        self.due = True
+        self._send()
+
+    def _cancelTimer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _send(self):
+        while (self.pending and self.remoteStep
+               and self.outstanding < self.MAX_OUTSTANDING):
+            # take at least one update, and then as many as fit in a batch
+            size = _updateSize(self.pending[0][0])
+            count = 1
+            while count < len(self.pending):
+                nextSize = _updateSize(self.pending[count][0])
+                if size + nextSize > self.MAX_BATCH_SIZE:
+                    break
+                size += nextSize
+                count += 1
+            batch = self.pending[:count]
+            del self.pending[:count]
+            self.pendingSize -= size
+
+            self.outstanding += 1
+            d = self.remoteStep.callRemote("update", batch)
+            d.addCallback(self.ackUpdate)
+            d.addErrback(self._ackFailed)
+            d.addCallback(self._acked)
+        if not self.pending:
+            self.due = False
+            self._cancelTimer()
+
+    def _ackFailed(self, why):
+        log.msg("UpdateBatcher._ackFailed")
+        log.err(why) # we don't really care
+
+    def _acked(self, _):
+        if self.remoteStep is None:
+            return # stopped
+        self.outstanding -= 1
+        if self.due or self.pendingSize >= self.MAX_BATCH_SIZE:
+            self._send()
+        self._checkPause()
+        self._checkFlushed()
+
+    def _checkPause(self):
+        if not self.producer:
+            return
+        if not self.producerPaused and self.pendingSize > self.PAUSE_SIZE:
+            self.producerPaused = True
+            self.producer.pauseProducing()
+        elif self.producerPaused and self.pendingSize < self.RESUME_SIZE:
+            self.producerPaused = False
+            self.producer.resumeProducing()
+
+    def _checkFlushed(self):
+        if self.pending or self.outstanding:
+            return
+        waiters, self.flushWaiters = self.flushWaiters, []
+        for d in waiters:
+            d.callback(None)
+
+def _updateSize(value):
+    # rough size, in bytes, of the data in an update
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum([ _updateSize(v) for v in value ])
+    if isinstance(value, dict):
+        return sum([ _updateSize(v) for v in value.itervalues() ])
+    return 8
+
 class SlaveBuilder(pb.Referenceable, service.Service):
 
     """This is the local representation of a single Builder: it handles a
@@ -54,6 +238,9 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # .updates is the UpdateBatcher sending status updates to .remoteStep
+    updates = None
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
@@ -104,6 +291,9 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        if self.updates:
+            self.updates.stop()
+            self.updates = None
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -138,6 +328,7 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         log.msg(" startCommand:%s [id %s]" % (command,stepId))
         self.remoteStep = stepref
         self.remoteStep.notifyOnDisconnect(self.lostRemoteStep)
+        self.updates = UpdateBatcher(stepref, self.ackUpdate)
         d = self.command.doStart()
         d.addCallback(lambda res: None)
         d.addBoth(self.commandComplete)
@@ -169,25 +360,28 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # sendUpdate is invoked by the Commands we spawn
     def sendUpdate(self, data):
         """This sends the status update to the master-side
-        L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        L{buildbot.process.step.RemoteCommand} object.  Updates are queued in
+        an L{UpdateBatcher}, which sends them to the master in batches and
+        waits for the master to acknowledge each batch."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
-        # the update[1]=0 comes from the leftover 'updateNum', which the
-        # master still expects to receive. Provide it to avoid significant
-        # interoperability issues between new slaves and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
-            d.addCallback(self.ackUpdate)
-            d.addErrback(self._ackFailed, "SlaveBuilder.sendUpdate")
+            self.updates.add(data)
+
+    def registerProducer(self, producer):
+        """Register the source of the current command's updates, which will
+        be paused while the master falls behind; see
+        L{UpdateBatcher.registerProducer}."""
+        if self.updates:
+            self.updates.registerProducer(producer)
+
+    def unregisterProducer(self):
+        if self.updates:
+            self.updates.unregisterProducer()
 
     def ackUpdate(self, acknum):
         self.activity() # update the "last activity" timer
@@ -217,11 +411,16 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
-            self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
-            d = self.remoteStep.callRemote("complete", failure)
+            remoteStep = self.remoteStep
+            remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
+            # send any remaining updates before the completion
+            self.updates.unregisterProducer()
+            d = self.updates.flush()
+            d.addCallback(lambda _ : remoteStep.callRemote("complete", failure))
             d.addCallback(self.ackComplete)
             d.addErrback(self._ackFailed, "sendComplete")
             self.remoteStep = None
+            self.updates = None
 
 
     def remote_shutdown(self):
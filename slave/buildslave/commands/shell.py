@@ -46,6 +46,10 @@ class SlaveShellCommand(base.Command):
                         watched just like 'tail -f', and all changes will be
                         written to 'log' status updates.
         - ['logEnviron']: False to not log the environment variables on the slave
+        - ['bufferTimeout']: longest time, in seconds, to hold output before
+                             sending it to the master
+        - ['maxBufferSize']: largest amount of output, in bytes, to collect
+                             before sending it to the master
 
     ShellCommand creates the following status messages:
         - {'stdout': data} : when stdout data is available
@@ -75,6 +79,8 @@ class SlaveShellCommand(base.Command):
                          logfiles=args.get('logfiles', {}),
                          usePTY=args.get('usePTY', "slave-config"),
                          logEnviron=args.get('logEnviron', True),
+                         bufferTimeout=args.get('bufferTimeout'),
+                         maxBufferSize=args.get('maxBufferSize'),
                          )
         c._reactor = self._reactor
         self.command = c
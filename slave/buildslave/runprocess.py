@@ -26,6 +26,7 @@ import subprocess
 import traceback
 import stat
 from collections import deque
+from cStringIO import StringIO
 
 from twisted.python import runtime, log
 from twisted.internet import reactor, defer, protocol, task, error
@@ -210,12 +211,19 @@ class RunProcess:
     notreally = False
     BACKUP_TIMEOUT = 5
     KILL = "KILL"
-    CHUNK_LIMIT = 128*1024
 
-    # Don't send any data until at least BUFFER_SIZE bytes have been collected
-    # or BUFFER_TIMEOUT elapsed
-    BUFFER_SIZE = 64*1024
-    BUFFER_TIMEOUT = 5
+    # limit the size of each message we send over PB, since it has a
+    # hardwired string-size limit of 640k
+    CHUNK_LIMIT = 512*1024
+
+    # Output is collected until the current buffer size has been collected,
+    # or the buffer timeout elapses.  The buffer size adapts to the
+    # output: it doubles, up to maxBufferSize, each time it fills, and halves,
+    # down to BUFFER_SIZE, each time the timeout elapses first.  So a trickle
+    # of output is sent promptly, while bursts are sent in large messages.
+    BUFFER_SIZE = 16*1024
+    MAX_BUFFER_SIZE = CHUNK_LIMIT
+    BUFFER_TIMEOUT = 0.25
 
     # For sending elapsed time:
     startTime = None
@@ -235,7 +243,7 @@ class RunProcess:
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdout=False, keepStderr=False,
                  logEnviron=True, logfiles={}, usePTY="slave-config",
-                 useProcGroup=True):
+                 useProcGroup=True, bufferTimeout=None, maxBufferSize=None):
         """
 
         @param keepStdout: if True, we keep a copy of all the stdout text
@@ -249,6 +257,13 @@ class RunProcess:
 
         @param useProcGroup: (default True) use a process group for non-PTY
             process invocations
+
+        @param bufferTimeout: longest time, in seconds, to hold output before
+            sending it; defaults to BUFFER_TIMEOUT
+
+        @param maxBufferSize: largest amount of output, in bytes, to collect
+            before sending it; defaults to MAX_BUFFER_SIZE, and cannot exceed
+            CHUNK_LIMIT
         """
 
         self.builder = builder
@@ -318,10 +333,22 @@ class RunProcess:
         self.keepStdout = keepStdout
         self.keepStderr = keepStderr
 
+        # one buffer for each stream, and a list of [logname, length] for
+        # each run of output on the same stream, in order
+        self.streams = {}
         self.buffered = deque()
         self.buflen = 0
         self.buftimer = None
 
+        if bufferTimeout is None:
+            bufferTimeout = self.BUFFER_TIMEOUT
+        self.bufferTimeout = bufferTimeout
+        if maxBufferSize is None:
+            maxBufferSize = self.MAX_BUFFER_SIZE
+        self.maxBufferSize = min(maxBufferSize, self.CHUNK_LIMIT)
+        self.minBufferSize = min(self.BUFFER_SIZE, self.maxBufferSize)
+        self.bufferSize = self.minBufferSize
+
         if usePTY == "slave-config":
             self.usePTY = self.builder.usePTY
         else:
@@ -497,6 +524,9 @@ class RunProcess:
                                  self.workdir,
                                  usePTY=self.usePTY)
 
+        # stop reading the process's output while the master is behind
+        self.builder.registerProducer(self)
+
         # set up timeouts
 
         if self.timeout:
@@ -525,87 +555,54 @@ class RunProcess:
 
     def _chunkForSend(self, data):
         """
-        limit the chunks that we send over PB to 128k, since it has a hardwired
-        string-size limit of 640k.
+        limit the chunks that we send over PB to CHUNK_LIMIT, since it has a
+        hardwired string-size limit of 640k.
         """
         LIMIT = self.CHUNK_LIMIT
         for i in range(0, len(data), LIMIT):
             yield data[i:i+LIMIT]
 
-    def _collapseMsg(self, msg):
+    def _sendMessage(self, logname, data):
         """
-        Take msg, which is a dictionary of lists of output chunks, and
-        concatentate all the chunks into a single string
+        Send data for a single log to the master
         """
-        retval = {}
-        for log in msg:
-            data = "".join(msg[log])
-            if isinstance(log, tuple) and log[0] == 'log':
-                retval['log'] = (log[1], data)
-            else:
-                retval[log] = data
-        return retval
-
-    def _sendMessage(self, msg):
-        """
-        Collapse and send msg to the master
-        """
-        if not msg:
-            return
-        msg = self._collapseMsg(msg)
-        self.sendStatus(msg)
+        if isinstance(logname, tuple) and logname[0] == 'log':
+            self.sendStatus({'log': (logname[1], data)})
+        else:
+            self.sendStatus({logname: data})
 
     def _bufferTimeout(self):
         self.buftimer = None
+        # the output is slow, so send it sooner next time
+        self.bufferSize = max(self.bufferSize / 2, self.minBufferSize)
         self._sendBuffers()
 
     def _sendBuffers(self):
         """
         Send all the content in our buffers.
         """
-        msg = {}
-        msg_size = 0
-        lastlog = None
-        logdata = []
-        while self.buffered:
-            # Grab the next bits from the buffer
-            logname, data = self.buffered.popleft()
-
-            # If this log is different than the last one, then we have to send
-            # out the message so far.  This is because the message is
-            # transferred as a dictionary, which makes the ordering of keys
-            # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
-            # On our first pass through this loop lastlog is None
-            if lastlog is None:
-                lastlog = logname
-            elif logname != lastlog:
-                self._sendMessage(msg)
-                msg = {}
-                msg_size = 0
-            lastlog = logname
-
-            logdata = msg.setdefault(logname, [])
-
-            # Chunkify the log data to make sure we're not sending more than
-            # CHUNK_LIMIT at a time
-            for chunk in self._chunkForSend(data):
-                if len(chunk) == 0: continue
-                logdata.append(chunk)
-                msg_size += len(chunk)
-                if msg_size >= self.CHUNK_LIMIT:
-                    # We've gone beyond the chunk limit, so send out our
-                    # message.  At worst this results in a message slightly
-                    # larger than (2*CHUNK_LIMIT)-1
-                    self._sendMessage(msg)
-                    msg = {}
-                    logdata = msg.setdefault(logname, [])
-                    msg_size = 0
+        # The data from different logs is sent in separate messages, in the
+        # order it arrived.  This is because the message is transferred as a
+        # dictionary, which makes the ordering of keys unspecified, and makes
+        # it impossible to interleave data from different logs.
+        values = {}
+        for logname, stream in self.streams.iteritems():
+            if stream.tell():
+                values[logname] = stream.getvalue()
+                # reuse the buffer
+                stream.reset()
+                stream.truncate()
+        offsets = {}
+        buffered, self.buffered = self.buffered, deque()
         self.buflen = 0
-        if logdata:
-            self._sendMessage(msg)
+        for logname, length in buffered:
+            data = values[logname]
+            start = offsets.get(logname, 0)
+            offsets[logname] = start + length
+            if start != 0 or length != len(data):
+                data = data[start:start+length]
+            for chunk in self._chunkForSend(data):
+                self._sendMessage(logname, chunk)
         if self.buftimer:
             if self.buftimer.active():
                 self.buftimer.cancel()
@@ -614,18 +611,33 @@ class RunProcess:
     def _addToBuffers(self, logname, data):
         """
         Add data to the buffer for logname
-        Start a timer to send the buffers if BUFFER_TIMEOUT elapses.
-        If adding data causes the buffer size to grow beyond BUFFER_SIZE, then
-        the buffers will be sent.
+        Start a timer to send the buffers if the buffer timeout elapses.
+        If adding data fills the current buffer size, then the buffers will
+        be sent.
         """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
         n = len(data)
+        if not n:
+            return
+
+        stream = self.streams.get(logname)
+        if stream is None:
+            stream = self.streams[logname] = StringIO()
+        stream.write(data)
+        if self.buffered and self.buffered[-1][0] == logname:
+            self.buffered[-1][1] += n
+        else:
+            self.buffered.append([logname, n])
 
         self.buflen += n
-        self.buffered.append((logname, data))
-        if self.buflen > self.BUFFER_SIZE:
+        if self.buflen >= self.bufferSize:
+            # the output is fast, so collect more of it next time
+            self.bufferSize = min(self.bufferSize * 2, self.maxBufferSize)
             self._sendBuffers()
         elif not self.buftimer:
-            self.buftimer = self._reactor.callLater(self.BUFFER_TIMEOUT, self._bufferTimeout)
+            self.buftimer = self._reactor.callLater(self.bufferTimeout,
+                                                    self._bufferTimeout)
 
     def addStdout(self, data):
         if self.sendStdout:
@@ -652,6 +664,7 @@ class RunProcess:
             self.timer.reset(self.timeout)
 
     def finished(self, sig, rc):
+        self.builder.unregisterProducer()
         self.elapsedTime = util.now(self._reactor) - self.startTime
         log.msg("command finished with signal %s, exit code %s, elapsedTime: %0.6f" % (sig,rc,self.elapsedTime))
         for w in self.logFileWatchers:
@@ -683,6 +696,7 @@ class RunProcess:
             log.msg("Hey, command %s finished twice" % self)
 
     def failed(self, why):
+        self.builder.unregisterProducer()
         self._sendBuffers()
         log.msg("RunProcess.failed: command failed: %s" % (why,))
         if self.timer:
@@ -701,6 +715,22 @@ class RunProcess:
         else:
             log.msg("Hey, command %s finished twice" % self)
 
+    def pauseProducing(self):
+        # called by the SlaveBuilder when too many updates are waiting to be
+        # sent; the child blocks once its output pipes fill up
+        if self.process:
+            self.process.pauseProducing()
+        # the process is silent because of us, so don't time it out
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def resumeProducing(self):
+        if self.process:
+            self.process.resumeProducing()
+        if self.timeout and not self.timer:
+            self.timer = self._reactor.callLater(self.timeout, self.doTimeout)
+
     def doTimeout(self):
         self.timer = None
         msg = "command timed out: %d seconds without output" % self.timeout
@@ -103,7 +103,8 @@ class FakeRunProcess:
                  sendStdout=True, sendStderr=True, sendRC=True,
                  timeout=None, maxTime=None, initialStdin=None,
                  keepStdout=False, keepStderr=False,
-                 logEnviron=True, logfiles={}, usePTY="slave-config")
+                 logEnviron=True, logfiles={}, usePTY="slave-config",
+                 bufferTimeout=None, maxBufferSize=None)
 
         if not self._expectations:
             raise AssertionError("unexpected instantiation: %s" % (kwargs,))
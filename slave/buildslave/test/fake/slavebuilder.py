@@ -26,12 +26,19 @@ class FakeSlaveBuilder:
         self.updates = []
         self.basedir = basedir
         self.usePTY = usePTY
+        self.producer = None
 
     def sendUpdate(self, data):
         if self.debug:
             print "FakeSlaveBuilder.sendUpdate", data
         self.updates.append(data)
 
+    def registerProducer(self, producer):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
     def show(self):
         return pprint.pformat(self.updates)
 
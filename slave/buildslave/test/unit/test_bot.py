@@ -254,11 +254,12 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(do_start)
         d.addCallback(lambda _ : st.wait_for_finish())
         def check(_):
+            # the updates are sent together
             self.assertEqual(st.actions, [
-                         ['update', [[{'hdr': 'headers'}, 0]]],
-                         ['update', [[{'stdout': 'hello\n'}, 0]]],
-                         ['update', [[{'rc': 0}, 0]]],
-                         ['update', [[{'elapsed': 1}, 0]]],
+                         ['update', [[{'hdr': 'headers'}, 0],
+                                     [{'stdout': 'hello\n'}, 0],
+                                     [{'rc': 0}, 0],
+                                     [{'elapsed': 1}, 0]]],
                          ['complete', None],
                     ])
         d.addCallback(check)
@@ -300,9 +301,9 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(lambda _ : st.wait_for_finish())
         def check(_):
             self.assertEqual(st.actions, [
-                         ['update', [[{'hdr': 'headers'}, 0]]],
-                         ['update', [[{'hdr': 'killing'}, 0]]],
-                         ['update', [[{'rc': -1}, 0]]],
+                         ['update', [[{'hdr': 'headers'}, 0],
+                                     [{'hdr': 'killing'}, 0],
+                                     [{'rc': -1}, 0]]],
                          ['complete', None],
                     ])
         d.addCallback(check)
@@ -332,6 +333,120 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+class TestUpdateBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.calls = []
+        self.acks = []
+        self.remoteStep = mock.Mock()
+        def callRemote(meth, updates):
+            d = defer.Deferred()
+            self.calls.append((meth, [ u[0] for u in updates ], d))
+            return d
+        self.remoteStep.callRemote = callRemote
+        self.batcher = bot.UpdateBatcher(self.remoteStep, self.acks.append)
+        self.batcher._reactor = self.clock
+        self.batcher.MAX_BATCH_SIZE = 10
+
+    def sent(self):
+        return [ updates for (meth, updates, d) in self.calls ]
+
+    def ack(self, i):
+        self.calls[i][2].callback(i)
+
+    def test_held_until_delay(self):
+        self.batcher.add({'hdr' : 'a'})
+        self.batcher.add({'rc' : 0})
+        self.assertEqual(self.sent(), [])
+        self.clock.advance(self.batcher.MAX_DELAY)
+        self.assertEqual(self.sent(), [ [ {'hdr' : 'a'}, {'rc' : 0} ] ])
+        self.assertEqual(self.calls[0][0], 'update')
+        self.ack(0)
+        self.assertEqual(self.acks, [ 0 ])
+        # the timer is not running
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_sent_when_full(self):
+        self.batcher.add({'stdout' : 'abcdef'})
+        self.batcher.add({'stdout' : 'ghijk'})
+        # too big for one batch
+        self.assertEqual(self.sent(), [ [ {'stdout' : 'abcdef'} ],
+                                        [ {'stdout' : 'ghijk'} ] ])
+
+    def test_outstanding_limit(self):
+        for data in [ 'abcdefgh', 'ijklmnop', 'qrstuvwx', 'y', 'z' ]:
+            self.batcher.add({'stdout' : data})
+        # two calls are outstanding, and nothing more is sent
+        self.assertEqual(len(self.calls), 2)
+        self.clock.advance(self.batcher.MAX_DELAY)
+        self.assertEqual(len(self.calls), 2)
+        # an ack lets the waiting updates go, together
+        self.ack(0)
+        self.assertEqual(self.sent()[2:], [ [ {'stdout' : 'qrstuvwx'},
+                                              {'stdout' : 'y'},
+                                              {'stdout' : 'z'} ] ])
+        self.ack(1)
+        self.ack(2)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.batcher.outstanding, 0)
+
+    def test_flush(self):
+        self.batcher.add({'hdr' : 'a'})
+        flushed = []
+        d = self.batcher.flush()
+        d.addCallback(flushed.append)
+        self.assertEqual(self.sent(), [ [ {'hdr' : 'a'} ] ])
+        self.assertEqual(flushed, [])
+        self.ack(0)
+        self.assertEqual(flushed, [ None ])
+
+    def test_flush_empty(self):
+        flushed = []
+        self.batcher.flush().addCallback(flushed.append)
+        self.assertEqual(flushed, [ None ])
+
+    def test_ack_failure(self):
+        self.patch(log, "err", lambda f : None)
+        self.batcher.add({'hdr' : 'a'})
+        self.batcher.flush()
+        self.calls[0][2].errback(failure.Failure(RuntimeError()))
+        self.assertEqual(self.batcher.outstanding, 0)
+
+    def test_stop(self):
+        self.batcher.add({'hdr' : 'a'})
+        self.batcher.stop()
+        self.clock.advance(self.batcher.MAX_DELAY)
+        self.assertEqual(self.sent(), [])
+
+    def test_producer_paused(self):
+        self.batcher.PAUSE_SIZE = 20
+        self.batcher.RESUME_SIZE = 10
+        producer = mock.Mock()
+        self.batcher.registerProducer(producer)
+        for data in [ 'abcdefgh', 'ijklmnop', 'qrstuvwx', 'yz' ]:
+            self.batcher.add({'stdout' : data})
+        self.assertEqual(producer.method_calls, [])
+        # 21 bytes are now waiting for the master
+        self.batcher.add({'stdout' : 'abcdefghijk'})
+        self.assertEqual(producer.method_calls, [ ('pauseProducing', (), {}) ])
+        # the first ack lets 10 bytes go, leaving 11, so still paused
+        self.ack(0)
+        self.assertEqual(producer.method_calls, [ ('pauseProducing', (), {}) ])
+        self.ack(1)
+        self.assertEqual(producer.method_calls, [ ('pauseProducing', (), {}),
+                                                  ('resumeProducing', (), {}) ])
+
+    def test_stop_resumes_producer(self):
+        self.batcher.PAUSE_SIZE = 5
+        producer = mock.Mock()
+        self.batcher.registerProducer(producer)
+        self.batcher.add({'hdr' : 'abcdef'})
+        self.batcher.stop()
+        self.assertEqual(producer.method_calls, [ ('pauseProducing', (), {}),
+                                                  ('resumeProducing', (), {}) ])
+        self.assertEqual(self.batcher.producer, None)
+
 class TestBotFactory(unittest.TestCase):
 
     def setUp(self):
@@ -49,4 +49,21 @@ class TestSlaveShellCommand(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_buffering_args(self):
+        self.make_command(shell.SlaveShellCommand, dict(
+            command=[ 'echo', 'hello' ],
+            workdir='workdir',
+            bufferTimeout=1,
+            maxBufferSize=4096,
+        ))
+
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], self.basedir_workdir,
+                   bufferTimeout=1, maxBufferSize=4096)
+            + { 'rc' : 0 }
+            + 0,
+        )
+
+        return self.run_command()
+
     # TODO: test all functionality that SlaveShellCommand adds atop RunProcess
@@ -164,6 +164,26 @@ class TestRunProcess(BasedirMixin, unittest.TestCase):
         clock.advance(6) # should knock out maxTime
         return d
 
+    def testPauseProducing(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  timeout=5)
+        clock = task.Clock()
+        s._reactor = clock
+        d = s.start()
+        self.assertIdentical(b.producer, s)
+        # while paused, the command does not time out
+        s.pauseProducing()
+        clock.advance(6)
+        s.resumeProducing()
+        def check(ign):
+            self.failUnless({'stdout': nl('hello\n')} in b.updates, b.show())
+            self.failUnless({'rc': 0} in b.updates, b.show())
+            self.failIf({'rc': FATAL_RC} in b.updates, b.show())
+            self.assertEqual(b.producer, None)
+        d.addCallback(check)
+        return d
+
     def test_stdin_closed(self):
         b = FakeSlaveBuilder(False, self.basedir)
         s = runprocess.RunProcess(b,
@@ -512,6 +532,62 @@ class TestLogging(BasedirMixin, unittest.TestCase):
         s._addToBuffers('stdout', data)
         self.failUnlessEqual(len(b.updates), 1)
 
+    def testSendBufferedReused(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._sendBuffers()
+        s._addToBuffers('stdout', 'world')
+        s._addToBuffers('stdout', u'!')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello '},
+                                         {'stdout': 'world!'}])
+
+    def testSendLogfile(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir)
+        s.addLogfile('log1', 'one')
+        s.addLogfile('log2', 'two')
+        s.addLogfile('log1', 'three')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [{'log': ('log1', 'one')},
+                                         {'log': ('log2', 'two')},
+                                         {'log': ('log1', 'three')}])
+
+    def testBufferTimeout(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  bufferTimeout=2)
+        s._reactor = clock = task.Clock()
+        s._addToBuffers('stdout', 'hello')
+        clock.advance(1)
+        self.failUnlessEqual(b.updates, [])
+        clock.advance(1)
+        self.failUnlessEqual(b.updates, [{'stdout': 'hello'}])
+
+    def testAdaptiveBufferSize(self):
+        b = FakeSlaveBuilder(False, self.basedir)
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), self.basedir,
+                                  maxBufferSize=runprocess.RunProcess.BUFFER_SIZE * 4)
+        s._reactor = clock = task.Clock()
+        minSize = runprocess.RunProcess.BUFFER_SIZE
+
+        # a burst of output grows the buffer, up to the maximum
+        for i in range(4):
+            s._addToBuffers('stdout', 'x' * (s.bufferSize + 1))
+        self.failUnlessEqual(len(b.updates), 4)
+        self.failUnlessEqual(s.bufferSize, minSize * 4)
+        s._addToBuffers('stdout', 'x' * (minSize * 2))
+        self.failUnlessEqual(len(b.updates), 4)
+
+        # and a trickle shrinks it again
+        clock.advance(s.bufferTimeout)
+        self.failUnlessEqual(len(b.updates), 5)
+        self.failUnlessEqual(s.bufferSize, minSize * 2)
+        s._addToBuffers('stdout', 'x')
+        clock.advance(s.bufferTimeout)
+        self.failUnlessEqual(s.bufferSize, minSize)
+
 class TestLogFileWatcher(BasedirMixin, unittest.TestCase):
     def setUp(self):
         self.setUpBasedir()